@@ -0,0 +1,68 @@
+import os
+import sys
+from datetime import datetime
+import pytest
+
+# Модули wb_parser импортируют друг друга по имени, как при запуске из каталога wb_parser
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'wb_parser'))
+
+
+@pytest.fixture(autouse=True)
+def fresh_schema_versions():
+    """Версия схемы запоминается по id пула, а id поддельных пулов разных тестов могут совпасть"""
+    import schema
+    schema._versions.clear()
+    yield
+    schema._versions.clear()
+
+
+class FakeClock:
+    """Управляемые часы для подмены time.monotonic/time.time в тестах"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+class FakePool:
+    """
+    Пул ClickHouse для тестов: запоминает запросы и отвечает на них по первому
+    фрагменту из responses, который входит в текст запроса (значение или функция
+    от запроса и параметров). На остальные запросы отвечает пустым результатом
+    """
+
+    def __init__(self, responses=None):
+        self.responses = dict(responses or {})
+        self.queries = []
+
+    def execute(self, query, params=None, **kwargs):
+        self.queries.append((query, params))
+        for fragment, response in self.responses.items():
+            if fragment in query:
+                return response(query, params) if callable(response) else response
+        return []
+
+    def execute_iter(self, query, params=None, **kwargs):
+        yield from self.execute(query, params, **kwargs)
+
+    def executed(self, fragment: str):
+        """Запросы, в тексте которых есть fragment"""
+        return [(query, params) for query, params in self.queries if fragment in query]
+
+
+def snapshot_columns(articles, query='платье', created_at=datetime(2024, 5, 1, 12), scores=True):
+    """Колонки среза в порядке SNAPSHOT_COLUMNS (без оценок — DATA_COLUMNS) с заглушками вместо данных"""
+    from schema import DATA_COLUMNS, SNAPSHOT_COLUMNS
+    rows = len(articles)
+    values = {
+        'articul': list(articles), 'query': [query] * rows, 'created_at': [created_at] * rows,
+        'name': ['name'] * rows, 'brand': ['brand'] * rows, 'promotion': ['no promotion'] * rows,
+        'tp': ['no tp'] * rows, 'promoTextCard': ['no promo'] * rows, 'predicted_conversion': [None] * rows,
+        'position': list(range(1, rows + 1)),
+    }
+    return [values.get(name, [1] * rows) for name in (SNAPSHOT_COLUMNS if scores else DATA_COLUMNS)]
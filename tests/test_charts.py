@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+from matplotlib.axes import Axes
+from charts import ChartRenderer, position_chart_key, render_position_chart
+
+PNG_SIGNATURE = b'\x89PNG'
+
+
+def chart_args(positions, min_positions, max_positions):
+    dates = [datetime(2024, 5, 1) + timedelta(hours=hour) for hour in range(len(positions))]
+    return 42, 'платье', dates, positions, min_positions, max_positions
+
+
+def test_extremes_of_plotted_line_are_annotated(monkeypatch):
+    annotations = []
+    original = Axes.annotate
+    monkeypatch.setattr(Axes, 'annotate', lambda ax, text, *args, **kwargs: (
+        annotations.append((text, kwargs['xy'][1])), original(ax, text, *args, **kwargs))[1])
+
+    png = render_position_chart(*chart_args([10.5, None, 3.25, 7], [1, None, 2, 5], [40, None, 5, 9]))
+
+    assert png.startswith(PNG_SIGNATURE)
+    assert annotations == [('Лучшая: 3.2', 3.25), ('Худшая: 10.5', 10.5)]
+
+
+def test_chart_without_positions_is_rendered():
+    assert render_position_chart(*chart_args([None, None], [None, None], [None, None])).startswith(PNG_SIGNATURE)
+
+
+def test_renderer_draws_in_spawned_process_and_caches():
+    renderer = ChartRenderer(max_workers=1)
+    args = chart_args([5, 4], [3, 4], [6, 4])
+    try:
+        png = renderer.render(position_chart_key(*args), *args).result(timeout=120)
+        assert png.startswith(PNG_SIGNATURE)
+        assert renderer._executor._mp_context.get_start_method() == 'spawn'
+        assert renderer.render(position_chart_key(*args), *args).result() is png
+    finally:
+        renderer.shutdown()
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+import schema
+from conftest import FakePool, snapshot_columns
+from conversion_model import ConversionModel, conversion_target, fit_model, score_snapshot
+from history_frame import HEADERS, clean_history
+from schema import DATA_COLUMNS, SNAPSHOT_COLUMNS
+
+
+def training_frame(rows=40):
+    columns = dict(zip(DATA_COLUMNS, snapshot_columns(list(range(1, rows + 1)), scores=False)))
+    columns['viewFlags'] = [100 + 7 * i for i in range(rows)]
+    columns['number_of_feedbacks'] = list(range(rows))
+    columns['price'] = [1000 + 13 * i % 97 for i in range(rows)]
+    frame, _ = clean_history(columns)
+    return frame
+
+
+def test_target_columns_are_not_accepted_as_features():
+    with pytest.raises(ValueError, match='целевой переменной'):
+        ConversionModel([HEADERS['viewFlags']], np.zeros(1), np.ones(1), np.zeros(1), 0.0)
+
+
+def test_fitted_model_survives_save_and_load(tmp_path):
+    frame = training_frame()
+    model = fit_model(frame)
+    path = str(tmp_path / 'model.npz')
+    model.save(path)
+
+    loaded = ConversionModel.load(path)
+    predictions = loaded.predict(frame)
+    assert loaded.features == model.features
+    np.testing.assert_allclose(predictions, model.predict(frame), rtol=1e-6)
+    assert ((predictions > 0) & (predictions < 1)).all()
+    # Чем выше фактическая конверсия, тем выше и оценка
+    assert np.corrcoef(predictions, conversion_target(frame))[0, 1] > 0
+
+
+def test_snapshot_is_not_scored_without_model(tmp_path):
+    columns = snapshot_columns([1, 2, 3], scores=False)
+    assert score_snapshot(columns, str(tmp_path / 'missing.npz')) == [None, None, None]
+
+
+@pytest.mark.parametrize('version, kept', [
+    (schema.SCORES_VERSION - 1, DATA_COLUMNS),
+    (schema.SCORES_VERSION, SNAPSHOT_COLUMNS),
+])
+def test_scores_are_written_only_after_their_migration(version, kept):
+    pool = FakePool({'max(version)': [(version,)]})
+    names, columns = schema.writable_columns(pool, SNAPSHOT_COLUMNS, snapshot_columns([1, 2]))
+    assert names == kept
+    assert len(columns) == len(kept)
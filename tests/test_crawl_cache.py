@@ -0,0 +1,62 @@
+import pytest
+import crawl_cache
+from crawl_cache import CrawlCache
+from conftest import FakeClock
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(crawl_cache.time, 'monotonic', clock)
+    return clock
+
+
+def test_fresh_snapshot_is_shared(clock):
+    cache = CrawlCache(ttl=60)
+    snapshot = cache.get_or_create('платье')
+    clock.advance(59)
+    assert cache.get('платье') is snapshot
+    assert cache.get_or_create('платье') is snapshot
+
+
+def test_expired_snapshot_is_replaced(clock):
+    cache = CrawlCache(ttl=60)
+    snapshot = cache.get_or_create('платье')
+    clock.advance(60)
+    assert cache.get('платье') is None
+    assert cache.get_or_create('платье') is not snapshot
+
+
+def test_least_recently_used_snapshot_is_evicted(clock):
+    cache = CrawlCache(ttl=60, max_entries=2)
+    first = cache.get_or_create('a')
+    cache.get_or_create('b')
+    # Обращение к 'a' делает вытесняемым 'b'
+    assert cache.get('a') is first
+    cache.get_or_create('c')
+
+    assert cache.get('a') is first
+    assert cache.get('b') is None
+    assert cache.get('c') is not None
+
+
+def test_expired_snapshots_are_purged_before_eviction(clock):
+    cache = CrawlCache(ttl=60, max_entries=2)
+    cache.get_or_create('a')
+    clock.advance(30)
+    fresh = cache.get_or_create('b')
+    clock.advance(40)
+    cache.get_or_create('c')
+
+    assert cache.get('a') is None
+    assert cache.get('b') is fresh
+
+
+def test_invalidate_and_clear(clock):
+    cache = CrawlCache()
+    cache.get_or_create('a')
+    cache.get_or_create('b')
+    cache.invalidate('a')
+    assert cache.get('a') is None
+    cache.clear()
+    assert cache.get('b') is None
@@ -0,0 +1,48 @@
+import csv
+from datetime import datetime
+import pytest
+from conftest import snapshot_columns
+from exporter import export_history
+from schema import META_COLUMNS, NOTEBOOK_COLUMNS
+from storage import SQLiteStorage
+
+HEADERS = [header for _, header in META_COLUMNS + NOTEBOOK_COLUMNS]
+
+
+@pytest.fixture
+def sqlite(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'wb.sqlite3'))
+    storage.insert_snapshot('платье', snapshot_columns([1, 2, 3]))
+    return storage
+
+
+def test_history_is_exported_to_csv_with_notebook_headers(sqlite, tmp_path):
+    path = str(tmp_path / 'history.csv')
+    assert export_history(sqlite, 'платье', path, datetime(2024, 5, 1)) == 3
+
+    with open(path, encoding='utf-8-sig', newline='') as file:
+        header, *rows = list(csv.reader(file))
+    assert header == HEADERS
+    assert [row[HEADERS.index('id')] for row in rows] == ['1', '2', '3']
+
+
+def test_history_is_exported_to_parquet(sqlite, tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = str(tmp_path / 'history.parquet')
+    assert export_history(sqlite, 'платье', path, datetime(2024, 5, 1), article=2) == 1
+
+    table = pq.read_table(path)
+    assert table.column_names == HEADERS
+    assert table.column('id').to_pylist() == [2]
+
+
+def test_interrupted_export_removes_file(tmp_path):
+    class BrokenStorage:
+        def iter_snapshots(self, *args):
+            yield [tuple(column[0] for column in snapshot_columns([1], scores=False))]
+            raise ConnectionError('сервер недоступен')
+
+    path = tmp_path / 'history.csv'
+    with pytest.raises(ConnectionError):
+        export_history(BrokenStorage(), 'платье', str(path), datetime(2024, 5, 1))
+    assert not path.exists()
@@ -0,0 +1,50 @@
+import pickle
+import numpy as np
+import pytest
+from features import BrandEncoder, CorrelationAccumulator
+
+
+def accumulate(matrix, parts):
+    accumulator = CorrelationAccumulator(matrix.shape[1])
+    for part in np.array_split(matrix, parts):
+        accumulator.update(part)
+    return accumulator
+
+
+def test_correlation_matches_numpy_for_any_partitioning():
+    rng = np.random.default_rng(0)
+    matrix = rng.normal(size=(1000, 4))
+    matrix[:, 1] += matrix[:, 0]
+    expected = np.corrcoef(matrix, rowvar=False)
+    for parts in (1, 3, 17):
+        np.testing.assert_allclose(accumulate(matrix, parts).correlation(), expected, atol=1e-12)
+
+
+def test_large_means_do_not_lose_precision():
+    rng = np.random.default_rng(1)
+    matrix = rng.normal(size=(10000, 3)) + [1e9, 1e6, 0]
+    matrix[:, 2] = matrix[:, 0] - 1e9
+    np.testing.assert_allclose(accumulate(matrix, 10).correlation(),
+                               np.corrcoef(matrix, rowvar=False), atol=1e-6)
+
+
+def test_empty_partitions_are_ignored():
+    matrix = np.arange(12, dtype=np.float64).reshape(6, 2) ** 2
+    accumulator = accumulate(matrix, 2)
+    accumulator.update(matrix[:0])
+    np.testing.assert_allclose(accumulator.correlation(), np.corrcoef(matrix, rowvar=False))
+
+
+def test_constant_feature_and_too_few_rows_give_nan():
+    assert np.isnan(CorrelationAccumulator(2).correlation()).all()
+    matrix = np.column_stack([np.arange(5.0), np.full(5, 3.0)])
+    correlation = accumulate(matrix, 2).correlation()
+    assert correlation[0, 0] == pytest.approx(1)
+    assert np.isnan(correlation[1, 1]) and np.isnan(correlation[0, 1])
+
+
+def test_brand_codes_are_stable_across_pickling():
+    encoder = BrandEncoder()
+    assert encoder.encode(np.array(['b', 'a', 'b'], dtype=object)).tolist() == [1, 0, 1]
+    restored = pickle.loads(pickle.dumps(encoder))
+    assert restored.encode(np.array(['c', 'a'], dtype=object)).tolist() == [2, 0]
@@ -0,0 +1,74 @@
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from history_frame import BRAND_CODE_COLUMN, HEADERS, NO_BRAND, clean_history, to_pandas
+from schema import DATA_COLUMNS
+
+ROWS = [
+    # position, promoPosition, promotion, tp, promoTextCard, cpm, brand, name, price
+    (1, 5, 'promo', 'c', 'Скидка', 150.0, 'Zara', 'Платье', 1000),
+    (2, -1, 'no promotion', 'no tp', 'no promo', None, '', 'no name', None),
+    (3, None, '', None, None, 0.0, None, None, 3000),
+    (4, 2, None, 'b', '', 90.0, 'Adidas', 'Кроссовки', 4000),
+]
+
+
+def columns(rows=ROWS):
+    values = {name: [0] * len(rows) for name in DATA_COLUMNS}
+    values['query'] = ['платье'] * len(rows)
+    values['created_at'] = [datetime(2024, 5, 1, 12)] * len(rows)
+    values['articul'] = list(range(100, 100 + len(rows)))
+    for index, name in enumerate(('position', 'promoPosition', 'promotion', 'tp', 'promoTextCard',
+                                  'cpm', 'brand', 'name', 'price')):
+        values[name] = [row[index] for row in rows]
+    return values
+
+
+def test_promo_flags_are_zero_for_missing_values():
+    frame, _ = clean_history(columns())
+    assert frame[HEADERS['promotion']].tolist() == [1, 0, 0, 0]
+    assert frame[HEADERS['tp']].tolist() == [1, 0, 0, 1]
+    assert frame[HEADERS['promoTextCard']].tolist() == [1, 0, 0, 0]
+
+
+def test_missing_numbers_are_filled():
+    frame, _ = clean_history(columns())
+    # Без продвижения место при продвижении равно месту без продвижения
+    assert frame[HEADERS['promoPosition']].tolist() == [5, 2, 3, 2]
+    assert frame[HEADERS['cpm']].tolist() == [150.0, 0.0, 0.0, 90.0]
+    assert frame[HEADERS['price']].tolist() == [1000, -1, 3000, 4000]
+    assert frame[HEADERS['price']].dtype == np.int64
+
+
+def test_brands_are_label_encoded_with_no_brand():
+    frame, classes = clean_history(columns())
+    assert classes.tolist() == sorted(['Adidas', 'Zara', NO_BRAND])
+    assert frame[HEADERS['brand']].tolist() == ['Zara', NO_BRAND, NO_BRAND, 'Adidas']
+    assert classes[frame[BRAND_CODE_COLUMN]].tolist() == frame[HEADERS['brand']].tolist()
+
+
+def test_missing_names_become_empty_strings():
+    frame, _ = clean_history(columns())
+    assert frame[HEADERS['name']].tolist() == ['Платье', '', '', 'Кроссовки']
+    assert frame[HEADERS['name']].dtype == object
+
+
+def test_categorical_columns_from_driver():
+    values = columns()
+    values['brand'] = pd.Categorical(['Zara', '', 'no brand', 'Adidas'])
+    values['promotion'] = pd.Categorical(values['promotion'])
+    frame, classes = clean_history(values)
+    assert classes.tolist() == sorted(['Adidas', 'Zara', NO_BRAND])
+    assert frame[HEADERS['promotion']].tolist() == [1, 0, 0, 0]
+
+
+def test_empty_history():
+    frame, classes = clean_history({name: [] for name in DATA_COLUMNS})
+    assert len(classes) == 0
+    assert len(frame[BRAND_CODE_COLUMN]) == 0
+
+
+def test_pandas_frame_keeps_brand_as_category():
+    dataframe = to_pandas(*clean_history(columns()))
+    assert isinstance(dataframe[HEADERS['brand']].dtype, pd.CategoricalDtype)
+    assert dataframe[HEADERS['brand']].tolist() == ['Zara', NO_BRAND, NO_BRAND, 'Adidas']
@@ -0,0 +1,83 @@
+import insert_buffer
+import storage
+from conftest import FakePool, snapshot_columns
+from insert_buffer import InsertBuffer
+from product_dimension import ProductDimensionCache
+from schema import LATEST_VERSION, POSITION_COLUMNS, PRODUCT_COLUMNS
+from storage import ClickHouseStorage
+
+
+class FlakyServer:
+    """Сервер, вставки в который завершаются ошибкой, пока failing=True"""
+
+    def __init__(self):
+        self.failing = False
+        self.inserts = []
+
+    def insert(self, query, params):
+        if self.failing:
+            raise ConnectionError('сервер недоступен')
+        self.inserts.append(params)
+        return []
+
+
+def buffer_pool(server):
+    return FakePool({'max(version)': [(LATEST_VERSION,)], 'INSERT INTO': server.insert})
+
+
+def test_blocks_are_sent_as_one_columnar_insert():
+    server = FlakyServer()
+    buffer = InsertBuffer('t', ('a', 'b'), pool=buffer_pool(server))
+    buffer.add([[1, 2], ['x', 'y']])
+    buffer.add([[3], ['z']])
+    assert buffer.flush()
+    assert server.inserts == [[[1, 2, 3], ['x', 'y', 'z']]]
+
+
+def test_failed_insert_is_retried_on_next_flush():
+    server = FlakyServer()
+    buffer = InsertBuffer('t', ('a',), pool=buffer_pool(server))
+    buffer.add([[1, 2]])
+    server.failing = True
+    assert not buffer.flush()
+    server.failing = False
+    assert buffer.flush()
+    assert server.inserts == [[[1, 2]]]
+
+
+def test_overflow_drops_oldest_blocks_and_reports_them(monkeypatch):
+    monkeypatch.setattr(insert_buffer, 'MAX_PENDING_ROWS', 3)
+    server = FlakyServer()
+    server.failing = True
+    buffer = InsertBuffer('t', ('a',), pool=buffer_pool(server))
+    dropped = []
+    buffer.add([[1, 2]], lambda: dropped.append('первый'))
+    buffer.add([[3, 4]], lambda: dropped.append('второй'))
+    assert not buffer.flush()
+    assert dropped == ['первый']
+
+    server.failing = False
+    assert buffer.flush()
+    assert server.inserts == [[[3, 4]]]
+
+
+def test_dropped_product_block_is_forgotten_by_dimension_cache(monkeypatch):
+    monkeypatch.setattr(insert_buffer, 'MAX_PENDING_ROWS', 2)
+    server = FlakyServer()
+    pool = buffer_pool(server)
+    dimension = ProductDimensionCache()
+    products_buffer = InsertBuffer('wildberries.products', PRODUCT_COLUMNS, pool=pool)
+    monkeypatch.setattr(storage, 'PRODUCT_DIMENSION', dimension)
+    monkeypatch.setattr(storage, 'PRODUCTS_BUFFER', products_buffer)
+    monkeypatch.setattr(storage, 'POSITIONS_BUFFER', InsertBuffer('wildberries.positions', POSITION_COLUMNS, pool=pool))
+    delta = ClickHouseStorage(pool, storage_mode='delta', buffered=True)
+
+    delta.insert_snapshot('платье', snapshot_columns([1, 2]))
+    delta.insert_snapshot('платье', snapshot_columns([3, 4]))
+    server.failing = True
+    assert not products_buffer.flush()
+
+    # Блок с товарами 1 и 2 отброшен: при следующем обходе они снова считаются новыми
+    attributes = [('name', 'brand', 1, 1, 1, 1, 1)] * 2
+    assert dimension.changed([1, 2], attributes) == [0, 1]
+    assert dimension.changed([3, 4], attributes) == []
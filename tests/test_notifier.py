@@ -0,0 +1,127 @@
+import asyncio
+import time
+from telebot import asyncio_helper
+from telebot.apihelper import ApiTelegramException
+import notifier
+from notifier import MAX_MESSAGE_LENGTH, AsyncBotSender, NotificationDispatcher
+
+
+class FakeBot:
+    """Бот, запоминающий отправленные сообщения; первые ответы могут быть ошибками 429"""
+
+    def __init__(self, rate_limited: int = 0, retry_after: int = 1):
+        self.sent = []
+        self.rate_limited = rate_limited
+        self.retry_after = retry_after
+
+    def send_message(self, chat_id, text):
+        if self.rate_limited:
+            self.rate_limited -= 1
+            raise ApiTelegramException('sendMessage', None, {
+                'error_code': 429, 'description': 'Too Many Requests',
+                'parameters': {'retry_after': self.retry_after},
+            })
+        self.sent.append((chat_id, text, time.monotonic()))
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'уведомления не отправлены'
+        time.sleep(0.02)
+
+
+def test_digest_fits_message_limit():
+    chunks = NotificationDispatcher._digest(['x' * 3000] * 3)
+    assert len(chunks) == 3
+    assert all(len(chunk) <= MAX_MESSAGE_LENGTH for chunk in chunks)
+    assert NotificationDispatcher._digest(['один']) == ['один']
+
+
+def test_notifications_to_one_chat_are_coalesced():
+    bot = FakeBot()
+    dispatcher = NotificationDispatcher(bot, coalesce_window=0.2)
+    for text in ('первое', 'второе', 'третье'):
+        dispatcher.send(1, text)
+
+    wait_for(lambda: bot.sent)
+    time.sleep(0.3)
+
+    [(chat_id, text, _)] = bot.sent
+    assert chat_id == 1
+    assert all(part in text for part in ('первое', 'второе', 'третье'))
+
+
+def test_digest_chunks_respect_chat_limit():
+    bot = FakeBot()
+    dispatcher = NotificationDispatcher(bot, coalesce_window=0.05)
+    for _ in range(3):
+        dispatcher.send(1, 'x' * 3000)
+
+    wait_for(lambda: len(bot.sent) == 3)
+
+    times = [sent_at for _, _, sent_at in bot.sent]
+    assert all(later - earlier >= 0.9 for earlier, later in zip(times, times[1:]))
+
+
+def test_rate_limited_message_is_retried_and_penalizes_bot(monkeypatch):
+    bot = FakeBot(rate_limited=1, retry_after=1)
+    penalties = []
+    dispatcher = NotificationDispatcher(bot, coalesce_window=0.05)
+    original = dispatcher.global_limiter.penalize
+    monkeypatch.setattr(dispatcher.global_limiter, 'penalize',
+                        lambda seconds: (penalties.append(seconds), original(seconds)))
+    started = time.monotonic()
+    dispatcher.send(1, 'текст')
+
+    wait_for(lambda: bot.sent)
+
+    assert penalties == [1]
+    assert bot.sent[0][1] == 'текст'
+    assert bot.sent[0][2] - started >= 1
+
+
+def test_idle_chat_limiters_are_pruned(monkeypatch):
+    monkeypatch.setattr(notifier, 'LIMITER_PRUNE_INTERVAL', 0.1)
+    bot = FakeBot()
+    dispatcher = NotificationDispatcher(bot, coalesce_window=0.05, chat_rate=10)
+    dispatcher.send(1, 'текст')
+
+    wait_for(lambda: bot.sent)
+    wait_for(lambda: not dispatcher._chat_limiters)
+
+
+class FakeAsyncBot:
+    """Асинхронный бот: первый ответ — ошибка 429 из asyncio_helper"""
+
+    def __init__(self):
+        self.sent = []
+        self.rate_limited = True
+
+    async def send_message(self, chat_id, text):
+        if self.rate_limited:
+            self.rate_limited = False
+            raise asyncio_helper.ApiTelegramException('sendMessage', None, {
+                'error_code': 429, 'description': 'Too Many Requests',
+                'parameters': {'retry_after': 1},
+            })
+        self.sent.append((chat_id, text))
+
+
+def test_async_bot_notifications_are_retried_from_event_loop():
+    bot = FakeAsyncBot()
+
+    async def main():
+        dispatcher = NotificationDispatcher(AsyncBotSender(bot, asyncio.get_running_loop()), coalesce_window=0.05)
+        dispatcher.send(1, 'первое')
+        dispatcher.send(1, 'второе')
+        deadline = time.monotonic() + 10
+        while not bot.sent:
+            assert time.monotonic() < deadline, 'уведомления не отправлены'
+            await asyncio.sleep(0.02)
+
+    asyncio.run(main())
+
+    [(chat_id, text)] = bot.sent
+    assert chat_id == 1
+    assert 'первое' in text and 'второе' in text
@@ -0,0 +1,59 @@
+import pytest
+import insert_buffer
+import storage
+from conftest import FakePool, snapshot_columns
+from insert_buffer import InsertBuffer
+from parser import ParserWB
+from schema import LATEST_VERSION, SNAPSHOT_COLUMNS
+from storage import ClickHouseStorage, SQLiteStorage
+from write_dedup import SQLiteDedupStore
+
+
+def test_snapshot_is_saved_once_per_write_window(tmp_path):
+    sqlite = SQLiteStorage(str(tmp_path / 'wb.sqlite3'))
+    parser = ParserWB('платье', storage=sqlite)
+    assert parser.save_columns(snapshot_columns([1, 2], scores=False))
+    assert not parser.save_columns(snapshot_columns([3], scores=False))
+    assert len(sqlite.read_columns('платье', snapshot_columns([1])[2][0])['articul']) == 2
+    assert not parser._write_due()
+
+
+def test_failed_insert_releases_write_window(tmp_path):
+    def refuse(query, params):
+        raise ConnectionError('сервер недоступен')
+
+    pool = FakePool({'max(version)': [(LATEST_VERSION,)], 'INSERT INTO': refuse})
+    parser = ParserWB('платье', storage=ClickHouseStorage(pool),
+                      dedup=SQLiteDedupStore(str(tmp_path / 'dedup.sqlite3')))
+    assert not parser.save_columns(snapshot_columns([1], scores=False))
+    assert parser._write_due()
+
+
+def test_snapshot_dropped_by_buffer_releases_write_window(tmp_path, monkeypatch):
+    def refuse(query, params):
+        raise ConnectionError('сервер недоступен')
+
+    pool = FakePool({'max(version)': [(LATEST_VERSION,)], 'INSERT INTO': refuse})
+    buffer = InsertBuffer('wildberries.data', SNAPSHOT_COLUMNS, pool=pool)
+    monkeypatch.setattr(storage, 'DATA_BUFFER', buffer)
+    monkeypatch.setattr(insert_buffer, 'MAX_PENDING_ROWS', 1)
+    dedup = SQLiteDedupStore(str(tmp_path / 'dedup.sqlite3'))
+    first = ParserWB('платье', storage=ClickHouseStorage(pool, buffered=True), dedup=dedup)
+    second = ParserWB('шарф', storage=ClickHouseStorage(pool, buffered=True), dedup=dedup)
+
+    assert first.save_columns(snapshot_columns([1], scores=False))
+    assert second.save_columns(snapshot_columns([2], query='шарф', scores=False))
+    # Окна обоих запросов заняты, пока срезы ждут в буфере
+    assert not first._write_due() and not second._write_due()
+
+    assert not buffer.flush()
+    # Срез по первому запросу отброшен при переполнении, второй ждет следующей вставки
+    assert first._write_due()
+    assert not second._write_due()
+
+
+def test_parse_skips_crawl_when_snapshot_already_written(tmp_path, monkeypatch):
+    parser = ParserWB('платье', storage=SQLiteStorage(str(tmp_path / 'wb.sqlite3')))
+    assert parser.save_columns(snapshot_columns([1], scores=False))
+    monkeypatch.setattr(parser, '_iter_pages', lambda: pytest.fail('выдача не должна обходиться'))
+    assert parser.parse() is None
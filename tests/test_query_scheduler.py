@@ -0,0 +1,80 @@
+import pytest
+import query_scheduler
+from query_scheduler import SPREAD_WINDOW, QueryScheduler
+from conftest import FakeClock
+
+HOUR = 3600
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock(100 * SPREAD_WINDOW)
+    monkeypatch.setattr(query_scheduler.time, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def scheduler():
+    return QueryScheduler(check_query=lambda query, due: None, max_workers=1)
+
+
+def test_query_phase_is_stable_and_inside_window():
+    phases = {query: QueryScheduler._query_phase(query) for query in ('платье', 'кроссовки', 'чехол')}
+    assert phases == {query: QueryScheduler._query_phase(query) for query in phases}
+    assert all(0 <= phase < SPREAD_WINDOW for phase in phases.values())
+    assert len(set(phases.values())) == len(phases)
+
+
+def test_next_slot_is_aligned_to_query_phase(scheduler, clock):
+    for earliest in (clock.now, clock.now + 1, clock.now + SPREAD_WINDOW - 1):
+        slot = scheduler._next_slot('платье', earliest)
+        assert earliest <= slot < earliest + SPREAD_WINDOW
+        assert slot % SPREAD_WINDOW == QueryScheduler._query_phase('платье')
+
+
+def test_first_run_is_not_earlier_than_half_interval(scheduler, clock):
+    scheduler.add(1, 111, 'платье', 2 * HOUR)
+
+    assert scheduler.collect_due() == []
+    clock.advance(HOUR + SPREAD_WINDOW)
+    [(query, due)] = scheduler.collect_due()
+    assert query == 'платье'
+    assert [subscription.article for subscription in due] == [111]
+
+
+def test_due_articles_of_one_query_are_collected_together(scheduler, clock):
+    scheduler.add_many([(1, 111, 'платье', HOUR), (2, 222, 'платье', HOUR), (1, 333, 'чехол', HOUR)])
+    clock.advance(HOUR / 2 + SPREAD_WINDOW)
+
+    collected = dict(scheduler.collect_due())
+
+    assert sorted(subscription.article for subscription in collected['платье']) == [111, 222]
+    assert [subscription.article for subscription in collected['чехол']] == [333]
+
+
+def test_running_query_is_skipped_until_finished(scheduler, clock):
+    scheduler.add(1, 111, 'платье', HOUR)
+    clock.advance(HOUR / 2 + SPREAD_WINDOW)
+    assert len(scheduler.collect_due()) == 1
+
+    clock.advance(10 * HOUR)
+    assert scheduler.collect_due() == []
+    scheduler.finish('платье')
+    assert len(scheduler.collect_due()) == 1
+
+
+def test_missed_slots_are_not_caught_up(scheduler, clock):
+    scheduler.add(1, 111, 'платье', HOUR)
+    clock.advance(10 * HOUR)
+
+    [(query, [subscription])] = scheduler.collect_due()
+
+    assert clock.now <= subscription.next_run < clock.now + SPREAD_WINDOW
+    assert subscription.next_run % SPREAD_WINDOW == QueryScheduler._query_phase('платье')
+
+
+def test_remove_drops_empty_query(scheduler, clock):
+    scheduler.add(1, 111, 'платье', HOUR)
+    scheduler.remove(1, 111, 'платье')
+    clock.advance(10 * HOUR)
+    assert scheduler.collect_due() == []
@@ -0,0 +1,42 @@
+import pytest
+import rate_limiter
+from rate_limiter import RateLimiter
+from conftest import FakeClock
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, 'monotonic', clock)
+    return clock
+
+
+def test_burst_up_to_capacity_then_wait(clock):
+    limiter = RateLimiter(rate=2, capacity=3)
+    assert [limiter.try_acquire() for _ in range(3)] == [0, 0, 0]
+    assert limiter.try_acquire() == pytest.approx(0.5)
+
+
+def test_tokens_refill_with_time(clock):
+    limiter = RateLimiter(rate=2, capacity=1)
+    assert limiter.try_acquire() == 0
+    clock.advance(0.25)
+    assert limiter.try_acquire() == pytest.approx(0.25)
+    clock.advance(0.25)
+    assert limiter.try_acquire() == 0
+
+
+def test_refill_does_not_exceed_capacity(clock):
+    limiter = RateLimiter(rate=1, capacity=2)
+    clock.advance(100)
+    assert limiter.is_full()
+    assert [limiter.try_acquire() for _ in range(3)][-1] == pytest.approx(1)
+
+
+def test_penalize_blocks_for_given_time(clock):
+    limiter = RateLimiter(rate=10)
+    limiter.penalize(2)
+    assert limiter.try_acquire() == pytest.approx(2.1)
+    clock.advance(2.1)
+    assert limiter.try_acquire() == 0
+    assert not limiter.is_full()
@@ -0,0 +1,161 @@
+from datetime import datetime
+import pytest
+import schema
+from conftest import FakePool
+
+
+class MigrationsTable:
+    """Версии в wildberries.schema_migrations поддельного сервера"""
+
+    def __init__(self, versions=()):
+        self.versions = list(versions)
+
+    def max_version(self, query, params):
+        return [(max(self.versions, default=0),)]
+
+    def record(self, query, params):
+        self.versions.extend(row[0] for row in params)
+        return []
+
+
+class LocksTable:
+    """Строки wildberries.schema_locks поддельного сервера, в порядке времени записи"""
+
+    def __init__(self, owners=()):
+        self.owners = list(owners)
+
+    def insert(self, query, params):
+        self.owners.append(params['owner'])
+        return []
+
+    def holder(self, query, params):
+        return [(self.owners[0], datetime(2024, 5, 1))] if self.owners else []
+
+    def delete(self, query, params):
+        self.owners.remove(params['owner'])
+        return []
+
+
+def schema_pool(layout=(schema.DATA_SORTING_KEY, schema.DATA_PARTITION_KEY), versions=(), locks=None):
+    table = MigrationsTable(versions)
+    locks = locks or LocksTable()
+    pool = FakePool({
+        'INSERT INTO wildberries.schema_locks': locks.insert,
+        'FROM wildberries.schema_locks': locks.holder,
+        'ALTER TABLE wildberries.schema_locks DELETE': locks.delete,
+        'sorting_key': [layout] if layout else [],
+        'max(version)': table.max_version,
+        'INSERT INTO wildberries.schema_migrations': table.record,
+        'max(created_at)': [(datetime(2024, 5, 1),)],
+    })
+    return pool, table
+
+
+def test_migrate_applies_missing_versions_in_order():
+    pool, table = schema_pool(layout=None)
+    assert schema.migrate(pool) == schema.LATEST_VERSION
+    assert table.versions == [version for version, _, _ in schema.MIGRATIONS]
+
+    assert schema.migrate(pool) == schema.LATEST_VERSION
+    assert table.versions == [version for version, _, _ in schema.MIGRATIONS]
+
+
+def test_migrate_stops_at_target():
+    pool, table = schema_pool(layout=None)
+    assert schema.migrate(pool, target=3) == 3
+    assert table.versions == [1, 2, 3]
+
+
+def test_migrate_refuses_legacy_data_table():
+    pool, table = schema_pool(layout=('articul, created_at', ''), versions=[1, 2])
+    with pytest.raises(RuntimeError, match='rebuild-data'):
+        schema.migrate(pool)
+    assert table.versions == [1, 2]
+
+
+def test_migrate_refuses_while_another_process_holds_the_lock():
+    locks = LocksTable(['другой процесс'])
+    pool, table = schema_pool(layout=None, locks=locks)
+    with pytest.raises(RuntimeError, match='другой процесс'):
+        schema.migrate(pool)
+    assert table.versions == []
+    assert locks.owners == ['другой процесс']
+
+    locks.owners.clear()
+    schema.migrate(pool)
+    assert table.versions
+    assert locks.owners == []
+
+
+def test_migrations_carry_no_credentials():
+    from clickhouse_pool import CLICKHOUSE_SETTINGS
+    for _, _, steps in schema.MIGRATIONS:
+        for step in steps:
+            if isinstance(step, str):
+                assert 'PASSWORD' not in step
+                assert CLICKHOUSE_SETTINGS['password'] not in step
+
+
+class BackfillServer:
+    """Представления и wildberries.schema_backfills поддельного сервера"""
+
+    def __init__(self, fail_backfills=0):
+        self.views = set()
+        self.records = []
+        self.backfills = []
+        self.fail_backfills = fail_backfills
+        self.last_created_at = datetime(2024, 5, 1)
+
+    def pool(self):
+        return FakePool({
+            'FROM system.tables': lambda query, params: [(1,)] if params['name'] in self.views else [],
+            'FROM wildberries.schema_backfills': lambda query, params: [
+                (cutoff, backfilled) for view, cutoff, backfilled, _ in reversed(self.records) if view == params['view']
+            ][:1],
+            'INSERT INTO wildberries.schema_backfills': lambda query, params: self.records.extend(params) or [],
+            'max(created_at)': lambda query, params: [(self.last_created_at,)],
+            'CREATE MATERIALIZED VIEW': lambda query, params: self.views.add(query.split()[6].split('.', 1)[1]) or [],
+            'INSERT INTO wildberries.positions_hourly': self.backfill,
+        })
+
+    def backfill(self, query, params):
+        if self.fail_backfills:
+            self.fail_backfills -= 1
+            raise ConnectionError('сервер недоступен')
+        self.backfills.append(params['cutoff'])
+        return []
+
+
+def hourly_step():
+    table, bucket_function = schema.ROLLUP_TABLES['hour']
+    return schema._materialize(table, 'full', schema._rollup_select('full', bucket_function),
+                               schema._rollup_backfill(table, 'full', bucket_function))
+
+
+def test_backfill_uses_cutoff_read_before_creating_view():
+    server = BackfillServer()
+    pool = server.pool()
+    hourly_step()(pool)
+
+    queries = [query for query, _ in pool.queries]
+    read_at = next(i for i, query in enumerate(queries) if 'max(created_at)' in query)
+    created_at = next(i for i, query in enumerate(queries) if 'CREATE MATERIALIZED VIEW' in query)
+    assert read_at < created_at
+    assert server.backfills == [datetime(2024, 5, 1)]
+    assert 'created_at <= %(cutoff)s' in pool.executed('INSERT INTO wildberries.positions_hourly')[0][0]
+
+    server.last_created_at = datetime(2024, 6, 1)
+    hourly_step()(server.pool())
+    assert server.backfills == [datetime(2024, 5, 1)]
+
+
+def test_retried_backfill_keeps_recorded_cutoff():
+    server = BackfillServer(fail_backfills=1)
+    with pytest.raises(ConnectionError):
+        hourly_step()(server.pool())
+
+    server.last_created_at = datetime(2024, 6, 1)
+    pool = server.pool()
+    hourly_step()(pool)
+    assert server.backfills == [datetime(2024, 5, 1)]
+    assert not pool.executed('CREATE MATERIALIZED VIEW')
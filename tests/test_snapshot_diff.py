@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+import numpy as np
+from snapshot_diff import ENTERED, EXITED, MOVED, PRICE, PROMO, QuerySnapshot, SnapshotStore, diff_snapshots
+
+
+def snapshot(ids, prices=None, promo=None):
+    return QuerySnapshot(ids, prices if prices is not None else [100] * len(ids),
+                         promo if promo is not None else [0] * len(ids), created_at=0)
+
+
+def test_added_removed_and_moved_products():
+    previous = snapshot([10, 20, 30, 40])
+    current = snapshot([20, 10, 50, 40])
+
+    diff = diff_snapshots('query', previous, current)
+
+    assert diff.summary() == {MOVED: 2, ENTERED: 1, EXITED: 1, PRICE: 0, PROMO: 0}
+    assert sorted(zip(*(group.tolist() for group in diff.moved))) == [(10, 1, 2), (20, 2, 1)]
+    assert [group.tolist() for group in diff.entered] == [[50], [3]]
+    assert [group.tolist() for group in diff.exited] == [[30], [3]]
+
+
+def test_price_and_promo_changes():
+    previous = snapshot([1, 2, 3], prices=[100, 200, 300], promo=[0, 0, 1])
+    current = snapshot([1, 2, 3], prices=[100, 250, 300], promo=[1, 0, 0])
+
+    diff = diff_snapshots('query', previous, current)
+
+    assert sorted(diff.to_rows()) == [(PRICE, 2, 200, 250), (PROMO, 1, 0, 1), (PROMO, 3, 1, 0)]
+
+
+def test_identical_snapshots_have_no_changes():
+    previous = snapshot([5, 6, 7], prices=[1, 2, 3])
+    assert len(diff_snapshots('query', previous, snapshot([5, 6, 7], prices=[1, 2, 3]))) == 0
+
+
+def test_empty_previous_snapshot_marks_everything_entered():
+    diff = diff_snapshots('query', snapshot([]), snapshot([3, 4]))
+    assert diff.summary()[ENTERED] == 2
+    assert diff.summary()[EXITED] == 0
+
+
+def test_duplicate_articles_keep_first_position():
+    current = snapshot([7, 8, 7])
+    assert current.ids.tolist() == [7, 8]
+    assert current.positions.tolist() == [1, 2]
+
+
+def test_for_articles_filters_changes():
+    diff = diff_snapshots('query', snapshot([1, 2, 3]), snapshot([2, 1, 4]))
+
+    changes = diff.for_articles([1, 3, 4, 99])
+
+    assert changes == {1: {MOVED: (1, 2)}, 3: {EXITED: (3, 0)}, 4: {ENTERED: (0, 3)}}
+
+
+def test_store_returns_diff_against_previous_snapshot():
+    store = SnapshotStore()
+    products = [SimpleNamespace(id=article, price=100, log={'promotion': 0}) for article in (1, 2)]
+
+    assert store.update('query', products) is None
+    diff = store.update('query', products[::-1])
+
+    assert diff.summary()[MOVED] == 2
+    assert isinstance(diff.moved[0], np.ndarray)
@@ -0,0 +1,81 @@
+import sqlite3
+from datetime import datetime
+import schema
+from conftest import FakePool, snapshot_columns
+from schema import DATA_COLUMNS
+from storage import ClickHouseStorage, SQLiteStorage
+
+
+def rollup_pool(buckets):
+    """Сервер со схемой последней версии и почасовыми агрегатами, начинающимися с buckets"""
+    return FakePool({
+        'max(version)': [(schema.LATEST_VERSION,)],
+        'FROM wildberries.positions_hourly': lambda query, params: [
+            (5, 4, 6, 1000, 10, bucket) for bucket in buckets if bucket >= params['date_from']
+        ],
+        'FROM wildberries.data': [(7, 7, 7, 900, 9, datetime(2024, 5, 1, 10))],
+    })
+
+
+def test_history_reads_partial_first_bucket_from_raw_rows():
+    pool = rollup_pool([datetime(2024, 5, 1, 10), datetime(2024, 5, 1, 11)])
+    rows = ClickHouseStorage(pool).history(42, 'платье', datetime(2024, 5, 1, 10, 30), 'hour')
+
+    assert [row[5] for row in rows] == [datetime(2024, 5, 1, 10), datetime(2024, 5, 1, 11)]
+    assert rows[0][0] == 7
+    [(raw_sql, params)] = pool.executed('FROM wildberries.data')
+    assert 'created_at >= %(date_from)s' in raw_sql
+    assert params['covered_from'] == datetime(2024, 5, 1, 11)
+
+
+def test_history_aligned_to_bucket_is_read_from_rollups_only():
+    pool = rollup_pool([datetime(2024, 5, 1, 10), datetime(2024, 5, 1, 11)])
+    rows = ClickHouseStorage(pool).history(42, 'платье', datetime(2024, 5, 1, 10), 'hour')
+
+    assert [row[0] for row in rows] == [5, 5]
+    assert not pool.executed('FROM wildberries.data')
+
+
+def test_sqlite_latest_record_is_the_newest_measurement(tmp_path):
+    sqlite = SQLiteStorage(str(tmp_path / 'wb.sqlite3'))
+    sqlite.insert_snapshot('платье', snapshot_columns([1, 2], created_at=datetime(2024, 5, 1, 10)))
+    sqlite.insert_snapshot('платье', snapshot_columns([2, 1], created_at=datetime(2024, 5, 1, 11)))
+
+    position, name, *_, created_at = sqlite.latest_record(1, 'платье')
+    assert (position, name, created_at) == (2, 'name', datetime(2024, 5, 1, 11))
+    assert sqlite.latest_record(3, 'платье') is None
+
+
+def test_sqlite_history_is_grouped_by_bucket(tmp_path):
+    sqlite = SQLiteStorage(str(tmp_path / 'wb.sqlite3'))
+    for created_at, articles in ((datetime(2024, 5, 1, 10), [1, 2]), (datetime(2024, 5, 1, 10, 30), [2, 1]),
+                                 (datetime(2024, 5, 1, 12), [1])):
+        sqlite.insert_snapshot('платье', snapshot_columns(articles, created_at=created_at))
+
+    rows = sqlite.history(1, 'платье', datetime(2024, 5, 1), 'hour')
+    assert [row[1:3] + row[5:] for row in rows] == [
+        (1, 2, datetime(2024, 5, 1, 10)), (1, 1, datetime(2024, 5, 1, 12)),
+    ]
+    assert len(sqlite.history(1, 'платье', datetime(2024, 5, 1, 11))) == 1
+
+
+def test_sqlite_snapshots_are_read_in_batches_and_by_columns(tmp_path):
+    sqlite = SQLiteStorage(str(tmp_path / 'wb.sqlite3'))
+    sqlite.insert_snapshot('платье', snapshot_columns([1, 2, 3], scores=False))
+
+    batches = list(sqlite.iter_snapshots('платье', datetime(2024, 5, 1), batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 1]
+    columns = sqlite.read_columns('платье', datetime(2024, 5, 1), article=2)
+    assert list(columns) == list(DATA_COLUMNS)
+    assert columns['articul'] == [2]
+
+
+def test_sqlite_file_without_scores_is_extended(tmp_path):
+    path = str(tmp_path / 'wb.sqlite3')
+    with sqlite3.connect(path) as conn:
+        conn.execute(f"CREATE TABLE data ({', '.join(DATA_COLUMNS)})")
+
+    sqlite = SQLiteStorage(path)
+    sqlite.insert_snapshot('платье', snapshot_columns([1]))
+    with sqlite3.connect(path) as conn:
+        assert conn.execute('SELECT predicted_conversion FROM data').fetchall() == [(None,)]
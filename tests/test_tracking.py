@@ -0,0 +1,102 @@
+from tracking import (
+    ACTION_HISTORY, ACTION_HISTORY_MENU, ACTION_MENU, ACTION_REMOVE, ACTION_TRACK,
+    BACK_BUTTON, STEP_HISTORY, STEP_REMOVE, Tracker, check_interval, parse_selection,
+)
+
+
+class FakeDiff:
+    """Изменения среза выдачи в формате SnapshotDiff.for_articles"""
+
+    def __init__(self, changes):
+        self.changes = changes
+
+    def for_articles(self, articles):
+        wanted = set(articles)
+        return {article: kinds for article, kinds in self.changes.items() if article in wanted}
+
+
+def test_adding_dialog_collects_query_article_and_frequency():
+    tracker = Tracker()
+    tracker.start_adding(1)
+    assert tracker.waiting(1)
+
+    assert tracker.handle(1, '123').action is None
+    assert not tracker.waiting(1)
+
+    tracker.start_adding(1)
+    tracker.handle(1, 'Шарф')
+    assert tracker.handle(1, 'не артикул').text == "Некорректный артикул. Попробуйте снова."
+    assert not tracker.waiting(1)
+
+    tracker.start_adding(1)
+    tracker.handle(1, 'Шарф')
+    tracker.handle(1, '42')
+    assert tracker.handle(1, '30').action is None
+
+    tracker.start_adding(1)
+    tracker.handle(1, 'Шарф')
+    tracker.handle(1, '42')
+    reply = tracker.handle(1, '4')
+    assert (reply.action, reply.args) == (ACTION_TRACK, (42, 'шарф', 4))
+    assert not tracker.waiting(1)
+
+
+def test_selection_dialog():
+    tracker = Tracker()
+    assert tracker.start_selection(1, STEP_HISTORY)[1] == []
+    assert not tracker.waiting(1)
+
+    tracker.track(1, 42, 'шарф', 4)
+    _, labels = tracker.start_selection(1, STEP_HISTORY)
+    assert labels == ['История: 42 (шарф)']
+    assert parse_selection(labels[0]) == (42, 'шарф')
+    reply = tracker.handle(1, labels[0])
+    assert (reply.action, reply.args) == (ACTION_HISTORY, (42, 'шарф'))
+
+    tracker.start_selection(1, STEP_HISTORY)
+    assert tracker.handle(1, 'что-то').action == ACTION_HISTORY_MENU
+    tracker.start_selection(1, STEP_REMOVE)
+    assert tracker.handle(1, 'Удалить: 7 (шарф)').action == ACTION_MENU
+    tracker.start_selection(1, STEP_REMOVE)
+    assert tracker.handle(1, BACK_BUTTON).action == ACTION_MENU
+    tracker.start_selection(1, STEP_REMOVE)
+    assert tracker.handle(1, 'Удалить: 42 (шарф)').action == ACTION_REMOVE
+
+    assert tracker.untrack(1, 42, 'шарф')
+    assert not tracker.untrack(1, 42, 'шарф')
+    assert tracker.tracked_items == {1: {}}
+
+
+def test_check_results_reports_changes_once():
+    tracker = Tracker()
+    tracker.track(1, 42, 'шарф', 4)
+    tracker.track(2, 7, 'шарф', 4, last_position=3)
+    targets = [(1, 42), (2, 7)]
+    result = {'position': 5, 'page': 1, 'price': 1000}
+
+    notifications, positions = tracker.check_results('шарф', targets, {42: result, 7: None})
+    assert [chat_id for chat_id, _ in notifications] == [1, 2]
+    assert positions == [(1, 42, 'шарф', 5)]
+
+    notifications, positions = tracker.check_results('шарф', targets[:1], {42: result})
+    assert notifications == []
+    assert positions == [(1, 42, 'шарф', 5)]
+
+
+def test_check_results_reports_snapshot_changes_of_tracked_products():
+    tracker = Tracker()
+    tracker.track(1, 42, 'шарф', 4, last_position=5)
+    tracker.track(2, 7, 'шарф', 4, last_position=1)
+    diff = FakeDiff({42: {'price': (1000, 900)}, 7: {'moved': (1, 2)}})
+    results = {42: {'position': 5, 'page': 1, 'price': 900}, 7: {'position': 1, 'page': 1, 'price': 10}}
+
+    tracker.untrack(2, 7, 'шарф')
+    notifications, _ = tracker.check_results('шарф', [(1, 42), (2, 7)], results, diff)
+    assert [chat_id for chat_id, _ in notifications] == [1]
+
+
+def test_restore_schedules_every_subscription():
+    tracker = Tracker()
+    subscriptions = tracker.restore([(1, 42, 'шарф', 4, 5), (1, 42, 'платье', 30, None)])
+    assert subscriptions == [(1, 42, 'шарф', check_interval(4)), (1, 42, 'платье', 3600)]
+    assert tracker.tracked(1, 42, 'шарф')['last_position'] == 5
@@ -0,0 +1,19 @@
+from tracking_store import TrackingStore
+
+
+def test_readding_subscription_resets_last_position(tmp_path):
+    store = TrackingStore(str(tmp_path / 'tracking.sqlite3'))
+    store.add(1, 42, 'шарф', 4)
+    store.update_positions([(1, 42, 'шарф', 7)])
+    assert list(store.iter_all()) == [(1, 42, 'шарф', 4, 7)]
+
+    store.add(1, 42, 'шарф', 2)
+    assert list(store.iter_all()) == [(1, 42, 'шарф', 2, None)]
+
+
+def test_removed_subscription_is_not_restored(tmp_path):
+    store = TrackingStore(str(tmp_path / 'tracking.sqlite3'))
+    store.add(1, 42, 'шарф', 4)
+    store.add(2, 42, 'шарф', 4)
+    store.remove(1, 42, 'шарф')
+    assert [row[0] for row in TrackingStore(store.path).iter_all()] == [2]
@@ -0,0 +1,63 @@
+from datetime import datetime
+import pytest
+from conftest import FakePool
+from write_dedup import ClickHouseDedupStore, SQLiteDedupStore, dedup_store
+
+WRITTEN_AT = datetime(2024, 5, 1, 12, 0)
+
+
+@pytest.mark.parametrize('storage_mode, table', [('full', 'wildberries.data'), ('delta', 'wildberries.positions')])
+def test_fallback_reads_table_of_storage_mode(storage_mode, table):
+    pool = FakePool({f'FROM {table}': [(WRITTEN_AT, 3)]})
+    assert ClickHouseDedupStore(pool, storage_mode).last_write('платье') == WRITTEN_AT.timestamp()
+
+
+def test_fallback_without_rows_gives_no_write():
+    pool = FakePool({'max(created_at)': [(datetime(1970, 1, 1), 0)]})
+    assert ClickHouseDedupStore(pool).last_write('платье') is None
+
+
+def test_fallback_write_is_copied_locally(tmp_path):
+    pool = FakePool({'FROM wildberries.positions': [(WRITTEN_AT, 3)]})
+    store = SQLiteDedupStore(str(tmp_path / 'dedup.sqlite3'), ClickHouseDedupStore(pool, 'delta'))
+    assert store.last_write('платье') == WRITTEN_AT.timestamp()
+    assert store.last_write('платье') == WRITTEN_AT.timestamp()
+    assert len(pool.queries) == 1
+
+
+def test_dedup_store_is_shared_per_file_pool_and_mode(tmp_path):
+    path = str(tmp_path / 'dedup.sqlite3')
+    pool = FakePool()
+    assert dedup_store(path, pool, 'delta') is dedup_store(path, pool, 'delta')
+    assert dedup_store(path, pool, 'delta') is not dedup_store(path, pool, 'full')
+    assert dedup_store(path, pool, 'delta').fallback.table == 'wildberries.positions'
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteDedupStore(str(tmp_path / 'dedup.sqlite3'))
+
+
+def test_window_is_claimed_once_per_interval(store):
+    assert store.try_claim('платье', 3600, now=1000.0) == 0.0
+    assert store.try_claim('платье', 3600, now=2000.0) is None
+    assert store.try_claim('платье', 3600, now=4600.0) == 1000.0
+    assert store.last_write('платье') == 4600.0
+
+
+def test_release_restores_previous_write(store):
+    store.try_claim('платье', 3600, now=1000.0)
+    store.try_claim('платье', 3600, now=4600.0)
+    store.release('платье', 1000.0, claimed_at=4600.0)
+    assert store.last_write('платье') == 1000.0
+
+    store.release('платье', 0.0)
+    assert store.last_write('платье') is None
+
+
+def test_stale_release_keeps_newer_claim(store):
+    store.try_claim('платье', 3600, now=1000.0)
+    store.try_claim('платье', 3600, now=4600.0)
+    # Срез часа 1000 отброшен уже после захвата следующего окна
+    store.release('платье', 0.0, claimed_at=1000.0)
+    assert store.last_write('платье') == 4600.0
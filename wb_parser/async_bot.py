@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import os
+import time
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
+from async_parser import AsyncParserWB, ASYNC_SEARCH_CLIENT
+from query_scheduler import QueryScheduler
+from insert_buffer import flush_buffers_if_due
+from tracking_store import TrackingStore
+from charts import ChartRenderer, position_chart_key
+from notifier import AsyncBotSender, NotificationDispatcher
+from tracking import Tracker
+import tracking
+import messages
+
+# Сколько проверок запросов может выполняться одновременно
+DEFAULT_MAX_CONCURRENT_CHECKS = 64
+
+
+class AsyncWBTrackerBot:
+    """
+    Асинхронный вариант WBTrackerBot: обработка сообщений, проверки позиций
+    и планировщик работают в одном event loop без блокирующих потоков
+    """
+
+    def __init__(self, token, superset_dashboard_url, max_concurrent_checks=DEFAULT_MAX_CONCURRENT_CHECKS):
+        self.logger = logging.getLogger(__name__)
+        self.logger.info("Инициализация асинхронного бота...")
+
+        self.bot = AsyncTeleBot(token)
+        # Отслеживания и шаги диалогов, общие с синхронной версией бота
+        self.tracker = Tracker()
+        self.store = TrackingStore()
+        self.scheduler = QueryScheduler()
+        self.chart_renderer = ChartRenderer()
+        # Плановые уведомления уходят через очередь с лимитами Telegram, как в WBTrackerBot.
+        # Диспетчеру нужен запущенный event loop, поэтому он создается в main()
+        self.notifier = None
+        self.superset_dashboard_url = superset_dashboard_url
+        self.max_concurrent_checks = max_concurrent_checks
+        self._tasks = set()
+        self.setup_handlers()
+
+        self.logger.info("Асинхронный бот инициализирован")
+
+    def setup_handlers(self):
+        @self.bot.message_handler(commands=['start'])
+        async def start(message):
+            self.tracker.cancel(message.chat.id)
+            await self.show_main_menu(message.chat.id)
+
+        @self.bot.message_handler(func=lambda m: m.text == tracking.ADD_BUTTON)
+        async def add_product(message):
+            self.logger.info(f"Пользователь {message.chat.id} начал добавление товара")
+            await self.bot.send_message(message.chat.id, self.tracker.start_adding(message.chat.id))
+
+        @self.bot.message_handler(func=lambda m: m.text == tracking.HISTORY_BUTTON)
+        async def show_history(message):
+            await self.show_selection(message.chat.id, tracking.STEP_HISTORY)
+
+        @self.bot.message_handler(func=lambda m: m.text == tracking.REMOVE_BUTTON)
+        async def remove_tracking(message):
+            await self.show_selection(message.chat.id, tracking.STEP_REMOVE)
+
+        @self.bot.message_handler(func=lambda m: m.text == tracking.ANALYTICS_BUTTON)
+        async def show_analytics(message):
+            self.tracker.cancel(message.chat.id)
+            markup = InlineKeyboardMarkup()
+            markup.add(InlineKeyboardButton(text="Открыть аналитику 📊", url=self.superset_dashboard_url))
+            await self.bot.send_message(message.chat.id, "Нажмите кнопку ниже, чтобы открыть полную аналитику:", reply_markup=markup)
+
+        @self.bot.message_handler(func=lambda m: self.tracker.waiting(m.chat.id))
+        async def next_step(message):
+            await self.handle_reply(message.chat.id, self.tracker.handle(message.chat.id, message.text))
+
+    async def handle_reply(self, chat_id, reply):
+        """Отправляет ответ на шаг диалога и выполняет выбранное пользователем действие"""
+        if reply.text:
+            await self.bot.send_message(chat_id, reply.text)
+        if reply.action == tracking.ACTION_MENU:
+            await self.show_main_menu(chat_id)
+        elif reply.action == tracking.ACTION_HISTORY_MENU:
+            await self.show_selection(chat_id, tracking.STEP_HISTORY)
+        elif reply.action == tracking.ACTION_HISTORY:
+            await self.send_product_history(chat_id, *reply.args)
+        elif reply.action == tracking.ACTION_REMOVE:
+            await self.remove_product(chat_id, *reply.args)
+        elif reply.action == tracking.ACTION_TRACK:
+            await self.add_product(chat_id, *reply.args)
+
+    async def show_main_menu(self, chat_id):
+        await self.bot.send_message(chat_id, "Выберите действие:", reply_markup=tracking.main_menu_markup())
+
+    async def show_selection(self, chat_id, step):
+        text, labels = self.tracker.start_selection(chat_id, step)
+        if not labels:
+            await self.bot.send_message(chat_id, text)
+            return
+        await self.bot.send_message(chat_id, text, reply_markup=tracking.selection_markup(labels))
+
+    async def send_product_history(self, chat_id, article, query):
+        """Отправляет историю позиций товара с графиком за последние 7 дней"""
+        try:
+            parser = AsyncParserWB(query)
+            history = await parser.get_product_history(article, query, days=tracking.HISTORY_DAYS, resolution='hour')
+
+            if not history:
+                await self.bot.send_message(chat_id, f"Для товара {article} нет данных за последние {tracking.HISTORY_DAYS} дней.")
+                await self.show_main_menu(chat_id)
+                return
+
+            await self.bot.send_message(chat_id, messages.history_text(article, query, history))
+
+            chart_args = tracking.history_chart_args(article, query, history)
+            png = await asyncio.wrap_future(self.chart_renderer.render(position_chart_key(*chart_args), *chart_args))
+            await self.bot.send_photo(chat_id, photo=png, caption=messages.chart_caption(article, query, tracking.HISTORY_DAYS))
+            self.logger.info(f"История для товара {article} успешно отправлена пользователю {chat_id}")
+
+        except Exception as e:
+            self.logger.error(f"Ошибка при получении истории: {str(e)}", exc_info=True)
+            await self.bot.send_message(chat_id, f"Произошла ошибка при построении графика для товара {article}.")
+        await self.show_main_menu(chat_id)
+
+    async def remove_product(self, chat_id, article, query):
+        self.scheduler.remove(chat_id, article, query)
+        await asyncio.to_thread(self.store.remove, chat_id, article, query)
+        self.tracker.untrack(chat_id, article, query)
+        await self.bot.send_message(chat_id, f"✅ Отслеживание товара {article} по запросу '{query}' удалено.")
+        self.logger.info(f"Удалено отслеживание товара {article} для пользователя {chat_id}")
+        await self.show_main_menu(chat_id)
+
+    async def add_product(self, chat_id, article, query, frequency):
+        try:
+            search_msg = await self.bot.send_message(
+                chat_id,
+                f"🔍 Идет поиск товара в каталоге по запросу '{query}'..."
+            )
+            self.tracker.track(chat_id, article, query, frequency)
+            await asyncio.to_thread(self.store.add, chat_id, article, query, frequency)
+
+            parser = AsyncParserWB(query, strict=False, buffered=True)
+            result = await parser.find_product_position(article, query, full_snapshot=True)
+            notifications, positions = self.tracker.check_results(query, [(chat_id, article)], {article: result})
+            # Ответ на действие пользователя отправляется сразу, а не через очередь уведомлений
+            for notification_chat_id, text in notifications:
+                await self.bot.send_message(notification_chat_id, text)
+            await asyncio.to_thread(self.store.update_positions, positions)
+
+            await self.bot.delete_message(chat_id, search_msg.message_id)
+            self.scheduler.add(chat_id, article, query, tracking.check_interval(frequency))
+
+            await self.bot.send_message(
+                chat_id,
+                f"✅ Товар {article} добавлен в отслеживание!\n"
+                f"Запрос: '{query}'\n"
+                f"Проверка: {frequency} раз(а) в день"
+            )
+        except Exception as e:
+            self.logger.error(f"Ошибка при добавлении товара: {str(e)}", exc_info=True)
+            await self.bot.send_message(chat_id, f"Произошла ошибка: {str(e)}")
+
+    async def check_query(self, query, subscriptions):
+        """Проверяет позиции всех отслеживаемых товаров по запросу за один обход выдачи"""
+        parser = AsyncParserWB(query, strict=False, buffered=True)
+        articles = list({subscription.article for subscription in subscriptions})
+        results = await parser.find_products_positions(articles, query, full_snapshot=True)
+        targets = [(subscription.chat_id, subscription.article) for subscription in subscriptions]
+        notifications, positions = self.tracker.check_results(query, targets, results, parser.last_diff)
+        for chat_id, text in notifications:
+            self.notifier.send(chat_id, text)
+        await asyncio.to_thread(self.store.update_positions, positions)
+
+    async def restore_tracking(self):
+        """Восстанавливает отслеживания из хранилища и массово ставит их в расписание"""
+        started_at = time.monotonic()
+        rows = await asyncio.to_thread(lambda: list(self.store.iter_all()))
+        subscriptions = self.tracker.restore(rows)
+        self.scheduler.add_many(subscriptions)
+        self.logger.info(f"Восстановлено {len(subscriptions)} отслеживаний за {time.monotonic() - started_at:.2f} с")
+
+    async def _run_check(self, semaphore, query, due):
+        async with semaphore:
+            try:
+                await self.check_query(query, due)
+            except Exception as e:
+                self.logger.error(f"Ошибка при проверке запроса '{query}': {str(e)}", exc_info=True)
+            finally:
+                self.scheduler.finish(query)
+
+    async def run_scheduler(self):
+        """Планировщик: каждую секунду запускает проверки наступивших запросов как задачи event loop"""
+        semaphore = asyncio.Semaphore(self.max_concurrent_checks)
+        while True:
+            try:
+                for query, due in self.scheduler.collect_due():
+                    task = asyncio.create_task(self._run_check(semaphore, query, due))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                await asyncio.to_thread(flush_buffers_if_due)
+            except Exception as e:
+                self.logger.error(f"Ошибка в планировщике: {str(e)}", exc_info=True)
+            await asyncio.sleep(1)
+
+    async def main(self):
+        self.logger.info("Запуск асинхронного бота")
+        self.notifier = NotificationDispatcher(AsyncBotSender(self.bot, asyncio.get_running_loop()))
+        # Отслеживания восстанавливаются до опроса Telegram: иначе восстановление
+        # перезаписало бы отслеживания, которые пользователи успели изменить
+        await self.restore_tracking()
+        scheduler_task = asyncio.create_task(self.run_scheduler())
+        try:
+            await self.bot.infinity_polling(timeout=30)
+        finally:
+            scheduler_task.cancel()
+            await ASYNC_SEARCH_CLIENT.close()
+            await self.bot.close_session()
+
+    def run(self):
+        asyncio.run(self.main())
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('bot.log', encoding='utf-8'),
+            logging.StreamHandler()
+        ]
+    )
+    DASHBOARD_URL = "https://datalens.yandex.cloud/3imlj6hgfqdqp?_theme=dark&_lang=ru"
+    TOKEN = os.environ["WB_BOT_TOKEN"]
+    AsyncWBTrackerBot(
+        token=TOKEN,
+        superset_dashboard_url=DASHBOARD_URL
+    ).run()
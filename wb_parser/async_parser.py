@@ -0,0 +1,162 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+import aiohttp
+from model import Items
+from parser import ParserWB
+from crawl_cache import CrawlSnapshot
+from wb_client import RETRY_STATUSES, WB_RATE_LIMITER, WBSearchClient
+
+# Как часто проверяется блокировка среза, которую держит другая проверка, сек
+LOCK_POLL_INTERVAL = 0.05
+
+
+class AsyncWBSearchClient(WBSearchClient):
+    """
+    Асинхронный клиент поиска WB на aiohttp с теми же повторами и общим лимитом запросов.
+    Сессия aiohttp создается при первом запросе внутри работающего event loop
+    """
+
+    def _create_session(self) -> Optional[aiohttp.ClientSession]:
+        # Вне event loop сессию aiohttp создавать нельзя, см. _get_session
+        return None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self.session
+
+    async def _acquire(self):
+        if self.rate_limiter is None:
+            return
+        delay = self.rate_limiter.try_acquire()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.rate_limiter.try_acquire()
+
+    async def get(self, params: Dict) -> Optional[Tuple[int, Optional[Dict]]]:
+        """
+        Выполняет запрос к поиску с повторами.
+        Возвращает (код ответа, JSON при коде 200) или None, если ни одна попытка не дошла до сервера
+        """
+        result = None
+        session = self._get_session()
+        for attempt in range(self.max_retries + 1):
+            await self._acquire()
+            try:
+                async with session.get(self.base_url, params=params) as response:
+                    status = response.status
+                    if status not in RETRY_STATUSES:
+                        payload = await response.json(content_type=None) if status == 200 else None
+                        return status, payload
+                    result = (status, None)
+                    retry_after = self._retry_after(response)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                result = None
+                delay = self._backoff(attempt)
+                self.logger.warning(
+                    f"[AsyncWBSearchClient] Ошибка сети (попытка {attempt + 1}): {str(e)}. Повтор через {delay:.1f} с"
+                )
+            else:
+                delay = retry_after if retry_after is not None else self._backoff(attempt)
+                self.logger.warning(
+                    f"[AsyncWBSearchClient] Код {status} (попытка {attempt + 1}). Повтор через {delay:.1f} с"
+                )
+                if status == 429 and self.rate_limiter is not None:
+                    self.rate_limiter.penalize(delay)
+                    delay = 0
+
+            if attempt < self.max_retries and delay > 0:
+                await asyncio.sleep(delay)
+        return result
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+
+class AsyncParserWB(ParserWB):
+    """
+    Асинхронный вариант ParserWB для работы в event loop.
+    Страницы загружаются через aiohttp, срезы берутся из того же кэша, что и
+    у синхронного парсера, а обращения к ClickHouse и SQLite выполняются в
+    потоках через asyncio.to_thread, чтобы не блокировать event loop
+    """
+
+    def __init__(self, query: str, async_client: Optional[AsyncWBSearchClient] = None, **kwargs):
+        super().__init__(query, **kwargs)
+        self.async_client = async_client if async_client is not None else ASYNC_SEARCH_CLIENT
+
+    async def _fetch_page_async(self, page: int) -> Optional[List]:
+        result = await self.async_client.get(self._page_params(page))
+        if not self._page_loaded(page, result[0] if result is not None else None):
+            return None
+        return self._decode_page(page, result[1])
+
+    async def _extend_snapshot_async(self, snapshot: CrawlSnapshot) -> bool:
+        batch = self._next_batch(snapshot)
+        if batch is None:
+            return True
+        # gather сохраняет порядок страниц независимо от порядка ответов
+        results = await asyncio.gather(*(self._fetch_page_async(page) for page in batch))
+        return self._append_pages(snapshot, batch, list(results))
+
+    async def iter_pages(self):
+        """Асинхронный аналог _iter_pages: (номер страницы, товары) строго по порядку"""
+        snapshot = self._open_snapshot()
+        index = 0
+        while True:
+            if index < len(snapshot.pages):
+                yield index + 1, snapshot.pages[index]
+                index += 1
+                continue
+            if snapshot.complete:
+                return
+            # Блокировку среза нельзя ждать блокирующе, иначе встанет весь event loop
+            while not snapshot.lock.acquire(blocking=False):
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+            try:
+                if index >= len(snapshot.pages) and not snapshot.complete:
+                    if not await self._extend_snapshot_async(snapshot):
+                        return
+            finally:
+                snapshot.lock.release()
+
+    async def find_products_positions(self, articles: List[int], query: str,
+                                      full_snapshot: bool = False) -> Dict[int, Optional[Dict]]:
+        """Асинхронный аналог ParserWB.find_products_positions"""
+        results = {article: None for article in articles}
+        try:
+            self.logger.info(f"[AsyncParserWB] Поиск товаров {list(results)} по запросу '{query}'")
+
+            full_snapshot = full_snapshot and await asyncio.to_thread(self._snapshot_due)
+
+            all_items = Items(products=[])
+            remaining = set(results)
+            position = 0
+            async for page, products in self.iter_pages():
+                if full_snapshot:
+                    all_items.products.extend(products)
+                for product in products:
+                    position += 1
+                    self._match_product(results, remaining, position, page, product)
+                if not remaining and not full_snapshot:
+                    break
+
+            await asyncio.to_thread(self._finish_search, results, remaining, all_items, query)
+
+        except Exception as e:
+            self.logger.error(f"[AsyncParserWB] Ошибка при поиске товаров {list(results)}: {str(e)}", exc_info=True)
+        return results
+
+    async def find_product_position(self, article: int, query: str, full_snapshot: bool = False) -> Optional[Dict]:
+        return (await self.find_products_positions([article], query, full_snapshot)).get(article)
+
+    async def get_product_history(self, article: int, query: str, days: int = 7,
+                                  resolution: Optional[str] = None) -> List[Dict]:
+        return await asyncio.to_thread(super().get_product_history, article, query, days, resolution)
+
+
+ASYNC_SEARCH_CLIENT = AsyncWBSearchClient(rate_limiter=WB_RATE_LIMITER)
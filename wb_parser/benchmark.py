@@ -0,0 +1,222 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+import logging
+from conversion_model import score_snapshot
+from model import Items
+from parser import ParserWB, DEFAULT_CONCURRENCY
+from replay import DEFAULT_FIXTURES_DIR, RecordingSearchClient, ReplayServer, list_recorded_queries
+from storage import SnapshotStorage, SQLiteStorage
+from wb_client import WB_RATE_LIMITER, WBSearchClient
+from write_dedup import SQLiteDedupStore
+
+# Задержки повторов для заглушки: ошибки внедряются намеренно, ждать их по-настоящему незачем
+REPLAY_BACKOFF_BASE = 0.01
+REPLAY_BACKOFF_MAX = 0.1
+
+
+class CrawlStats:
+    """Замеры одного обхода выдачи"""
+    __slots__ = ('query', 'pages', 'products', 'crawl_seconds', 'decode_seconds',
+                 'build_seconds', 'score_seconds', 'insert_seconds', 'peak_memory')
+
+    def __init__(self, query: str):
+        self.query = query
+        self.pages = 0
+        self.products = 0
+        self.crawl_seconds = 0.0
+        self.decode_seconds = 0.0
+        self.build_seconds = 0.0
+        self.score_seconds = 0.0
+        self.insert_seconds = 0.0
+        self.peak_memory = 0
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.pages / self.crawl_seconds if self.crawl_seconds else 0.0
+
+    @property
+    def products_per_second(self) -> float:
+        return self.products / self.crawl_seconds if self.crawl_seconds else 0.0
+
+    def as_dict(self) -> Dict:
+        return {
+            'query': self.query,
+            'pages': self.pages,
+            'products': self.products,
+            'crawl_seconds': self.crawl_seconds,
+            'pages_per_second': self.pages_per_second,
+            'products_per_second': self.products_per_second,
+            'decode_seconds': self.decode_seconds,
+            'build_seconds': self.build_seconds,
+            'score_seconds': self.score_seconds,
+            'insert_seconds': self.insert_seconds,
+            'peak_memory': self.peak_memory,
+        }
+
+
+class TimedParserWB(ParserWB):
+    """ParserWB, который считает суммарное время разбора и валидации страниц"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.decode_seconds = 0.0
+        self._decode_lock = threading.Lock()
+
+    def _decode_page(self, page: int, payload: Dict) -> List:
+        started = time.perf_counter()
+        try:
+            return super()._decode_page(page, payload)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._decode_lock:
+                self.decode_seconds += elapsed
+
+
+class OpenWriteWindow:
+    """
+    Окно записи для замеров (интерфейс write_dedup.SQLiteDedupStore), которое всегда свободно:
+    повторные прогоны одного запроса записывают срез каждый раз и замеряются одинаково
+    """
+
+    def is_due(self, query: str, interval: float) -> bool:
+        return True
+
+    def try_claim(self, query: str, interval: float, now: Optional[float] = None) -> Optional[float]:
+        return 0.0
+
+    def release(self, query: str, previous: float, claimed_at: Optional[float] = None):
+        pass
+
+
+def benchmark_query(query: str, search_client: WBSearchClient, storage: SnapshotStorage,
+                    strict: bool = True, concurrency: int = DEFAULT_CONCURRENCY,
+                    trace_memory: bool = True, dedup: Optional[SQLiteDedupStore] = None) -> CrawlStats:
+    """
+    Обходит выдачу по запросу без кэша и записывает срез в storage тем же путем,
+    что и ParserWB.parse: колонки, оценка конверсии, ParserWB.save_columns.
+    Окно записи по умолчанию всегда свободно (OpenWriteWindow); чтобы замерить
+    запись с настоящим окном, передайте dedup, например storage.write_dedup()
+    """
+    stats = CrawlStats(query)
+    parser = TimedParserWB(query, concurrency=concurrency, use_cache=False, search_client=search_client,
+                           strict=strict, storage=storage,
+                           dedup=dedup if dedup is not None else OpenWriteWindow())
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        items = Items(products=[])
+        started = time.perf_counter()
+        for _, products in parser._iter_pages():
+            stats.pages += 1
+            items.products.extend(products)
+        stats.crawl_seconds = time.perf_counter() - started
+        stats.products = len(items.products)
+        stats.decode_seconds = parser.decode_seconds
+
+        if items.products:
+            started = time.perf_counter()
+            columns = parser._build_columns(items, datetime.now())
+            stats.build_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            columns.append(score_snapshot(columns))
+            stats.score_seconds = time.perf_counter() - started
+
+            started = time.perf_counter()
+            saved = parser.save_columns(columns)
+            stats.insert_seconds = time.perf_counter() - started
+            if not saved:
+                raise RuntimeError(f"Срез по запросу '{query}' не записан в хранилище")
+    finally:
+        if trace_memory:
+            stats.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return stats
+
+
+def run_benchmark(queries: List[str], fixtures_dir: str = DEFAULT_FIXTURES_DIR, latency: float = 0.0,
+                  jitter: float = 0.0, error_rate: float = 0.0, strict: bool = True,
+                  concurrency: int = DEFAULT_CONCURRENCY, trace_memory: bool = True,
+                  storage_factory: Optional[Callable[[], SnapshotStorage]] = None,
+                  dedup: Optional[SQLiteDedupStore] = None) -> List[CrawlStats]:
+    """
+    Прогоняет обходы по записанным ответам через локальную заглушку поиска.
+    По умолчанию срезы пишутся во временную базу SQLite
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if storage_factory is None:
+            def storage_factory():
+                return SQLiteStorage(os.path.join(tmp_dir, 'benchmark.sqlite3'))
+        storage = storage_factory()
+
+        with ReplayServer(fixtures_dir, latency=latency, jitter=jitter, error_rate=error_rate) as server:
+            client = WBSearchClient(base_url=server.url, backoff_base=REPLAY_BACKOFF_BASE,
+                                    backoff_max=REPLAY_BACKOFF_MAX)
+            results = [
+                benchmark_query(query, client, storage, strict, concurrency, trace_memory, dedup)
+                for query in queries
+            ]
+    return results
+
+
+def record_queries(queries: List[str], fixtures_dir: str = DEFAULT_FIXTURES_DIR,
+                   concurrency: int = DEFAULT_CONCURRENCY):
+    """Один раз обходит живую выдачу и сохраняет ответы поиска для воспроизведения"""
+    client = RecordingSearchClient(fixtures_dir, rate_limiter=WB_RATE_LIMITER)
+    for query in queries:
+        parser = ParserWB(query, concurrency=concurrency, use_cache=False, search_client=client, strict=False)
+        pages = sum(1 for _ in parser._iter_pages())
+        parser.logger.info(f"[benchmark] Записано {pages} стр. по запросу '{query}' в {fixtures_dir}")
+
+
+def format_report(results: List[CrawlStats]) -> str:
+    header = (
+        f"{'запрос':<24} {'стр.':>5} {'товаров':>8} {'обход, с':>9} {'стр./с':>8} {'тов./с':>9} "
+        f"{'разбор, с':>10} {'колонки, с':>11} {'оценка, с':>10} {'вставка, с':>11} {'память, МБ':>11}"
+    )
+    lines = [header, '-' * len(header)]
+    for stats in results:
+        lines.append(
+            f"{stats.query[:24]:<24} {stats.pages:>5} {stats.products:>8} {stats.crawl_seconds:>9.3f} "
+            f"{stats.pages_per_second:>8.1f} {stats.products_per_second:>9.0f} {stats.decode_seconds:>10.3f} "
+            f"{stats.build_seconds:>11.3f} {stats.score_seconds:>10.3f} {stats.insert_seconds:>11.3f} {stats.peak_memory / 2 ** 20:>11.1f}"
+        )
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description='Запись выдачи WB и замеры обхода на записанных ответах')
+    arg_parser.add_argument('--fixtures', default=DEFAULT_FIXTURES_DIR, help='каталог с записанными ответами')
+    arg_parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+
+    record = commands.add_parser('record', help='записать ответы поиска по запросам')
+    record.add_argument('queries', nargs='+')
+
+    run = commands.add_parser('run', help='замерить обходы по записанным ответам')
+    run.add_argument('queries', nargs='*', help='по умолчанию все записанные запросы')
+    run.add_argument('--latency', type=float, default=0.0, help='задержка ответа заглушки, с')
+    run.add_argument('--jitter', type=float, default=0.0, help='случайная добавка к задержке, с')
+    run.add_argument('--error-rate', type=float, default=0.0, help='доля ответов 429/503')
+    run.add_argument('--fast', action='store_true', help='разбор ProductRecord вместо pydantic')
+    run.add_argument('--no-memory', action='store_true', help='не замерять пиковую память (tracemalloc замедляет обход)')
+
+    args = arg_parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if args.command == 'record':
+        logging.getLogger('WBTrackerBot').setLevel(logging.INFO)
+        record_queries(args.queries, args.fixtures, args.concurrency)
+    else:
+        report = run_benchmark(
+            args.queries or list_recorded_queries(args.fixtures), args.fixtures,
+            latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+            strict=not args.fast, concurrency=args.concurrency, trace_memory=not args.no_memory,
+        )
+        print(format_report(report))
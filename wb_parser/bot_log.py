@@ -1,15 +1,16 @@
 import telebot
-from telebot.types import ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton
-import schedule
+from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 import threading
 import time
-from datetime import datetime, timedelta
 from parser import ParserWB  
-import matplotlib
-matplotlib.use('Agg')  
-from matplotlib import pyplot as plt
-import matplotlib.dates as mdates
-import io
+from query_scheduler import QueryScheduler
+from insert_buffer import flush_buffers_if_due
+from tracking_store import TrackingStore
+from charts import ChartRenderer, position_chart_key
+from notifier import NotificationDispatcher
+from tracking import Tracker
+import tracking
+import messages
 import logging
 import os
 
@@ -22,11 +23,17 @@ class WBTrackerBot:
         self.logger.info("Инициализация бота...")
         
         self.bot = telebot.TeleBot(token)
-        # структура: {chat_id: {article: {query: {data}}}
-        self.tracked_items = {}  
+        # Отслеживания и шаги диалогов, общие с асинхронной версией бота
+        self.tracker = Tracker()
+        # Отслеживания хранятся на диске и восстанавливаются после перезапуска
+        self.store = TrackingStore()
         self.superset_dashboard_url = superset_dashboard_url
+        self.chart_renderer = ChartRenderer()
+        # Плановые уведомления уходят через очередь, чтобы проверки не ждали Telegram
+        self.notifier = NotificationDispatcher(self.bot)
         self.setup_handlers()
         
+        self.scheduler = QueryScheduler(self.check_query)
         self.scheduler_thread = threading.Thread(target=self.run_scheduler)
         self.scheduler_thread.daemon = True
         self.scheduler_thread.start()
@@ -55,100 +62,81 @@ class WBTrackerBot:
         @self.bot.message_handler(commands=['start'])
         def start(message):
             self.logger.info(f"Обработка команды /start от пользователя {message.chat.id}")
+            self.tracker.cancel(message.chat.id)
             self.show_main_menu(message.chat.id)
 
-        @self.bot.message_handler(func=lambda m: m.text == '📊 Добавить товар')
+        @self.bot.message_handler(func=lambda m: m.text == tracking.ADD_BUTTON)
         def add_product(message):
             self.logger.info(f"Пользователь {message.chat.id} начал добавление товара")
-            self.bot.send_message(message.chat.id, "Напишите запрос, в котором будет отслеживаться положение товара (например, 'шарф'):")
-            self.bot.register_next_step_handler(message, self.process_query)
+            self.bot.send_message(message.chat.id, self.tracker.start_adding(message.chat.id))
 
-        @self.bot.message_handler(func=lambda m: m.text == '📉 История отслеживания')
+        @self.bot.message_handler(func=lambda m: m.text == tracking.HISTORY_BUTTON)
         def show_history(message):
             self.logger.info(f"Пользователь {message.chat.id} запросил историю отслеживания")
             self.handle_history_request(message.chat.id)
         
-        @self.bot.message_handler(func=lambda m: m.text == '❌ Удалить отслеживание')
+        @self.bot.message_handler(func=lambda m: m.text == tracking.REMOVE_BUTTON)
         def remove_tracking(message):
             self.logger.info(f"Пользователь {message.chat.id} запросил удаление отслеживания")
             self.handle_remove_tracking_request(message.chat.id)
 
-        @self.bot.message_handler(func=lambda m: m.text == '📈 Аналитика')
+        @self.bot.message_handler(func=lambda m: m.text == tracking.ANALYTICS_BUTTON)
         def show_analytics(message):
             self.logger.info(f"Пользователь {message.chat.id} запросил аналитику")
+            self.tracker.cancel(message.chat.id)
             markup = InlineKeyboardMarkup()
             markup.add(InlineKeyboardButton(text="Открыть аналитику 📊", url=self.superset_dashboard_url))
             self.bot.send_message(message.chat.id, "Нажмите кнопку ниже, чтобы открыть полную аналитику:", reply_markup=markup)
+
+        # Ответы на шаги диалога: сами шаги ведет общий с асинхронным ботом Tracker
+        @self.bot.message_handler(func=lambda m: self.tracker.waiting(m.chat.id))
+        def next_step(message):
+            try:
+                self.handle_reply(message.chat.id, self.tracker.handle(message.chat.id, message.text))
+            except Exception as e:
+                self.logger.error(f"Ошибка при обработке сообщения: {str(e)}", exc_info=True)
+                self.bot.send_message(message.chat.id, "Произошла ошибка при обработке запроса.")
+
+    def handle_reply(self, chat_id, reply):
+        """Отправляет ответ на шаг диалога и выполняет выбранное пользователем действие"""
+        if reply.text:
+            self.bot.send_message(chat_id, reply.text)
+        if reply.action == tracking.ACTION_MENU:
+            self.show_main_menu(chat_id)
+        elif reply.action == tracking.ACTION_HISTORY_MENU:
+            self.handle_history_request(chat_id)
+        elif reply.action == tracking.ACTION_HISTORY:
+            self.send_product_history(chat_id, *reply.args)
+        elif reply.action == tracking.ACTION_REMOVE:
+            self.remove_product(chat_id, *reply.args)
+        elif reply.action == tracking.ACTION_TRACK:
+            self.add_product(chat_id, *reply.args)
     
     def show_main_menu(self, chat_id):
         try:
-            markup = ReplyKeyboardMarkup(resize_keyboard=True)
-            markup.add('📊 Добавить товар', '📈 Аналитика')
-            markup.add('❌ Удалить отслеживание','📉 История отслеживания')
-            self.bot.send_message(chat_id, "Выберите действие:", reply_markup=markup)
+            self.bot.send_message(chat_id, "Выберите действие:", reply_markup=tracking.main_menu_markup())
             self.logger.info(f"Отображено главное меню для пользователя {chat_id}")
         except Exception as e:
             self.logger.error(f"Ошибка при отображении главного меню: {str(e)}", exc_info=True)
             raise
 
-    def handle_history_request(self, chat_id):
-        """Обрабатывает запрос на просмотр истории"""
+    def show_selection(self, chat_id, step):
+        """Показывает кнопки выбора отслеживаемого товара для шага step"""
         try:
-            if chat_id not in self.tracked_items or not self.tracked_items[chat_id]:
-                self.bot.send_message(chat_id, "У вас нет отслеживаемых товаров.")
+            text, labels = self.tracker.start_selection(chat_id, step)
+            if not labels:
+                self.bot.send_message(chat_id, text)
                 self.logger.info(f"Пользователь {chat_id} не имеет отслеживаемых товаров")
                 return
-            
-            markup = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-            
-            for article in self.tracked_items[chat_id]:
-                if isinstance(article, int): 
-                    queries = self.tracked_items[chat_id][article]
-                    for query, data in queries.items():
-                        markup.add(f"История: {article} ({query})")
-            
-            markup.add("↩️ Назад")
-            self.bot.send_message(
-                chat_id, 
-                "Выберите товар для просмотра истории:\n(Указан артикул и запрос)",
-                reply_markup=markup
-            )
-            self.bot.register_next_step_handler_by_chat_id(chat_id, self.process_history_selection)
-            self.logger.info(f"Пользователю {chat_id} показаны варианты истории")
+            self.bot.send_message(chat_id, text, reply_markup=tracking.selection_markup(labels))
+            self.logger.info(f"Пользователю {chat_id} показаны отслеживаемые товары")
         except Exception as e:
-            self.logger.error(f"Ошибка при обработке запроса истории: {str(e)}", exc_info=True)
+            self.logger.error(f"Ошибка при обработке запроса: {str(e)}", exc_info=True)
             self.bot.send_message(chat_id, "Произошла ошибка при обработке запроса.")
 
-    def process_history_selection(self, message):
-        """Обрабатывает выбор товара для просмотра истории"""
-        try:
-            if message.text == "↩️ Назад":
-                self.show_main_menu(message.chat.id)
-                return
-            
-            self.logger.info(f"Пользователь {message.chat.id} выбрал: {message.text}")
-            
-            parts = message.text.split('(')
-            article = int(parts[0].split(':')[1].strip())
-            query = parts[1].replace(')', '').strip()
-            
-            chat_id = message.chat.id
-            
-            if (chat_id in self.tracked_items and 
-                article in self.tracked_items[chat_id] and 
-                query in self.tracked_items[chat_id][article]):
-                self.send_product_history(chat_id, article, query)
-            else:
-                self.bot.send_message(chat_id, "Товар не найден в вашем списке отслеживания.")
-                self.logger.warning(f"Товар {article} не найден для пользователя {chat_id}")
-        
-        except Exception as e:
-            self.logger.error(f"Ошибка при обработке выбора истории: {str(e)}", exc_info=True)
-            self.bot.send_message(
-                message.chat.id, 
-                "Некорректный формат. Используйте кнопки для выбора."
-            )
-            self.handle_history_request(message.chat.id)
+    def handle_history_request(self, chat_id):
+        """Обрабатывает запрос на просмотр истории"""
+        self.show_selection(chat_id, tracking.STEP_HISTORY)
 
     def send_product_history(self, chat_id, article, query):
         """Отправляет историю позиций товара с графиком за последние 7 дней"""
@@ -156,252 +144,67 @@ class WBTrackerBot:
             self.logger.info(f"Формирование истории для товара {article} по запросу '{query}'")
             
             parser = ParserWB(query)
-            history = parser.get_product_history(article, query)
-            
-            if not history:
-                self.bot.send_message(chat_id, f"Для товара {article} нет данных истории.")
-                self.show_main_menu(chat_id)
-                self.logger.warning(f"Нет данных истории для товара {article}")
-                return
+            # Окно и почасовая агрегация считаются в ClickHouse, приходят только точки графика
+            history_sorted = parser.get_product_history(article, query, days=tracking.HISTORY_DAYS, resolution='hour')
             
-            days_ago = datetime.now() - timedelta(days=7)
-            recent_history = [entry for entry in history if entry['date'] >= days_ago]
-            
-            if not recent_history:
-                self.bot.send_message(chat_id, f"Для товара {article} нет данных за последние 7 дней.")
+            if not history_sorted:
+                self.bot.send_message(chat_id, f"Для товара {article} нет данных за последние {tracking.HISTORY_DAYS} дней.")
                 self.show_main_menu(chat_id)
-                self.logger.warning(f"Нет данных за 7 дней для товара {article}")
+                self.logger.warning(f"Нет данных за {tracking.HISTORY_DAYS} дней для товара {article}")
                 return
-                
-            history_sorted = sorted(recent_history, key=lambda x: x['date'])
-            dates = [entry['date'] for entry in history_sorted]
-            positions = [entry['position'] for entry in history_sorted]
-            
-            plt.figure(figsize=(12, 6))            
-            plt.plot(dates, positions, 'b-', marker='o', linewidth=2, markersize=8)
-            
-            plt.gca().invert_yaxis()
-            plt.title(f'Динамика позиции товара {article}\nпо запросу "{query}"', pad=20)
-            plt.xlabel('Дата')
-            plt.ylabel('Позиция в каталоге')
-            plt.grid(True, linestyle='--', alpha=0.3)
-            
-            plt.gca().xaxis.set_major_formatter(mdates.DateFormatter('%d.%m.%y'))
-            plt.gca().xaxis.set_major_locator(mdates.DayLocator(interval=1))
-            plt.xticks(rotation=45, ha='right', fontsize=8)
-            
-            if len(positions) > 0:
-                min_pos = min(positions)
-                max_pos = max(positions)
-                min_idx = positions.index(min_pos)
-                max_idx = positions.index(max_pos)
-                plt.annotate(f'Лучшая: {min_pos}',
-                            xy=(dates[min_idx], min_pos),
-                            xytext=(10, 20), textcoords='offset points',
-                            bbox=dict(boxstyle='round,pad=0.5', fc='lime', alpha=0.7),
-                            arrowprops=dict(arrowstyle='->'))
-                plt.annotate(f'Худшая: {max_pos}',
-                            xy=(dates[max_idx], max_pos),
-                            xytext=(10, -30), textcoords='offset points',
-                            bbox=dict(boxstyle='round,pad=0.5', fc='red', alpha=0.3),
-                            arrowprops=dict(arrowstyle='->'))
-            plt.tight_layout()
             
-            buf = io.BytesIO()
-            plt.savefig(buf, format='png', dpi=120, bbox_inches='tight')
-            buf.seek(0)
-            plt.close()
-    
-            history_text = f"📊 История позиций товара {article} по запросу '{query}':\n\n"
-            
-            current_date = None
-            for entry in history_sorted:
-                entry_date = entry['date'].strftime('%d.%m.%Y')
-                if entry_date != current_date:
-                    history_text += f"\n📅 {entry_date}:\n"
-                    current_date = entry_date
-                
-                history_text += (
-                    f"🕒 {entry['date'].strftime('%H:%M')}: "
-                    f"Позиция {entry['position']} | "
-                    f"Цена: {entry['price']} руб | "
-                    f"Отзывы: {entry['feedbacks']}\n"
-                )
+            self.bot.send_message(chat_id, messages.history_text(article, query, history_sorted))
             
-            self.bot.send_message(chat_id, history_text[:4000])
-            self.bot.send_photo(chat_id, photo=buf, 
-                            caption=f'📈 График изменения позиции товара {article}\n'
-                                    f'Запрос: "{query}" (7 дней)')
-            
-            self.show_main_menu(chat_id)
-            self.logger.info(f"История для товара {article} успешно отправлена пользователю {chat_id}")
+            # График рисуется в пуле процессов и отправляется по готовности,
+            # обработчик сообщений не ждет отрисовку
+            chart_args = tracking.history_chart_args(article, query, history_sorted)
+            chart = self.chart_renderer.render(position_chart_key(*chart_args), *chart_args)
+            chart.add_done_callback(lambda done: self.send_history_chart(chat_id, article, query, done))
             
         except Exception as e:
             self.logger.error(f"Ошибка при получении истории: {str(e)}", exc_info=True)
             self.bot.send_message(chat_id, f"Произошла ошибка при построении графика для товара {article}.")
             self.show_main_menu(chat_id)
+
+    def send_history_chart(self, chat_id, article, query, chart):
+        """Отправляет готовый график истории позиций"""
+        try:
+            self.bot.send_photo(chat_id, photo=chart.result(), caption=messages.chart_caption(article, query, tracking.HISTORY_DAYS))
+            self.logger.info(f"История для товара {article} успешно отправлена пользователю {chat_id}")
+        except Exception as e:
+            self.logger.error(f"Ошибка при построении графика: {str(e)}", exc_info=True)
+            self.bot.send_message(chat_id, f"Произошла ошибка при построении графика для товара {article}.")
+        self.show_main_menu(chat_id)
     
     def handle_remove_tracking_request(self, chat_id):
         """Обрабатывает запрос на удаление отслеживания"""
-        try:
-            if chat_id not in self.tracked_items or not self.tracked_items[chat_id]:
-                self.bot.send_message(chat_id, "У вас нет отслеживаемых товаров.")
-                self.logger.info(f"Пользователь {chat_id} не имеет товаров для удаления")
-                return
-            
-            has_items_to_remove = any(
-                isinstance(key, int) for key in self.tracked_items[chat_id].keys()
-            )
-        
-            if not has_items_to_remove:
-                self.bot.send_message(chat_id, "У вас нет отслеживаемых товаров.")
-                self.logger.info(f"Пользователь {chat_id} не имеет товаров для удаления")
-                return
-            
-            markup = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
-            
-            for key, value in self.tracked_items[chat_id].items():
-                if isinstance(key, int):  # Это артикул товара
-                    article = key
-                    for query in value.keys():
-                        markup.add(f"Удалить: {article} ({query})")
-                
-            markup.add("↩️ Назад")
-            self.bot.send_message(
-                chat_id, 
-                "Выберите товар для удаления отслеживания:\n(Указан артикул и запрос)",
-                reply_markup=markup
-            )
-            self.bot.register_next_step_handler_by_chat_id(chat_id, self.process_remove_selection)
-            self.logger.info(f"Пользователю {chat_id} показаны варианты для удаления")
-        except Exception as e:
-            self.logger.error(f"Ошибка при обработке запроса на удаление: {str(e)}", exc_info=True)
-            self.bot.send_message(chat_id, "Произошла ошибка при обработке запроса.")
+        self.show_selection(chat_id, tracking.STEP_REMOVE)
 
-    def process_remove_selection(self, message):
-        """Обрабатывает выбор товара для удаления"""
+    def remove_product(self, chat_id, article, query):
+        """Удаляет отслеживание товара, выбранное пользователем"""
         try:
-            if message.text == "↩️ Назад":
-                self.show_main_menu(message.chat.id)
-                return
-            
-            self.logger.info(f"Пользователь {message.chat.id} выбрал удаление: {message.text}")
-            
-            parts = message.text.split('(')
-            article = int(parts[0].split(':')[1].strip())
-            query = parts[1].replace(')', '').strip()
-            
-            chat_id = message.chat.id
-            
-            if (chat_id in self.tracked_items and 
-                article in self.tracked_items[chat_id] and 
-                query in self.tracked_items[chat_id][article]):
-                
-                job_tag = f'track_{chat_id}_{article}_{query}'
-                schedule.clear(job_tag)
-                
-                del self.tracked_items[chat_id][article][query]
-                
-                if not self.tracked_items[chat_id][article]:
-                    del self.tracked_items[chat_id][article]
-                
-                self.bot.send_message(chat_id, f"✅ Отслеживание товара {article} по запросу '{query}' удалено.")
-                self.logger.info(f"Удалено отслеживание товара {article} для пользователя {chat_id}")
-            else:
-                self.bot.send_message(chat_id, "Товар не найден в вашем списке отслеживания.")
-                self.logger.warning(f"Товар {article} не найден для удаления у пользователя {chat_id}")
-        
+            self.scheduler.remove(chat_id, article, query)
+            self.store.remove(chat_id, article, query)
+            self.tracker.untrack(chat_id, article, query)
+            self.bot.send_message(chat_id, f"✅ Отслеживание товара {article} по запросу '{query}' удалено.")
+            self.logger.info(f"Удалено отслеживание товара {article} для пользователя {chat_id}")
         except Exception as e:
             self.logger.error(f"Ошибка при обработке удаления: {str(e)}", exc_info=True)
-            self.bot.send_message(
-                message.chat.id, 
-                "Некорректный формат. Используйте кнопки для выбора."
-            )
-        
-        self.show_main_menu(message.chat.id)
-
-    def process_query(self, message):
-        try:
-            query = message.text.lower()
-            chat_id = message.chat.id
-            
-            self.logger.info(f"Пользователь {chat_id} ввел запрос: {query}")
-            
-            if query.isdigit():
-                self.bot.send_message(
-                    chat_id,
-                    "❌ Вы ввели число (похоже на артикул товара).\n"
-                    "Пожалуйста, введите текстовый поисковый запрос (например, 'шарфы', 'зимние куртки')."
-                )
-                self.logger.warning(f"Пользователь {chat_id} ввел число вместо запроса")
-                return
-            
-            if len(query) < 2:
-                self.bot.send_message(chat_id, "❌ Слишком короткий запрос. Введите минимум 2 символа.")
-                self.logger.warning(f"Слишком короткий запрос от пользователя {chat_id}")
-                return
-
-            if chat_id not in self.tracked_items:
-                self.tracked_items[chat_id] = {}
-            
-            self.tracked_items[chat_id]['current_query'] = query
-            
-            self.bot.send_message(chat_id, "Теперь отправьте артикул товара WB, который вы хотите отслеживать:")
-            self.bot.register_next_step_handler(message, lambda m: self.process_article(m, query))
-            self.logger.info(f"Запрос '{query}' принят, ожидаем артикул от пользователя {chat_id}")
-            
-        except Exception as e:
-            self.logger.error(f"Ошибка при обработке запроса: {str(e)}", exc_info=True)
-            self.bot.send_message(message.chat.id, "Произошла ошибка при обработке запроса.")
+            self.bot.send_message(chat_id, "Произошла ошибка при удалении отслеживания.")
+        self.show_main_menu(chat_id)
 
-    def process_article(self, message, query):
+    def add_product(self, chat_id, article, query, frequency):
+        """Ставит товар на отслеживание и сразу сообщает его текущую позицию"""
         try:
-            article = int(message.text)
-            chat_id = message.chat.id
-            
-            self.logger.info(f"Пользователь {chat_id} ввел артикул: {article}")
-            
-            if chat_id not in self.tracked_items:
-                self.tracked_items[chat_id] = {}
-            
-            self.bot.send_message(chat_id, "Укажите периодичность проверок в день (например, 4):")
-            self.bot.register_next_step_handler(
-                message, 
-                lambda m: self.process_frequency(m, query, article)
-            )
-            self.logger.info(f"Артикул {article} принят, ожидаем частоту проверок от пользователя {chat_id}")
-            
-        except ValueError:
-            self.logger.warning(f"Некорректный артикул от пользователя {message.chat.id}")
-            self.bot.send_message(message.chat.id, "Некорректный артикул. Попробуйте снова.")
-        except Exception as e:
-            self.logger.error(f"Ошибка при обработке артикула: {str(e)}", exc_info=True)
-            self.bot.send_message(message.chat.id, "Произошла ошибка при обработке артикула.")
-
-    def process_frequency(self, message, query, article):
-        try:
-            frequency = int(message.text)
-            chat_id = message.chat.id
-            
             self.logger.info(f"Пользователь {chat_id} указал частоту проверок: {frequency}")
             
-            if frequency < 1 or frequency > 24:
-                raise ValueError("Частота должна быть от 1 до 24 раз в день")
-            
             search_msg = self.bot.send_message(
                 chat_id, 
                 f"🔍 Идет поиск товара в каталоге по запросу '{query}'..."
             )
             
-            if chat_id not in self.tracked_items:
-                self.tracked_items[chat_id] = {}
-            if article not in self.tracked_items[chat_id]:
-                self.tracked_items[chat_id][article] = {}
-            
-            self.tracked_items[chat_id][article][query] = {
-                'frequency': frequency,
-                'last_position': None
-            }
+            self.tracker.track(chat_id, article, query, frequency)
+            self.store.add(chat_id, article, query, frequency)
             
             self.check_product_position(chat_id, article, query)
             
@@ -417,82 +220,66 @@ class WBTrackerBot:
             
             self.logger.info(f"Товар {article} успешно добавлен в отслеживание для пользователя {chat_id}")
             
-        except ValueError as e:
-            self.logger.warning(f"Некорректная частота проверок от пользователя {message.chat.id}: {str(e)}")
-            self.bot.send_message(message.chat.id, f"Ошибка: {str(e)}. Попробуйте снова.")
         except Exception as e:
             self.logger.error(f"Ошибка при добавлении товара: {str(e)}", exc_info=True)
-            self.bot.send_message(message.chat.id, f"Произошла ошибка: {str(e)}")
+            self.bot.send_message(chat_id, f"Произошла ошибка: {str(e)}")
 
     def check_product_position(self, chat_id, article, query):
         """Проверяет текущую позицию товара"""
-        try:
-            self.logger.info(f"Проверка позиции товара {article} по запросу '{query}' для пользователя {chat_id}")
-            
-            parser = ParserWB(query)
-            result = parser.find_product_position(article, query)
-            
-            if not result:
-                self.bot.send_message(chat_id, f"❌ Товар {article} не найден по запросу '{query}'")
-                self.logger.warning(f"Товар {article} не найден по запросу '{query}'")
-                return
-            
-            current_position = result['position']
-            product_data = result.get('product_data', {})
-            last_position = self.tracked_items[chat_id][article][query].get('last_position')
-            
-            if last_position is None:
-                self.bot.send_message(
-                    chat_id,
-                    f"🔍 Товар {article} по запросу '{query}':\n"
-                    f"Текущая позиция: {current_position}\n"
-                    f"Название: {product_data.get('name', 'Неизвестно')}\n"
-                    f"Цена: {product_data.get('price', 'Неизвестно')} руб"
-                )
-                self.logger.info(f"Первая проверка товара {article}: позиция {current_position}")
-            elif current_position != last_position:
-                change = last_position - current_position
-                arrow = "⬆️" if change > 0 else "⬇️"
-                self.bot.send_message(
-                    chat_id,
-                    f"🔄 Изменение позиции товара {article} по запросу '{query}':\n"
-                    f"Было: {last_position} → Стало: {current_position} {arrow}\n"
-                    f"Изменение: {abs(change)} позиций\n"
-                    f"Название: {product_data.get('name', 'Неизвестно')}\n"
-                    f"Цена: {product_data.get('price', 'Неизвестно')} руб"
-                )
-                self.logger.info(f"Изменение позиции товара {article}: {last_position} → {current_position}")
-            
-            self.tracked_items[chat_id][article][query]['last_position'] = current_position
-            
-        except Exception as e:
-            self.logger.error(f"Ошибка при проверке товара {article}: {str(e)}", exc_info=True)
-            self.bot.send_message(chat_id, f"⚠️ Ошибка при проверке товара {article}: {str(e)}")
+        self.logger.info(f"Проверка позиции товара {article} по запросу '{query}' для пользователя {chat_id}")
+        
+        parser = ParserWB(query, strict=False, buffered=True)
+        result = parser.find_product_position(article, query, full_snapshot=True)
+        notifications, positions = self.tracker.check_results(query, [(chat_id, article)], {article: result})
+        # Ответ на действие пользователя отправляется сразу, а не через очередь уведомлений
+        for notification_chat_id, text in notifications:
+            self.bot.send_message(notification_chat_id, text)
+        self.store.update_positions(positions)
+
+    def check_query(self, query, subscriptions):
+        """Проверяет позиции всех отслеживаемых товаров по запросу за один обход выдачи"""
+        self.logger.info(f"Проверка запроса '{query}': {len(subscriptions)} отслеживаний")
+        
+        parser = ParserWB(query, strict=False, buffered=True)
+        articles = list({subscription.article for subscription in subscriptions})
+        results = parser.find_products_positions(articles, query, full_snapshot=True)
+        
+        targets = [(subscription.chat_id, subscription.article) for subscription in subscriptions]
+        notifications, positions = self.tracker.check_results(query, targets, results, parser.last_diff)
+        for chat_id, text in notifications:
+            self.notifier.send(chat_id, text)
+        self.store.update_positions(positions)
 
     def setup_schedule(self, chat_id, article, query, frequency_per_day):
         """Настраивает расписание проверок"""
         try:
-            interval = max(1, 24 // frequency_per_day)
+            interval = tracking.check_interval(frequency_per_day)
+            self.scheduler.add(chat_id, article, query, interval)
             
-            job_tag = f'track_{chat_id}_{article}_{query}'
-            schedule.clear(job_tag)
-            
-            schedule.every(interval).hours.do(
-                self.check_product_position, 
-                chat_id, article, query
-            ).tag(job_tag)
-            
-            self.logger.info(f"Настроено расписание для товара {article}: проверка каждые {interval} часов")
+            self.logger.info(f"Настроено расписание для товара {article}: проверка каждые {interval // 3600} часов")
         except Exception as e:
             self.logger.error(f"Ошибка при настройке расписания: {str(e)}", exc_info=True)
             raise
 
+    def restore_tracking(self):
+        """Восстанавливает отслеживания из хранилища и массово ставит их в расписание"""
+        try:
+            started_at = time.monotonic()
+            subscriptions = self.tracker.restore(self.store.iter_all())
+            self.scheduler.add_many(subscriptions)
+            self.logger.info(
+                f"Восстановлено {len(subscriptions)} отслеживаний за {time.monotonic() - started_at:.2f} с"
+            )
+        except Exception as e:
+            self.logger.error(f"Ошибка при восстановлении отслеживаний: {str(e)}", exc_info=True)
+
     def run_scheduler(self):
         """Запуск планировщика задач"""
         self.logger.info("Запуск планировщика задач")
         while True:
             try:
-                schedule.run_pending()
+                self.scheduler.run_pending()
+                flush_buffers_if_due()
                 time.sleep(1)
             except Exception as e:
                 self.logger.error(f"Ошибка в планировщике: {str(e)}", exc_info=True)
@@ -501,6 +288,9 @@ class WBTrackerBot:
     def run(self):
         """Основной цикл работы бота"""
         self.logger.info("Запуск бота")
+        # Отслеживания восстанавливаются до опроса Telegram: иначе восстановление
+        # перезаписало бы отслеживания, которые пользователи успели изменить
+        self.restore_tracking()
         while True:
             try:
                 self.bot.polling(none_stop=True, timeout=30)
@@ -0,0 +1,152 @@
+import io
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from typing import Hashable, List
+import logging
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import matplotlib.dates as mdates
+
+# Количество процессов отрисовки графиков
+DEFAULT_WORKERS = 2
+# Сколько готовых PNG хранится в памяти
+DEFAULT_CACHE_SIZE = 256
+
+
+def render_position_chart(article: int, query: str, dates: List[datetime], positions: List[int],
+                          min_positions: List[int], max_positions: List[int]) -> bytes:
+    """
+    Рисует график позиции товара и возвращает PNG.
+    Использует объектный API Figure без глобального состояния pyplot,
+    поэтому безопасно вызывается из нескольких потоков и процессов
+    """
+    fig = Figure(figsize=(12, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    # Интервалы без замеров позиции (None) на графике пропускаются
+    points = [
+        (date, position, low, high)
+        for date, position, low, high in zip(dates, positions, min_positions, max_positions)
+        if position is not None
+    ]
+    dates = [point[0] for point in points]
+    positions = [point[1] for point in points]
+
+    # Линия — средняя позиция за интервал, полоса — от лучшей до худшей позиции в нем
+    band = [(date, low, high) for date, _, low, high in points if low is not None and high is not None]
+    if band:
+        ax.fill_between([point[0] for point in band], [point[1] for point in band], [point[2] for point in band],
+                        color='b', alpha=0.15, label='Разброс за интервал')
+    ax.plot(dates, positions, 'b-', marker='o', linewidth=2, markersize=8, label='Средняя позиция')
+
+    ax.invert_yaxis()
+    ax.set_title(f'Динамика позиции товара {article}\nпо запросу "{query}"', pad=20)
+    ax.set_xlabel('Дата')
+    ax.set_ylabel('Позиция в каталоге')
+    ax.grid(True, linestyle='--', alpha=0.3)
+
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%d.%m.%y'))
+    ax.xaxis.set_major_locator(mdates.DayLocator(interval=1))
+    for label in ax.get_xticklabels():
+        label.set_rotation(45)
+        label.set_horizontalalignment('right')
+        label.set_fontsize(8)
+
+    if len(positions) > 0:
+        # Подписываются точки самой линии, а не границы полосы
+        min_pos = min(positions)
+        max_pos = max(positions)
+        min_idx = positions.index(min_pos)
+        max_idx = positions.index(max_pos)
+        ax.legend(loc='lower right')
+        ax.annotate(f'Лучшая: {round(min_pos, 1):g}',
+                    xy=(dates[min_idx], min_pos),
+                    xytext=(10, 20), textcoords='offset points',
+                    bbox=dict(boxstyle='round,pad=0.5', fc='lime', alpha=0.7),
+                    arrowprops=dict(arrowstyle='->'))
+        ax.annotate(f'Худшая: {round(max_pos, 1):g}',
+                    xy=(dates[max_idx], max_pos),
+                    xytext=(10, -30), textcoords='offset points',
+                    bbox=dict(boxstyle='round,pad=0.5', fc='red', alpha=0.3),
+                    arrowprops=dict(arrowstyle='->'))
+    fig.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=120, bbox_inches='tight')
+    return buf.getvalue()
+
+
+def position_chart_key(article: int, query: str, dates: List[datetime], positions: List[int],
+                       min_positions: List[int], max_positions: List[int]) -> Hashable:
+    """
+    Ключ кэша графика render_position_chart — сами точки графика.
+    Время последней точки не подходит: точка почасового агрегата
+    меняется, пока в ее час дописываются новые замеры
+    """
+    return article, query, tuple(dates), tuple(positions), tuple(min_positions), tuple(max_positions)
+
+
+class ChartRenderer:
+    """
+    Отрисовка графиков в пуле процессов с кэшем готовых PNG.
+    Ключ кэша должен однозначно описывать данные графика (см. position_chart_key)
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_WORKERS, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.logger = logging.getLogger('WBTrackerBot')
+        self.max_workers = max_workers
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Процессы запускаются при первом графике, а не при старте бота.
+        # spawn, а не fork: у бота уже работают потоки, и копия процесса могла бы
+        # унаследовать захваченную ими блокировку (логирования, пула соединений)
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._executor
+
+    def render(self, key: Hashable, *args) -> Future:
+        """
+        Возвращает Future с PNG графика render_position_chart(*args).
+        Готовый график берется из кэша, одинаковые одновременные запросы рисуются один раз
+        """
+        with self._lock:
+            png = self._cache.get(key)
+            if png is not None:
+                self._cache.move_to_end(key)
+                self.logger.debug(f"[ChartRenderer] График {key} взят из кэша")
+                future = Future()
+                future.set_result(png)
+                return future
+
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+
+            future = self._get_executor().submit(render_position_chart, *args)
+            self._pending[key] = future
+        future.add_done_callback(lambda done: self._store(key, done))
+        return future
+
+    def _store(self, key: Hashable, future: Future):
+        with self._lock:
+            self._pending.pop(key, None)
+            if future.cancelled() or future.exception() is not None:
+                return
+            self._cache[key] = future.result()
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
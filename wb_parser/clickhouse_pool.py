@@ -0,0 +1,91 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from clickhouse_driver import Client
+import logging
+
+CLICKHOUSE_SETTINGS = {
+    'host': '195.133.194.116',
+    'port': 9000,
+    'user': 'default',
+    'password': '1234',
+    'settings': {'connect_timeout': 10},
+}
+# Максимальное количество одновременно открытых соединений
+DEFAULT_POOL_SIZE = 8
+# Соединения, простоявшие дольше, закрываются: сервер мог их уже оборвать, сек
+MAX_IDLE_TIME = 300
+
+
+class ClickHousePool:
+    """
+    Потокобезопасный пул клиентов ClickHouse.
+    Клиент подключается к серверу только при первом запросе, проверка
+    соединения выполняется драйвером перед запросом. Клиент, на котором
+    запрос завершился ошибкой или был прерван, в пул не возвращается
+    """
+
+    def __init__(self, max_size: int = DEFAULT_POOL_SIZE, **client_kwargs):
+        self.logger = logging.getLogger('WBTrackerBot')
+        self.max_size = max_size
+        self.client_kwargs = client_kwargs
+        # LIFO: чаще используются недавно освобожденные и, значит, живые соединения
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def _take(self) -> Client:
+        while True:
+            try:
+                client, released_at = self._idle.get_nowait()
+            except queue.Empty:
+                self.logger.debug("[ClickHousePool] Создание нового клиента ClickHouse")
+                return Client(**self.client_kwargs)
+            if time.monotonic() - released_at <= MAX_IDLE_TIME:
+                return client
+            client.disconnect()
+
+    @contextmanager
+    def connection(self):
+        """Выдает клиента из пула на время блока with"""
+        self._slots.acquire()
+        client = None
+        try:
+            client = self._take()
+            yield client
+        except BaseException:
+            # В том числе GeneratorExit: у клиента недочитанного execute_iter
+            # в сокете остаются блоки результата, и вернуть его в пул нельзя
+            if client is not None:
+                client.disconnect()
+                client = None
+            raise
+        finally:
+            if client is not None:
+                self._idle.put((client, time.monotonic()))
+            self._slots.release()
+
+    def execute(self, *args, **kwargs):
+        with self.connection() as client:
+            return client.execute(*args, **kwargs)
+
+    def execute_iter(self, *args, **kwargs):
+        """
+        Отдает строки результата по мере чтения с сервера (блоками max_block_size).
+        Соединение занято, пока результат не дочитан или генератор не закрыт.
+        Если генератор закрыт раньше, соединение разрывается, а не возвращается в пул
+        """
+        with self.connection() as client:
+            yield from client.execute_iter(*args, **kwargs)
+
+    def close(self):
+        """Закрывает все свободные соединения"""
+        while True:
+            try:
+                client, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            client.disconnect()
+
+
+CLICKHOUSE_POOL = ClickHousePool(**CLICKHOUSE_SETTINGS)
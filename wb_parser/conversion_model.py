@@ -0,0 +1,172 @@
+import argparse
+import os
+import time
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence
+import logging
+import numpy as np
+from history_frame import HEADERS, clean_history
+from schema import DATA_COLUMNS
+
+# Файл обученной модели, путь можно переопределить переменной окружения
+DEFAULT_MODEL_PATH = os.environ.get('WB_CONVERSION_MODEL', 'conversion_model.npz')
+
+# Признаки, которые нужны гипотезам README и которых нет среди столбцов тетрадки
+DERIVED_FEATURES = {
+    # сезонность: месяц замера на окружности, чтобы декабрь был рядом с январем
+    'месяц (sin)': lambda frame: np.sin(2 * np.pi * _month(frame) / 12),
+    'месяц (cos)': lambda frame: np.cos(2 * np.pi * _month(frame) / 12),
+}
+# Столбцы, из которых считается конверсия (см. conversion_target). Среди признаков
+# их быть не может: модель выучила бы саму формулу целевой переменной
+TARGET_COLUMNS = (HEADERS['number_of_feedbacks'], HEADERS['viewFlags'])
+# Признаки модели по умолчанию: продвижение, позиция, рейтинг, цвета, цена, остатки, сезонность
+DEFAULT_FEATURES = tuple(
+    HEADERS[name] for name in (
+        'promotion', 'promoPosition', 'position', 'cpm', 'promoTextCard', 'reviewRating',
+        'colors', 'price', 'totalQuantity',
+    )
+) + tuple(DERIVED_FEATURES)
+
+
+def _month(frame: Dict[str, np.ndarray]) -> np.ndarray:
+    return (frame[HEADERS['created_at']].astype('datetime64[M]').astype(np.int64) % 12).astype(np.float64)
+
+
+def feature_matrix(frame: Dict[str, np.ndarray], features: Sequence[str]) -> np.ndarray:
+    """Матрица признаков (строки × features) из очищенного среза (см. history_frame.clean_history)"""
+    return np.column_stack([
+        DERIVED_FEATURES[name](frame) if name in DERIVED_FEATURES else frame[name].astype(np.float64)
+        for name in features
+    ])
+
+
+def conversion_target(frame: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Конверсия по формуле README: покупки (принимаются равными числу отзывов) / просмотры.
+    Для товаров без просмотров — nan
+    """
+    views = frame[HEADERS['viewFlags']].astype(np.float64)
+    feedbacks = frame[HEADERS['number_of_feedbacks']].astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(views > 0, np.clip(feedbacks / views, 0, 1), np.nan)
+
+
+class ConversionModel:
+    """
+    Логистическая регрессия по стандартизованным признакам:
+    конверсия = sigmoid(((x - mean) / scale) · coef + intercept).
+    Оценка всего среза — одно матричное умножение
+    """
+
+    def __init__(self, features: Sequence[str], mean: np.ndarray, scale: np.ndarray,
+                 coef: np.ndarray, intercept: float):
+        unknown = [name for name in features if name not in DERIVED_FEATURES and name not in HEADERS.values()]
+        if unknown:
+            raise ValueError(f"Неизвестные признаки модели: {unknown}")
+        leaking = [name for name in features if name in TARGET_COLUMNS]
+        if leaking:
+            raise ValueError(f"Признаки модели совпадают со столбцами целевой переменной: {leaking}")
+        self.features = tuple(features)
+        # Деление на масштаб заранее вносится в коэффициенты
+        self.weights = np.asarray(coef, dtype=np.float64) / np.asarray(scale, dtype=np.float64)
+        self.bias = float(intercept) - float(np.asarray(mean, dtype=np.float64) @ self.weights)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.coef = np.asarray(coef, dtype=np.float64)
+        self.intercept = float(intercept)
+
+    @classmethod
+    def load(cls, path: str) -> 'ConversionModel':
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['features'].tolist(), data['mean'], data['scale'], data['coef'], data['intercept'])
+
+    def save(self, path: str):
+        np.savez(path, features=np.array(self.features), mean=self.mean, scale=self.scale,
+                 coef=self.coef, intercept=np.float64(self.intercept))
+
+    def predict(self, frame: Dict[str, np.ndarray]) -> np.ndarray:
+        logits = feature_matrix(frame, self.features) @ self.weights + self.bias
+        return (1.0 / (1.0 + np.exp(-logits))).astype(np.float32)
+
+
+def fit_model(frame: Dict[str, np.ndarray], features: Sequence[str] = DEFAULT_FEATURES,
+              l2: float = 1.0) -> ConversionModel:
+    """
+    Обучает модель на очищенных срезах (например, ParserWB.load_history(output='numpy')[0]):
+    гребневая регрессия логита конверсии на стандартизованных признаках.
+    Товары без просмотров в обучение не попадают
+    """
+    target = conversion_target(frame)
+    known = ~np.isnan(target)
+    matrix = feature_matrix(frame, features)[known]
+    # Логит конверсии; нулевая и полная конверсия сдвигаются внутрь (0, 1)
+    rate = np.clip(target[known], 1e-4, 1 - 1e-4)
+    logits = np.log(rate / (1 - rate))
+
+    mean = matrix.mean(axis=0)
+    scale = matrix.std(axis=0)
+    scale[scale == 0] = 1.0
+    scaled = (matrix - mean) / scale
+    intercept = logits.mean()
+    coef = np.linalg.solve(scaled.T @ scaled + l2 * np.eye(len(features)), scaled.T @ (logits - intercept))
+    return ConversionModel(features, mean, scale, coef, intercept)
+
+
+@lru_cache(maxsize=None)
+def load_model(path: str = DEFAULT_MODEL_PATH) -> Optional[ConversionModel]:
+    """
+    Загружает модель один раз на процесс. Если файла нет, срезы не оцениваются;
+    новая модель подхватывается после перезапуска (или load_model.cache_clear())
+    """
+    logger = logging.getLogger('WBTrackerBot')
+    if not os.path.exists(path):
+        logger.info(f"[conversion_model] Модель {path} не найдена, оценка конверсии отключена")
+        return None
+    model = ConversionModel.load(path)
+    logger.info(f"[conversion_model] Загружена модель {path}: {len(model.features)} признаков")
+    return model
+
+
+def score_snapshot(columns: Sequence[Sequence], model_path: str = DEFAULT_MODEL_PATH) -> List:
+    """
+    Оценивает конверсию каждого товара среза (колонки в порядке DATA_COLUMNS).
+    Возвращает колонку predicted_conversion: оценки или None, если модели нет.
+    Ошибка оценки не мешает записи среза: оценки просто остаются пустыми
+    """
+    logger = logging.getLogger('WBTrackerBot')
+    rows = len(columns[0])
+    try:
+        model = load_model(model_path)
+        if model is None or not rows:
+            return [None] * rows
+        started = time.perf_counter()
+        frame, _ = clean_history(dict(zip(DATA_COLUMNS, columns)))
+        scores = model.predict(frame).tolist()
+    except Exception as e:
+        logger.error(f"[conversion_model] Ошибка при оценке среза: {str(e)}", exc_info=True)
+        return [None] * rows
+    logger.debug(f"[conversion_model] Оценено {rows} товаров за {(time.perf_counter() - started) * 1000:.1f} мс")
+    return scores
+
+
+if __name__ == "__main__":
+    from parser import ParserWB
+
+    arg_parser = argparse.ArgumentParser(description='Обучение модели конверсии по истории замеров')
+    arg_parser.add_argument('queries', nargs='+')
+    arg_parser.add_argument('--days', type=int, default=30)
+    arg_parser.add_argument('--l2', type=float, default=1.0)
+    arg_parser.add_argument('--out', default=DEFAULT_MODEL_PATH)
+    args = arg_parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    )
+
+    frames = [ParserWB(query).load_history(args.days, output='numpy')[0] for query in args.queries]
+    history = {header: np.concatenate([frame[header] for frame in frames]) for header in frames[0]}
+    trained = fit_model(history, l2=args.l2)
+    trained.save(args.out)
+    for name, weight in zip(trained.features, trained.coef):
+        print(f"{name:<32} {weight:>8.3f}")
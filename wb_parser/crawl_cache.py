@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, List, Optional
+import logging
+
+# Время жизни среза выдачи в кэше, сек
+DEFAULT_TTL = 600
+# Максимальное количество запросов, срезы которых хранятся одновременно
+DEFAULT_MAX_ENTRIES = 256
+
+
+class CrawlSnapshot:
+    """
+    Срез выдачи по одному запросу, общий для всех проверок.
+    Страницы дописываются по мере обхода, complete=True означает, что выдача прочитана до конца
+    """
+
+    def __init__(self):
+        self.created_at = time.monotonic()
+        self.pages: List[list] = []
+        self.complete = False
+        # Блокировка на время догрузки страниц: один запрос к WB на всех ожидающих
+        self.lock = threading.Lock()
+
+
+class CrawlCache:
+    """Кэш срезов выдачи с ограничением по времени жизни и количеству записей"""
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.logger = logging.getLogger('WBTrackerBot')
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, CrawlSnapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, snapshot: CrawlSnapshot, now: float) -> bool:
+        return now - snapshot.created_at < self.ttl
+
+    def get(self, key: Hashable) -> Optional[CrawlSnapshot]:
+        """Возвращает актуальный срез по ключу или None"""
+        with self._lock:
+            snapshot = self._entries.get(key)
+            if snapshot is None:
+                return None
+            if not self._is_fresh(snapshot, time.monotonic()):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return snapshot
+
+    def get_or_create(self, key: Hashable) -> CrawlSnapshot:
+        """Возвращает актуальный срез по ключу, при его отсутствии создает пустой"""
+        with self._lock:
+            now = time.monotonic()
+            snapshot = self._entries.get(key)
+            if snapshot is not None and self._is_fresh(snapshot, now):
+                self._entries.move_to_end(key)
+                return snapshot
+
+            self._purge_expired(now)
+            snapshot = CrawlSnapshot()
+            self._entries[key] = snapshot
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self.logger.debug(f"[CrawlCache] Вытеснен срез {evicted_key}")
+            return snapshot
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _purge_expired(self, now: float):
+        expired = [key for key, snapshot in self._entries.items() if not self._is_fresh(snapshot, now)]
+        for key in expired:
+            del self._entries[key]
+
+
+CRAWL_CACHE = CrawlCache()
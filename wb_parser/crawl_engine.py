@@ -0,0 +1,233 @@
+import json
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+from model import Items, decode_products
+from parser import MAX_PAGES, DEFAULT_DEST, DEFAULT_SORT, DEFAULT_CONCURRENCY, ParserWB, build_columns
+from schema import DATA_COLUMNS
+from storage import SnapshotStorage
+from wb_client import SEARCH_CLIENT, WBSearchClient
+
+# Сколько запросов обходится одновременно
+DEFAULT_QUERY_WORKERS = 8
+# Сколько страниц (по всем запросам) загружается одновременно
+DEFAULT_IO_WORKERS = 32
+
+POSITION_INDEX = DATA_COLUMNS.index('position')
+
+
+def decode_page(content: bytes, query: str, created_at: datetime,
+                strict: bool) -> Tuple[int, Optional[List], List[int], float]:
+    """
+    Разбирает сырой ответ поиска и собирает колонки страницы в порядке DATA_COLUMNS.
+    Выполняется в процессе пула, поэтому обратно передаются только колонки:
+    (число товаров, колонки или None для пустой страницы,
+    индексы товаров без log на странице, время разбора в секундах)
+    """
+    started = time.perf_counter()
+    data = json.loads(content).get("data", {})
+    raw_products = data.get("products")
+    if not isinstance(raw_products, list) or not raw_products:
+        return 0, None, [], time.perf_counter() - started
+
+    products = Items.model_validate(data).products if strict else decode_products(raw_products)
+    columns = build_columns(products, query, created_at, first_position=None)
+    missing_positions = [i for i, product in enumerate(products) if not product.log]
+    return len(products), columns, missing_positions, time.perf_counter() - started
+
+
+class QueryCrawlResult:
+    """Итог обхода одного запроса и замеры его этапов"""
+    __slots__ = ('query', 'pages', 'products', 'columns', 'saved', 'skipped', 'error',
+                 'fetch_seconds', 'decode_seconds', 'insert_seconds', 'wall_seconds')
+
+    def __init__(self, query: str):
+        self.query = query
+        self.pages = 0
+        self.products = 0
+        # Колонки среза в порядке DATA_COLUMNS (None, если товаров нет)
+        self.columns: Optional[List] = None
+        self.saved = False
+        # Срез по запросу уже записан в текущем окне, обход не выполнялся
+        self.skipped = False
+        self.error: Optional[str] = None
+        # Суммарное время ожидания ответов WB по страницам запроса
+        self.fetch_seconds = 0.0
+        # Суммарное время разбора страниц в процессах пула
+        self.decode_seconds = 0.0
+        self.insert_seconds = 0.0
+        self.wall_seconds = 0.0
+
+    def as_dict(self) -> Dict:
+        return {
+            'query': self.query,
+            'pages': self.pages,
+            'products': self.products,
+            'saved': self.saved,
+            'skipped': self.skipped,
+            'error': self.error,
+            'fetch_seconds': self.fetch_seconds,
+            'decode_seconds': self.decode_seconds,
+            'insert_seconds': self.insert_seconds,
+            'wall_seconds': self.wall_seconds,
+        }
+
+
+class CrawlEngine:
+    """
+    Обход выдачи сразу по многим запросам.
+    Запросы обходятся параллельно в query_workers потоках, страницы каждого
+    запроса загружаются пачками по page_window штук через общий пул из
+    io_workers потоков, а разбор JSON, валидация и сборка колонок идут в пуле
+    из cpu_workers процессов. Лимит запросов к WB общий (см. wb_client),
+    поэтому время полного обновления упирается в соединения и ядра,
+    а не в число запросов
+    """
+
+    def __init__(self, search_client: Optional[WBSearchClient] = None,
+                 query_workers: int = DEFAULT_QUERY_WORKERS, io_workers: int = DEFAULT_IO_WORKERS,
+                 cpu_workers: Optional[int] = None, page_window: int = DEFAULT_CONCURRENCY,
+                 strict: bool = True, dest: str = DEFAULT_DEST, sort: str = DEFAULT_SORT,
+                 storage: Optional[SnapshotStorage] = None):
+        self.logger = logging.getLogger('WBTrackerBot')
+        self.search_client = search_client if search_client is not None else SEARCH_CLIENT
+        self.query_workers = max(1, query_workers)
+        self.page_window = max(1, page_window)
+        self.strict = strict
+        self.dest = dest
+        self.sort = sort
+        # None — хранилище по умолчанию из ParserWB (ClickHouse)
+        self.storage = storage
+        self._io_pool = ThreadPoolExecutor(max_workers=max(1, io_workers), thread_name_prefix='wb-crawl-io')
+        self._cpu_pool = ProcessPoolExecutor(max_workers=cpu_workers or os.cpu_count() or 1)
+
+    def crawl(self, queries: Iterable[str], save: bool = True) -> Dict[str, QueryCrawlResult]:
+        """
+        Обходит выдачу по всем запросам и возвращает {запрос: QueryCrawlResult}.
+        При save=True срезы записываются в хранилище с учетом окна записи WRITE_INTERVAL,
+        а запросы, срез по которым в текущем окне уже записан, не обходятся вовсе
+        """
+        queries = list(dict.fromkeys(queries))
+        started = time.perf_counter()
+        self.logger.info(f"[CrawlEngine] Начало обхода {len(queries)} запросов")
+
+        with ThreadPoolExecutor(max_workers=self.query_workers, thread_name_prefix='wb-crawl-query') as executor:
+            futures = {query: executor.submit(self._crawl_query, query, save) for query in queries}
+        results = {query: future.result() for query, future in futures.items()}
+
+        products = sum(result.products for result in results.values())
+        failed = sum(1 for result in results.values() if result.error)
+        skipped = sum(1 for result in results.values() if result.skipped)
+        self.logger.info(
+            f"[CrawlEngine] Обход завершен за {time.perf_counter() - started:.1f} с: "
+            f"{products} товаров по {len(queries)} запросам, с ошибками: {failed}, уже записано: {skipped}"
+        )
+        return results
+
+    def _crawl_query(self, query: str, save: bool) -> QueryCrawlResult:
+        result = QueryCrawlResult(query)
+        started = time.perf_counter()
+        parser = ParserWB(query, concurrency=self.page_window, dest=self.dest, sort=self.sort,
+                          use_cache=False, search_client=self.search_client, strict=self.strict,
+                          storage=self.storage)
+        try:
+            # Окно записи проверяется до загрузки: иначе выдача скачивается и разбирается
+            # только для того, чтобы save_columns отбросил срез
+            if save and not parser._write_due():
+                result.skipped = True
+                self.logger.info(f"[CrawlEngine] Срез по запросу '{query}' уже сохранен, обход пропущен")
+                return result
+            pages = self._fetch_pages(parser, result, datetime.now())
+            result.columns = self._collect_columns(pages, result)
+            if result.columns is not None and save:
+                insert_started = time.perf_counter()
+                result.saved = parser.save_columns(result.columns)
+                result.insert_seconds = time.perf_counter() - insert_started
+        except Exception as e:
+            result.error = str(e)
+            self.logger.error(f"[CrawlEngine] Ошибка при обходе запроса '{query}': {str(e)}", exc_info=True)
+        result.wall_seconds = time.perf_counter() - started
+        self.logger.info(
+            f"[CrawlEngine] Запрос '{query}': {result.pages} стр., {result.products} товаров "
+            f"за {result.wall_seconds:.2f} с (сеть {result.fetch_seconds:.2f} с, разбор {result.decode_seconds:.2f} с)"
+        )
+        return result
+
+    def _fetch(self, parser: ParserWB, page: int) -> Tuple[Optional[bytes], float]:
+        """Загружает страницу выдачи; возвращает (тело ответа или None при ошибке, время ожидания)"""
+        started = time.perf_counter()
+        response = self.search_client.get(parser._build_params(page))
+        elapsed = time.perf_counter() - started
+        if response is None:
+            self.logger.error(f"[CrawlEngine] Не удалось получить страницу {page} по запросу '{parser.query}': сервер недоступен")
+            return None, elapsed
+        if response.status_code != 200:
+            self.logger.error(f"[CrawlEngine] Ошибка при запросе страницы {page} по запросу '{parser.query}'! Код: {response.status_code}")
+            return None, elapsed
+        return response.content, elapsed
+
+    def _fetch_pages(self, parser: ParserWB, result: QueryCrawlResult, created_at: datetime) -> List[Future]:
+        """
+        Загружает страницы пачками и сразу отправляет их на разбор в пул процессов.
+        Следующая пачка запрашивается, только если последняя страница пачки
+        не пустая; обход обрывается на первой ошибке загрузки
+        """
+        decoded: List[Future] = []
+        for first_page in range(1, MAX_PAGES + 1, self.page_window):
+            batch = range(first_page, min(first_page + self.page_window, MAX_PAGES + 1))
+            responses = list(self._io_pool.map(lambda page: self._fetch(parser, page), batch))
+            for content, elapsed in responses:
+                result.fetch_seconds += elapsed
+                if content is None:
+                    return decoded
+                decoded.append(self._cpu_pool.submit(decode_page, content, parser.query, created_at, self.strict))
+            if decoded[-1].result()[0] == 0:
+                break
+        return decoded
+
+    def _collect_columns(self, pages: List[Future], result: QueryCrawlResult) -> Optional[List]:
+        """Склеивает колонки страниц по порядку до первой пустой страницы"""
+        columns = None
+        for future in pages:
+            count, page_columns, missing_positions, elapsed = future.result()
+            result.decode_seconds += elapsed
+            if not count:
+                break
+            # Позиции товаров без log известны только после склейки: по порядку в выдаче
+            for index in missing_positions:
+                page_columns[POSITION_INDEX][index] = result.products + index + 1
+            if columns is None:
+                columns = page_columns
+            else:
+                for column, page_column in zip(columns, page_columns):
+                    column.extend(page_column)
+            result.pages += 1
+            result.products += count
+        return columns
+
+    def close(self):
+        self._io_pool.shutdown()
+        self._cpu_pool.shutdown()
+
+    def __enter__(self) -> 'CrawlEngine':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('bot.log'),
+            logging.StreamHandler()
+        ]
+    )
+    with CrawlEngine(strict=False) as engine:
+        for query_result in engine.crawl(["шарф", "перчатки", "шапка"], save=False).values():
+            print(query_result.as_dict())
@@ -0,0 +1,250 @@
+import argparse
+import csv
+import os
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Sequence, Tuple
+import logging
+import openpyxl
+from parser import ParserWB, build_columns
+from schema import DATA_COLUMNS, META_COLUMNS, MISSING_VALUES, NOTEBOOK_COLUMNS
+from storage import SnapshotStorage, ClickHouseStorage
+
+# Типы столбцов Parquet по внутренним именам
+PARQUET_TYPES = {
+    'articul': 'uint64', 'query': 'string', 'created_at': 'timestamp',
+    'name': 'string', 'brand': 'string', 'price': 'int64', 'logistics': 'int64',
+    'reviewRating': 'float64', 'number_of_feedbacks': 'int64', 'totalQuantity': 'int64',
+    'viewFlags': 'int64', 'pics': 'int64', 'supplierFlags': 'int64', 'supplierRating': 'float64',
+    'dist': 'int64', 'promotion': 'float64', 'tp': 'string', 'promoTextCard': 'string',
+    'cpm': 'float64', 'promoPosition': 'int64', 'position': 'int64', 'colors': 'int64',
+}
+EXPORT_FORMATS = ('csv', 'xlsx', 'parquet')
+# Сколько строк копится перед записью группы строк Parquet
+DEFAULT_ROW_GROUP_SIZE = 10000
+
+
+def export_columns(include_meta: bool = False) -> Tuple[Tuple[str, str], ...]:
+    """Пары (внутреннее имя, заголовок) столбцов выгрузки"""
+    return (META_COLUMNS + NOTEBOOK_COLUMNS) if include_meta else NOTEBOOK_COLUMNS
+
+
+class RowConverter:
+    """Переводит строки в порядке DATA_COLUMNS в строки выгрузки"""
+
+    def __init__(self, include_meta: bool = False):
+        names = [name for name, _ in export_columns(include_meta)]
+        self.indexes = [DATA_COLUMNS.index(name) for name in names]
+        self.missing = [MISSING_VALUES.get(name, ()) for name in names]
+        self.promotion = names.index('promotion')
+
+    def convert(self, row: Sequence) -> List:
+        values = [row[index] for index in self.indexes]
+        for i, missing in enumerate(self.missing):
+            if missing and values[i] in missing:
+                values[i] = None
+        promotion = values[self.promotion]
+        if promotion is not None:
+            # promotion хранится строкой, в тетрадке это число (1.0)
+            try:
+                values[self.promotion] = float(promotion)
+            except ValueError:
+                values[self.promotion] = None
+        return values
+
+
+class ExportWriter:
+    """
+    Потоковая запись строк выгрузки в файл.
+    Строки принимаются пачками в порядке DATA_COLUMNS и сразу уходят на диск,
+    поэтому память не зависит от размера выгрузки
+    """
+
+    def __init__(self, path: str, include_meta: bool = False):
+        self.logger = logging.getLogger('WBTrackerBot')
+        self.path = path
+        self.columns = export_columns(include_meta)
+        self.converter = RowConverter(include_meta)
+        self.rows = 0
+
+    def write_rows(self, rows: Iterable[Sequence]):
+        for row in rows:
+            self._write(self.converter.convert(row))
+            self.rows += 1
+
+    def _write(self, values: List):
+        raise NotImplementedError
+
+    def close(self):
+        self.logger.info(f"[{type(self).__name__}] Записано {self.rows} строк в {self.path}")
+
+    def __enter__(self) -> 'ExportWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.close()
+        finally:
+            if exc_type is not None:
+                self.discard()
+
+    def discard(self):
+        """Удаляет файл оборванной выгрузки, чтобы его нельзя было принять за полный"""
+        self.logger.error(f"[{type(self).__name__}] Выгрузка в {self.path} прервана, файл удален")
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class CSVExportWriter(ExportWriter):
+    def __init__(self, path: str, include_meta: bool = False):
+        super().__init__(path, include_meta)
+        # utf-8-sig: иначе Excel не распознает кириллицу в CSV
+        self._file = open(path, 'w', newline='', encoding='utf-8-sig')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([header for _, header in self.columns])
+
+    def _write(self, values: List):
+        self._writer.writerow(values)
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+class XLSXExportWriter(ExportWriter):
+    """XLSX через write-only режим openpyxl: строки пишутся во временный файл, а не держатся в памяти"""
+
+    def __init__(self, path: str, include_meta: bool = False):
+        super().__init__(path, include_meta)
+        self._workbook = openpyxl.Workbook(write_only=True)
+        self._sheet = self._workbook.create_sheet('data')
+        self._sheet.append([header for _, header in self.columns])
+
+    def _write(self, values: List):
+        self._sheet.append(values)
+
+    def close(self):
+        self._workbook.save(self.path)
+        super().close()
+
+
+class ParquetExportWriter(ExportWriter):
+    """Parquet группами по row_group_size строк (нужен pyarrow)"""
+
+    def __init__(self, path: str, include_meta: bool = False, row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+        super().__init__(path, include_meta)
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self._pa = pa
+        types = {
+            'string': pa.string(), 'int64': pa.int64(), 'uint64': pa.uint64(),
+            'float64': pa.float64(), 'timestamp': pa.timestamp('s'),
+        }
+        self._schema = pa.schema([(header, types[PARQUET_TYPES[name]]) for name, header in self.columns])
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self.row_group_size = max(1, row_group_size)
+        self._pending: List[List] = []
+
+    def _write(self, values: List):
+        self._pending.append(values)
+        if len(self._pending) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        arrays = [
+            self._pa.array(column, type=field.type)
+            for column, field in zip(zip(*self._pending), self._schema)
+        ]
+        self._writer.write_table(self._pa.Table.from_arrays(arrays, schema=self._schema))
+        self._pending = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+        super().close()
+
+
+def open_writer(path: str, fmt: Optional[str] = None, include_meta: bool = False) -> ExportWriter:
+    """Создает запись в формате fmt, по умолчанию формат берется из расширения файла"""
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt == 'csv':
+        return CSVExportWriter(path, include_meta)
+    if fmt == 'xlsx':
+        return XLSXExportWriter(path, include_meta)
+    if fmt == 'parquet':
+        return ParquetExportWriter(path, include_meta)
+    raise ValueError(f"Неизвестный формат выгрузки: {fmt}")
+
+
+def export_snapshot(parser: ParserWB, path: Optional[str] = None, fmt: str = 'xlsx',
+                    include_meta: bool = False) -> int:
+    """
+    Обходит выдачу парсера и пишет товары в файл постранично, по мере загрузки.
+    По умолчанию файл — parser.filename_excel или parser.filename_csv.
+    Возвращает число записанных строк
+    """
+    if path is None:
+        path = parser.filename_csv if fmt == 'csv' else parser.filename_excel
+        if fmt == 'parquet':
+            path = os.path.splitext(path)[0] + '.parquet'
+    created_at = datetime.now()
+    position = 0
+    with open_writer(path, fmt, include_meta) as writer:
+        for _, products in parser._iter_pages():
+            columns = build_columns(products, parser.query, created_at, first_position=position + 1)
+            writer.write_rows(zip(*columns))
+            position += len(products)
+    return writer.rows
+
+
+def export_history(storage: SnapshotStorage, query: str, path: str, date_from: datetime,
+                   date_to: Optional[datetime] = None, article: Optional[int] = None,
+                   fmt: Optional[str] = None) -> int:
+    """
+    Выгружает все замеры по запросу за период из хранилища, читая их пачками.
+    В выгрузку добавляются столбцы запроса и времени замера.
+    Возвращает число записанных строк; при ошибке чтения файл удаляется, ошибка пробрасывается
+    """
+    with open_writer(path, fmt, include_meta=True) as writer:
+        for batch in storage.iter_snapshots(query, date_from, date_to, article):
+            writer.write_rows(batch)
+    return writer.rows
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description='Выгрузка выдачи WB в CSV/XLSX/Parquet для research.ipynb')
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+
+    snapshot = commands.add_parser('snapshot', help='обойти выдачу и выгрузить текущий срез')
+    snapshot.add_argument('query')
+    snapshot.add_argument('--format', choices=EXPORT_FORMATS, default='xlsx')
+    snapshot.add_argument('--out', help='файл выгрузки, по умолчанию <запрос>.<формат>')
+
+    history = commands.add_parser('history', help='выгрузить замеры из ClickHouse')
+    history.add_argument('query')
+    history.add_argument('--days', type=int, default=30)
+    history.add_argument('--article', type=int)
+    history.add_argument('--format', choices=EXPORT_FORMATS, default='parquet')
+    history.add_argument('--out', help='файл выгрузки, по умолчанию <запрос>_history.<формат>')
+
+    args = arg_parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('bot.log'),
+            logging.StreamHandler()
+        ]
+    )
+
+    if args.command == 'snapshot':
+        parser = ParserWB(args.query, use_cache=False, strict=False)
+        export_snapshot(parser, args.out, args.format)
+    else:
+        export_history(
+            ClickHouseStorage(), args.query, args.out or f"{args.query}_history.{args.format}",
+            datetime.now() - timedelta(days=args.days), article=args.article, fmt=args.format,
+        )
@@ -0,0 +1,231 @@
+import argparse
+import os
+import pickle
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+from urllib.parse import quote
+import logging
+import numpy as np
+from sklearn.preprocessing import StandardScaler
+from history_frame import BRAND_CODE_COLUMN, HEADERS, clean_history
+from schema import DATA_COLUMNS
+from storage import SnapshotStorage, ClickHouseStorage
+
+# Каталог с сохраненным состоянием конвейера: <каталог>/<запрос>.pkl
+DEFAULT_STATE_DIR = 'wb_features'
+# Сколько дней истории обрабатывается при первом запуске
+DEFAULT_HISTORY_DAYS = 30
+# Признаки в порядке столбцов матрицы: числовые столбцы research.ipynb
+# без id и текстовых названия и бренда (бренд входит кодом)
+FEATURE_COLUMNS = tuple(
+    HEADERS[name] for name in (
+        'price', 'logistics', 'reviewRating', 'number_of_feedbacks', 'totalQuantity',
+        'viewFlags', 'pics', 'supplierFlags', 'supplierRating', 'dist', 'promotion',
+        'tp', 'promoTextCard', 'cpm', 'promoPosition', 'position', 'colors',
+    )
+) + (BRAND_CODE_COLUMN,)
+# Версия формата файла состояния: при изменении признаков старое состояние не загружается
+STATE_VERSION = 2
+
+
+class BrandEncoder:
+    """
+    Кодирует бренды номерами, как LabelEncoder, но устойчиво между запусками:
+    известные бренды сохраняют свои коды, новые получают следующие номера
+    """
+
+    def __init__(self):
+        self.classes: List[str] = []
+        self._codes: Dict[str, int] = {}
+
+    def encode(self, brands: np.ndarray) -> np.ndarray:
+        # Словарь обходится только по уникальным брендам, строки кодируются через inverse
+        unique, inverse = np.unique(brands, return_inverse=True)
+        codes = np.empty(len(unique), dtype=np.int32)
+        for i, brand in enumerate(unique.tolist()):
+            code = self._codes.get(brand)
+            if code is None:
+                code = self._codes[brand] = len(self.classes)
+                self.classes.append(brand)
+            codes[i] = code
+        return codes[inverse]
+
+    def __getstate__(self):
+        # Словарь кодов восстанавливается из списка брендов, на диск пишется только список
+        return {'classes': self.classes}
+
+    def __setstate__(self, state):
+        self.classes = state['classes']
+        self._codes = {brand: code for code, brand in enumerate(self.classes)}
+
+
+class CorrelationAccumulator:
+    """
+    Матрица корреляций признаков, собираемая по частям.
+    Каждая часть дает центрированные моменты (число строк, средние, матрицу
+    сумм произведений отклонений), которые объединяются по формулам Чана,
+    поэтому большие средние (цены, артикулы) не съедают точность разброса
+    """
+
+    def __init__(self, features: int):
+        self.rows = 0
+        self.mean = np.zeros(features)
+        self.comoment = np.zeros((features, features))
+
+    def update(self, matrix: np.ndarray):
+        rows = len(matrix)
+        if not rows:
+            return
+        mean = matrix.mean(axis=0)
+        centered = matrix - mean
+        delta = mean - self.mean
+        total = self.rows + rows
+        self.comoment += centered.T @ centered + np.outer(delta, delta) * (self.rows * rows / total)
+        self.mean += delta * (rows / total)
+        self.rows = total
+
+    def correlation(self) -> np.ndarray:
+        """Корреляции Пирсона; для признаков без разброса — nan, как в DataFrame.corr"""
+        if self.rows < 2:
+            return np.full(self.comoment.shape, np.nan)
+        covariance = self.comoment / (self.rows - 1)
+        deviation = np.sqrt(np.clip(np.diag(covariance), 0, None))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return covariance / np.outer(deviation, deviation)
+
+
+class FeaturePipeline:
+    """
+    Признаки research.ipynb по срезам одного запроса.
+    Очистка выполняется векторно (history_frame.clean_history), бренды кодируются
+    BrandEncoder, масштабирование — StandardScaler, дообучаемый через partial_fit.
+    Состояние сохраняется на диск после каждой обработанной суточной партиции,
+    поэтому ежедневный запуск обрабатывает только новые сутки
+    """
+
+    def __init__(self, query: str, state_dir: str = DEFAULT_STATE_DIR):
+        self.logger = logging.getLogger('WBTrackerBot')
+        self.query = query
+        self.path = os.path.join(state_dir, f"{quote(query, safe='')}.pkl")
+        self.brands = BrandEncoder()
+        self.scaler = StandardScaler()
+        self.correlations = CorrelationAccumulator(len(FEATURE_COLUMNS))
+        # Обработанные суточные партиции
+        self.partitions: List[date] = []
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return
+        if state.get('version') != STATE_VERSION:
+            self.logger.warning(f"[FeaturePipeline] Состояние {self.path} устарело, признаки будут посчитаны заново")
+            return
+        self.brands = state['brands']
+        self.scaler = state['scaler']
+        self.correlations = state['correlations']
+        self.partitions = state['partitions']
+        self.logger.info(f"[FeaturePipeline] Загружено состояние по запросу '{self.query}': {len(self.partitions)} сут.")
+
+    def save(self):
+        """Записывает состояние во временный файл и подменяет им старое, чтобы сбой не оставил его битым"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        state = {
+            'version': STATE_VERSION,
+            'brands': self.brands,
+            'scaler': self.scaler,
+            'correlations': self.correlations,
+            'partitions': self.partitions,
+        }
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+    def features(self, columns: Union[Dict[str, Sequence], Sequence[Sequence]]) -> np.ndarray:
+        """
+        Матрица признаков (строки × FEATURE_COLUMNS) без масштабирования.
+        Принимает столбцы среза: {имя из DATA_COLUMNS: значения} из SnapshotStorage.read_columns
+        или список столбцов в порядке DATA_COLUMNS из parser.build_columns
+        """
+        if not isinstance(columns, dict):
+            columns = dict(zip(DATA_COLUMNS, columns))
+        frame, classes = clean_history(columns)
+        # Коды clean_history действуют только внутри одной выборки, здесь нужны постоянные
+        frame[BRAND_CODE_COLUMN] = self.brands.encode(classes)[frame[BRAND_CODE_COLUMN]]
+        return np.column_stack([frame[name].astype(np.float64) for name in FEATURE_COLUMNS])
+
+    def partial_fit(self, columns: Union[Dict[str, Sequence], Sequence[Sequence]]) -> np.ndarray:
+        """Дообучает масштабирование и корреляции на новых строках, возвращает их признаки"""
+        matrix = self.features(columns)
+        if len(matrix):
+            self.scaler.partial_fit(matrix)
+            self.correlations.update(matrix)
+        return matrix
+
+    def transform(self, columns: Union[Dict[str, Sequence], Sequence[Sequence]]) -> np.ndarray:
+        """Масштабированные признаки по уже накопленной статистике"""
+        return self.scaler.transform(self.features(columns))
+
+    def correlation(self) -> Tuple[np.ndarray, Tuple[str, ...]]:
+        """Матрица корреляций признаков по всем обработанным партициям и названия ее столбцов"""
+        return self.correlations.correlation(), FEATURE_COLUMNS
+
+    def update(self, storage: SnapshotStorage, days: int = DEFAULT_HISTORY_DAYS,
+               until: Optional[date] = None) -> int:
+        """
+        Обрабатывает завершенные сутки, которых еще нет в состоянии: с последней
+        обработанной партиции (или за days суток при первом запуске) до until
+        (по умолчанию — до сегодняшних суток, которые еще пополняются).
+        Сутки отмечаются обработанными только после успешного чтения: ошибка чтения
+        пробрасывается, и при следующем запуске обработка продолжится с этих суток.
+        Возвращает число обработанных строк
+        """
+        until = until or date.today()
+        start = self.partitions[-1] + timedelta(days=1) if self.partitions else until - timedelta(days=days)
+        rows = 0
+        day = start
+        while day < until:
+            date_from = datetime.combine(day, datetime.min.time())
+            matrix = self.partial_fit(storage.read_columns(self.query, date_from, date_from + timedelta(days=1)))
+            self.partitions.append(day)
+            self.save()
+            rows += len(matrix)
+            self.logger.info(f"[FeaturePipeline] Запрос '{self.query}': обработаны сутки {day}, {len(matrix)} строк")
+            day += timedelta(days=1)
+        return rows
+
+
+def format_correlation(matrix: np.ndarray, names: Sequence[str], threshold: float = 0.2) -> str:
+    """Пары признаков с |корреляцией| выше threshold, как filtered_correlation в тетрадке"""
+    lines = []
+    for i in range(len(names)):
+        for j in range(i + 1, len(names)):
+            if abs(matrix[i, j]) > threshold:
+                lines.append(f"{names[i]:<32} {names[j]:<32} {matrix[i, j]:>6.2f}")
+    return '\n'.join(lines)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description='Инкрементальный расчет признаков research.ipynb')
+    arg_parser.add_argument('queries', nargs='+')
+    arg_parser.add_argument('--state-dir', default=DEFAULT_STATE_DIR)
+    arg_parser.add_argument('--days', type=int, default=DEFAULT_HISTORY_DAYS, help='глубина истории при первом запуске')
+    args = arg_parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler('bot.log'),
+            logging.StreamHandler()
+        ]
+    )
+
+    storage = ClickHouseStorage()
+    for query in args.queries:
+        pipeline = FeaturePipeline(query, args.state_dir)
+        pipeline.update(storage, args.days)
+        print(f"== {query}")
+        print(format_correlation(*pipeline.correlation()))
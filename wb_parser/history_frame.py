@@ -0,0 +1,116 @@
+from typing import Dict, Sequence, Tuple
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from schema import META_COLUMNS, MISSING_VALUES, NOTEBOOK_COLUMNS
+
+# Столбец с кодом бренда, как после LabelEncoder в research.ipynb
+BRAND_CODE_COLUMN = 'код бренда'
+NO_BRAND = 'no brand'
+# Флаги продвижения: внутреннее имя -> значения, при которых флаг равен 0
+PROMO_FLAGS = {name: MISSING_VALUES[name] + ('', 'None') for name in ('promotion', 'tp', 'promoTextCard')}
+# Типы числовых столбцов после очистки
+NUMERIC_TYPES = {
+    'articul': np.uint64, 'price': np.int64, 'logistics': np.int64, 'reviewRating': np.float64,
+    'number_of_feedbacks': np.int64, 'totalQuantity': np.int64, 'viewFlags': np.int64,
+    'pics': np.int64, 'supplierFlags': np.int64, 'supplierRating': np.float64,
+    'dist': np.int64, 'cpm': np.float64, 'promoPosition': np.int64, 'position': np.int64,
+    'colors': np.int64,
+}
+HEADERS = dict(META_COLUMNS + NOTEBOOK_COLUMNS)
+
+
+def _fill_missing(values: Sequence, fill, dtype) -> np.ndarray:
+    """Приводит столбец к dtype, заменяя None (Nullable-столбцы ClickHouse) на fill"""
+    values = np.asarray(values)
+    if values.dtype == object:
+        values = np.where(np.equal(values, None), fill, values)
+    return values.astype(dtype)
+
+
+def _strings(values: Sequence) -> pa.Array:
+    """
+    Строковый столбец Arrow, None — null. Строки не копируются в numpy-массив
+    фиксированной ширины, а сравнения выполняются в pyarrow.compute без сортировки
+    """
+    array = values if isinstance(values, (pa.Array, pa.ChunkedArray)) else pa.array(values, from_pandas=True)
+    # LowCardinality-столбцы драйвер может отдать как pandas.Categorical (словарный столбец)
+    if not (pa.types.is_string(array.type) or pa.types.is_large_string(array.type)):
+        array = array.cast(pa.string())
+    return array
+
+
+def _replace(values: pa.Array, missing: Sequence[str], fill: str) -> pa.Array:
+    """Заменяет null и значения из missing на fill"""
+    values = pc.fill_null(values, fill)
+    return pc.if_else(pc.is_in(values, value_set=pa.array(missing, pa.string())), fill, values)
+
+
+def _flag(values: Sequence, missing: Sequence[str]) -> np.ndarray:
+    """0/1: 0 для null и значений из missing"""
+    values = _strings(values)
+    absent = pc.or_(pc.is_null(values), pc.fill_null(pc.is_in(values, value_set=pa.array(missing, pa.string())), False))
+    return pc.invert(absent).to_numpy(zero_copy_only=False).astype(np.int8)
+
+
+def encode_brands(brands: Sequence) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Заменяет отсутствующие бренды на 'no brand' и кодирует их как LabelEncoder:
+    коды — номера брендов в отсортированном списке. Возвращает (бренды, коды).
+    Сортируются только уникальные бренды, строки кодируются словарем Arrow
+    """
+    encoded = pc.dictionary_encode(_replace(_strings(brands), ('', 'None'), NO_BRAND))
+    if isinstance(encoded, pa.ChunkedArray):
+        encoded = encoded.combine_chunks()
+    dictionary = encoded.dictionary.to_numpy(zero_copy_only=False)
+    order = np.argsort(dictionary, kind='stable')
+    ranks = np.empty(len(order), dtype=np.int32)
+    ranks[order] = np.arange(len(order), dtype=np.int32)
+    return dictionary[order], ranks[encoded.indices.to_numpy(zero_copy_only=False)]
+
+
+def clean_history(columns: Dict[str, Sequence]) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    """
+    Очищает срезы так же, как ячейки research.ipynb, но сразу по целым столбцам:
+    типизирует числа, кодирует бренды, переводит признаки продвижения в 0/1,
+    заполняет ставку нулем, а место при продвижении — местом без продвижения.
+    Принимает {имя из DATA_COLUMNS: значения} (см. SnapshotStorage.read_columns),
+    возвращает ({заголовок тетрадки: массив}, список брендов по кодам)
+    """
+    cleaned: Dict[str, np.ndarray] = {}
+    for name, dtype in NUMERIC_TYPES.items():
+        cleaned[name] = _fill_missing(columns[name], -1 if dtype is np.int64 else 0, dtype)
+
+    position = cleaned['position']
+    promo_position = cleaned['promoPosition']
+    cleaned['promoPosition'] = np.where(promo_position < 0, position, promo_position)
+
+    for name, missing in PROMO_FLAGS.items():
+        cleaned[name] = _flag(columns[name], missing)
+
+    classes, codes = encode_brands(columns['brand'])
+    # Текстовые столбцы остаются массивами объектов-строк
+    cleaned['name'] = _replace(_strings(columns['name']), MISSING_VALUES['name'] + ('None',), '').to_numpy(
+        zero_copy_only=False)
+    cleaned['query'] = pc.fill_null(_strings(columns['query']), '').to_numpy(zero_copy_only=False)
+    cleaned['created_at'] = np.asarray(columns['created_at'], dtype='datetime64[s]')
+
+    frame = {header: classes[codes] if name == 'brand' else cleaned[name] for name, header in HEADERS.items()}
+    frame[BRAND_CODE_COLUMN] = codes
+    return frame, classes
+
+
+def to_arrow(frame: Dict[str, np.ndarray], brands: np.ndarray):
+    """pyarrow.Table с брендом в виде словарного столбца (в pandas — category)"""
+    arrays = {}
+    for header, values in frame.items():
+        if header == HEADERS['brand']:
+            arrays[header] = pa.DictionaryArray.from_arrays(frame[BRAND_CODE_COLUMN], pa.array(brands, pa.string()))
+        else:
+            arrays[header] = pa.array(values)
+    return pa.table(arrays)
+
+
+def to_pandas(frame: Dict[str, np.ndarray], brands: np.ndarray):
+    """pandas.DataFrame через Arrow, без копирования числовых столбцов"""
+    return to_arrow(frame, brands).to_pandas()
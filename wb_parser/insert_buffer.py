@@ -0,0 +1,125 @@
+import atexit
+import threading
+import time
+from itertools import chain
+from typing import Callable, List, Optional, Sequence, Tuple
+import logging
+from clickhouse_pool import CLICKHOUSE_POOL, ClickHousePool
+from schema import POSITION_COLUMNS, PRODUCT_COLUMNS, SNAPSHOT_COLUMNS, insert_sql, writable_columns
+
+# Размер пачки строк, при котором буфер сбрасывается сразу
+DEFAULT_MAX_ROWS = 50000
+# Максимальное время ожидания строк в буфере, сек
+DEFAULT_MAX_DELAY = 30
+# Сколько строк можно держать в буфере после неудачных вставок, прежде чем отбрасывать старые
+MAX_PENDING_ROWS = 500000
+
+
+class InsertBuffer:
+    """
+    Накопитель колоночных блоков для вставки в одну таблицу ClickHouse.
+    Блоки от разных запросов объединяются и отправляются одной колоночной
+    вставкой при достижении max_rows строк или через max_delay секунд.
+    После неудачной вставки блоки остаются в буфере и отправляются снова;
+    блок, отброшенный при переполнении, сообщает об этом своим on_dropped
+    """
+
+    def __init__(self, table: str, columns: Sequence[str], pool: ClickHousePool = CLICKHOUSE_POOL,
+                 max_rows: int = DEFAULT_MAX_ROWS, max_delay: float = DEFAULT_MAX_DELAY):
+        self.logger = logging.getLogger('WBTrackerBot')
+        self.table = table
+        self.columns = columns
+        self.pool = pool
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        # (колонки блока, on_dropped)
+        self._blocks: List[Tuple[List[Sequence], Optional[Callable[[], None]]]] = []
+        self._rows = 0
+        self._first_added_at = None
+        self._lock = threading.Lock()
+        # Не даем двум потокам отправлять вставки одновременно
+        self._flush_lock = threading.Lock()
+
+    def add(self, columns: List[Sequence], on_dropped: Optional[Callable[[], None]] = None):
+        """
+        Добавляет блок: список колонок одинаковой длины в порядке столбцов таблицы.
+        on_dropped вызывается, если блок так и не будет записан (отброшен при переполнении)
+        """
+        rows = len(columns[0]) if columns else 0
+        if not rows:
+            return
+        with self._lock:
+            self._blocks.append((columns, on_dropped))
+            self._rows += rows
+            if self._first_added_at is None:
+                self._first_added_at = time.monotonic()
+            full = self._rows >= self.max_rows
+        if full:
+            self.flush()
+
+    def flush_if_due(self):
+        with self._lock:
+            due = self._first_added_at is not None and time.monotonic() - self._first_added_at >= self.max_delay
+        if due:
+            self.flush()
+
+    def flush(self) -> bool:
+        """Отправляет накопленные строки одной вставкой"""
+        with self._flush_lock:
+            with self._lock:
+                blocks, rows = self._blocks, self._rows
+                self._blocks, self._rows, self._first_added_at = [], 0, None
+            if not blocks:
+                return True
+
+            columns = blocks[0][0] if len(blocks) == 1 else [
+                list(chain.from_iterable(block[i] for block, _ in blocks)) for i in range(len(blocks[0][0]))
+            ]
+            try:
+                self.logger.info(f"[InsertBuffer] Вставка {rows} строк ({len(blocks)} блоков) в {self.table}")
+                names, columns = writable_columns(self.pool, self.columns, columns)
+                self.pool.execute(insert_sql(self.table, names), columns, columnar=True)
+                return True
+            except Exception as e:
+                self.logger.error(f"[InsertBuffer] Ошибка при вставке в {self.table}: {str(e)}", exc_info=True)
+                self._requeue(blocks, rows)
+                return False
+
+    def _requeue(self, blocks: List[Tuple[List[Sequence], Optional[Callable[[], None]]]], rows: int):
+        dropped = []
+        with self._lock:
+            self._blocks = blocks + self._blocks
+            self._rows += rows
+            if self._first_added_at is None:
+                self._first_added_at = time.monotonic()
+            while self._rows > MAX_PENDING_ROWS and len(self._blocks) > 1:
+                block = self._blocks.pop(0)
+                self._rows -= len(block[0][0])
+                dropped.append(block)
+        for columns, on_dropped in dropped:
+            self.logger.error(f"[InsertBuffer] Буфер {self.table} переполнен, отброшено {len(columns[0])} строк")
+            if on_dropped is not None:
+                try:
+                    on_dropped()
+                except Exception as e:
+                    self.logger.error(f"[InsertBuffer] Ошибка обработчика отброшенного блока: {str(e)}", exc_info=True)
+
+
+DATA_BUFFER = InsertBuffer('wildberries.data', SNAPSHOT_COLUMNS)
+# Буферы режима хранения storage_mode='delta' (см. schema.py)
+POSITIONS_BUFFER = InsertBuffer('wildberries.positions', POSITION_COLUMNS)
+PRODUCTS_BUFFER = InsertBuffer('wildberries.products', PRODUCT_COLUMNS)
+BUFFERS = (DATA_BUFFER, POSITIONS_BUFFER, PRODUCTS_BUFFER)
+
+
+def flush_buffers_if_due():
+    for buffer in BUFFERS:
+        buffer.flush_if_due()
+
+
+def flush_buffers():
+    for buffer in BUFFERS:
+        buffer.flush()
+
+
+atexit.register(flush_buffers)
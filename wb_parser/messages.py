@@ -0,0 +1,68 @@
+from typing import Dict, List
+
+# Тексты сообщений бота, общие для синхронной и асинхронной версий
+
+
+def first_position_text(article: int, query: str, result: Dict) -> str:
+    product_data = result.get('product_data', {})
+    return (
+        f"🔍 Товар {article} по запросу '{query}':\n"
+        f"Текущая позиция: {result['position']}\n"
+        f"Страница выдачи: {result.get('page', 'Неизвестно')}\n"
+        f"Название: {product_data.get('name', 'Неизвестно')}\n"
+        f"Цена: {product_data.get('price', 'Неизвестно')} руб"
+    )
+
+
+def position_change_text(article: int, query: str, last_position: int, result: Dict) -> str:
+    product_data = result.get('product_data', {})
+    current_position = result['position']
+    change = last_position - current_position
+    arrow = "⬆️" if change > 0 else "⬇️"
+    return (
+        f"🔄 Изменение позиции товара {article} по запросу '{query}':\n"
+        f"Было: {last_position} → Стало: {current_position} {arrow}\n"
+        f"Изменение: {abs(change)} позиций\n"
+        f"Название: {product_data.get('name', 'Неизвестно')}\n"
+        f"Цена: {product_data.get('price', 'Неизвестно')} руб"
+    )
+
+
+def snapshot_changes_text(article: int, query: str, changes: Dict) -> str:
+    """Изменения цены и продвижения товара между двумя срезами выдачи"""
+    lines = [f"ℹ️ Товар {article} по запросу '{query}':"]
+    if 'price' in changes:
+        old_price, new_price = changes['price']
+        arrow = "⬆️" if new_price > old_price else "⬇️"
+        lines.append(f"Цена: {old_price} → {new_price} руб {arrow}")
+    if 'promo' in changes:
+        _, in_promo = changes['promo']
+        lines.append("Товар участвует в продвижении" if in_promo else "Товар больше не участвует в продвижении")
+    return "\n".join(lines)
+
+
+def history_text(article: int, query: str, history: List[Dict]) -> str:
+    text = f"📊 История позиций товара {article} по запросу '{query}':\n\n"
+
+    current_date = None
+    for entry in history:
+        entry_date = entry['date'].strftime('%d.%m.%Y')
+        if entry_date != current_date:
+            text += f"\n📅 {entry_date}:\n"
+            current_date = entry_date
+
+        text += (
+            f"🕒 {entry['date'].strftime('%H:%M')}: "
+            f"Позиция {entry['position']} | "
+            f"Цена: {entry['price']} руб | "
+            f"Отзывы: {entry['feedbacks']}\n"
+        )
+    # Ограничение Telegram на длину сообщения
+    return text[:4000]
+
+
+def chart_caption(article: int, query: str, days: int) -> str:
+    return (
+        f'📈 График изменения позиции товара {article}\n'
+        f'Запрос: "{query}" ({days} дней)'
+    )
@@ -21,6 +21,72 @@ class Item(BaseModel):
     log: Optional[Dict[str, Any]] = None  # Список логов, содержащий маркетинговую и техническую информацию
     colors: Optional[List[Dict[str, Any]]] = None  # Список цветов товара
 
+    @property
+    def price(self) -> int:
+        return self.sizes[0].get("price", {}).get("total", 0) // 100 if self.sizes else 0
+
+    @property
+    def logistics(self) -> int:
+        return self.sizes[0].get("price", {}).get("logistics", 0) if self.sizes else 0
+
+    @property
+    def colors_count(self) -> int:
+        return len(self.colors) if self.colors else 0
+
 
 class Items(BaseModel):
     products: List[Item]
+
+
+# Поля log, которые используются при сохранении и выводе данных товара
+LOG_FIELDS = ("promotion", "tp", "cpm", "promoPosition", "position")
+# Значения, которые записываются вместо отсутствующих полей товара
+LOG_DEFAULTS = {"tp": "no tp", "cpm": 0.0}
+NO_PROMO_TEXT = "no promo"
+
+
+class ProductRecord:
+    """
+    Компактная запись товара для быстрого режима разбора выдачи.
+    Содержит только поля, нужные для сохранения в БД и вывода данных товара,
+    и заполняется напрямую из JSON без валидации pydantic
+    """
+    __slots__ = (
+        "id", "name", "brand", "reviewRating", "feedbacks", "totalQuantity", "viewFlags",
+        "supplierFlags", "pics", "supplierRating", "dist", "promoTextCard",
+        "price", "logistics", "colors_count", "log",
+    )
+
+    def __init__(self, raw: Dict[str, Any]):
+        self.id = int(raw["id"])
+        self.name = raw.get("name")
+        self.brand = raw.get("brand")
+        self.reviewRating = raw.get("reviewRating")
+        self.feedbacks = raw.get("feedbacks")
+        self.totalQuantity = raw.get("totalQuantity")
+        self.viewFlags = raw.get("viewFlags")
+        self.supplierFlags = raw.get("supplierFlags")
+        self.pics = raw.get("pics")
+        self.supplierRating = raw.get("supplierRating")
+        self.dist = raw.get("dist")
+        self.promoTextCard = raw.get("promoTextCard") or NO_PROMO_TEXT
+
+        sizes = raw.get("sizes")
+        size_price = sizes[0].get("price", {}) if sizes else {}
+        self.price = size_price.get("total", 0) // 100
+        self.logistics = size_price.get("logistics", 0)
+
+        colors = raw.get("colors")
+        self.colors_count = len(colors) if colors else 0
+
+        log = raw.get("log")
+        self.log = {key: log[key] for key in LOG_FIELDS if key in log} if log else None
+        if self.log is not None:
+            for key, default in LOG_DEFAULTS.items():
+                if self.log.get(key) is None:
+                    self.log[key] = default
+
+
+def decode_products(products: List[Dict[str, Any]]) -> List[ProductRecord]:
+    """Быстрый разбор списка товаров из ответа поиска без полной валидации"""
+    return [ProductRecord(raw) for raw in products]
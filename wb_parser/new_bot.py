@@ -343,7 +343,7 @@ class WBTrackerBot:
         """Проверяет текущую позицию товара"""
         try:
             parser = ParserWB(query)
-            result = parser.find_product_position(article, query)
+            result = parser.find_product_position(article, query, full_snapshot=True)
             
             if not result:
                 self.bot.send_message(chat_id, f"❌ Товар {article} не найден по запросу '{query}'")
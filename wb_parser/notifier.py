@@ -0,0 +1,177 @@
+import asyncio
+import queue
+import threading
+import time
+from typing import Dict, List
+import logging
+from telebot import asyncio_helper
+from telebot.apihelper import ApiTelegramException
+from rate_limiter import RateLimiter
+
+# Лимиты Telegram: около 30 сообщений в секунду на бота и 1 в секунду в один чат
+GLOBAL_MESSAGES_PER_SECOND = 25
+CHAT_MESSAGES_PER_SECOND = 1
+# Сколько секунд копятся уведомления в один чат перед отправкой сводкой
+DEFAULT_COALESCE_WINDOW = 2.0
+# Максимальная длина одного сообщения Telegram
+MAX_MESSAGE_LENGTH = 4000
+MAX_ATTEMPTS = 5
+# Как часто удаляются ограничители чатов, в которые давно ничего не отправлялось, сек
+LIMITER_PRUNE_INTERVAL = 60
+# Сколько секунд поток рассылки ждет отправку сообщения через AsyncTeleBot
+ASYNC_SEND_TIMEOUT = 60
+
+
+class _PendingChat:
+    __slots__ = ('texts', 'chunks', 'first_at', 'not_before', 'attempts')
+
+    def __init__(self, now: float):
+        self.texts: List[str] = []
+        # Уже собранные, но еще не отправленные части сводки
+        self.chunks: List[str] = []
+        self.first_at = now
+        self.not_before = 0.0
+        self.attempts = 0
+
+
+class AsyncBotSender:
+    """
+    Адаптер AsyncTeleBot для NotificationDispatcher: поток рассылки отправляет
+    сообщение в event loop бота и ждет результат, не блокируя сам event loop.
+    Ошибки Telegram приводятся к ApiTelegramException синхронного API, чтобы
+    диспетчер так же повторял отправку после ответа 429
+    """
+
+    def __init__(self, bot, loop: asyncio.AbstractEventLoop):
+        self.bot = bot
+        self.loop = loop
+
+    def send_message(self, chat_id: int, text: str):
+        future = asyncio.run_coroutine_threadsafe(self._send(chat_id, text), self.loop)
+        return future.result(ASYNC_SEND_TIMEOUT)
+
+    async def _send(self, chat_id: int, text: str):
+        try:
+            return await self.bot.send_message(chat_id, text)
+        except asyncio_helper.ApiTelegramException as e:
+            raise ApiTelegramException(e.function_name, e.result, e.result_json) from e
+
+
+class NotificationDispatcher:
+    """
+    Очередь исходящих уведомлений Telegram.
+    send() только ставит текст в очередь и сразу возвращает управление.
+    Отдельный поток объединяет уведомления в один чат в сводку, соблюдает
+    общий лимит бота и лимит на чат (для каждой части длинной сводки)
+    и повторяет отправку после ответа 429
+    """
+
+    def __init__(self, bot, coalesce_window: float = DEFAULT_COALESCE_WINDOW,
+                 global_rate: float = GLOBAL_MESSAGES_PER_SECOND, chat_rate: float = CHAT_MESSAGES_PER_SECOND):
+        self.logger = logging.getLogger('WBTrackerBot')
+        self.bot = bot
+        self.coalesce_window = coalesce_window
+        self.chat_rate = chat_rate
+        self.global_limiter = RateLimiter(global_rate)
+        self._chat_limiters: Dict[int, RateLimiter] = {}
+        self._queue = queue.Queue()
+        self._pending: Dict[int, _PendingChat] = {}
+        self._pruned_at = time.monotonic()
+
+        self._thread = threading.Thread(target=self._run, name='notification-dispatcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def send(self, chat_id: int, text: str):
+        """Ставит уведомление в очередь на отправку"""
+        self._queue.put((chat_id, text))
+
+    def _drain_queue(self):
+        timeout = 0.1
+        while True:
+            try:
+                chat_id, text = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                return
+            pending = self._pending.get(chat_id)
+            if pending is None:
+                pending = self._pending[chat_id] = _PendingChat(time.monotonic())
+            pending.texts.append(text)
+            timeout = 0
+
+    def _run(self):
+        while True:
+            try:
+                self._drain_queue()
+                now = time.monotonic()
+                for chat_id, pending in list(self._pending.items()):
+                    if now - pending.first_at < self.coalesce_window or now < pending.not_before:
+                        continue
+                    limiter = self._chat_limiters.setdefault(chat_id, RateLimiter(self.chat_rate))
+                    if limiter.try_acquire() > 0:
+                        continue
+                    self._deliver(chat_id, pending)
+                if now - self._pruned_at >= LIMITER_PRUNE_INTERVAL:
+                    self._prune_limiters()
+                    self._pruned_at = now
+            except Exception as e:
+                self.logger.error(f"[NotificationDispatcher] Ошибка в потоке рассылки: {str(e)}", exc_info=True)
+                time.sleep(1)
+
+    def _prune_limiters(self):
+        """Удаляет ограничители чатов без очереди, лимит которых полностью восстановился"""
+        for chat_id, limiter in list(self._chat_limiters.items()):
+            if chat_id not in self._pending and limiter.is_full():
+                del self._chat_limiters[chat_id]
+
+    @staticmethod
+    def _digest(texts: List[str]) -> List[str]:
+        """Склеивает уведомления в сообщения не длиннее MAX_MESSAGE_LENGTH"""
+        if len(texts) == 1:
+            return [texts[0][:MAX_MESSAGE_LENGTH]]
+
+        header = f"📬 Изменения по отслеживаемым товарам ({len(texts)}):\n\n"
+        chunks, current = [], header
+        for text in texts:
+            text = text[:MAX_MESSAGE_LENGTH - len(header)]
+            if len(current) + len(text) + 2 > MAX_MESSAGE_LENGTH:
+                chunks.append(current.rstrip())
+                current = ""
+            current += text + "\n\n"
+        chunks.append(current.rstrip())
+        return chunks
+
+    def _deliver(self, chat_id: int, pending: _PendingChat):
+        """
+        Отправляет одну часть сводки. Следующая часть уйдет, когда лимит чата
+        снова разрешит отправку (см. _run)
+        """
+        if not pending.chunks:
+            pending.chunks = self._digest(pending.texts)
+            pending.texts = []
+
+        self.global_limiter.acquire()
+        try:
+            self.bot.send_message(chat_id, pending.chunks[0])
+        except ApiTelegramException as e:
+            pending.attempts += 1
+            if e.error_code == 429 and pending.attempts < MAX_ATTEMPTS:
+                retry_after = (e.result_json or {}).get('parameters', {}).get('retry_after', 1)
+                self.logger.warning(f"[NotificationDispatcher] Лимит Telegram для чата {chat_id}, повтор через {retry_after} с")
+                pending.not_before = time.monotonic() + retry_after
+                # 429 может означать и превышение общего лимита бота: остальные чаты тоже ждут
+                self.global_limiter.penalize(retry_after)
+                return
+            self.logger.error(f"[NotificationDispatcher] Не удалось отправить уведомление в чат {chat_id}: {str(e)}")
+        except Exception as e:
+            self.logger.error(f"[NotificationDispatcher] Ошибка при отправке уведомления в чат {chat_id}: {str(e)}", exc_info=True)
+        pending.chunks.pop(0)
+        pending.attempts = 0
+
+        if pending.chunks:
+            return
+        if pending.texts:
+            # Пока ждали повтора, в чат накопились новые уведомления
+            pending.first_at = time.monotonic()
+        else:
+            del self._pending[chat_id]
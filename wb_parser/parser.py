@@ -1,152 +1,321 @@
 import openpyxl
 import csv
-from model import Items
-from datetime import datetime
-from clickhouse_driver import Client
-import requests
+from model import Items, LOG_DEFAULTS, NO_PROMO_TEXT, decode_products
+from datetime import datetime, timedelta
+from clickhouse_pool import ClickHousePool
+from write_dedup import SQLiteDedupStore
 from typing import Optional, Dict, List, Tuple
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from array import array
+from crawl_cache import CRAWL_CACHE, CrawlSnapshot
+from wb_client import SEARCH_CLIENT, WBSearchClient
+from snapshot_diff import SNAPSHOT_STORE, SnapshotDiff
+from storage import HISTORY_RESOLUTIONS, ClickHouseStorage, SnapshotStorage
+from history_frame import clean_history, to_arrow, to_pandas
+from conversion_model import score_snapshot
+from schema import DATA_COLUMNS
 
-LAST_WRITE_TIMES = {}
+MAX_PAGES = 60
+DEFAULT_DEST = '123585528'
+DEFAULT_SORT = 'popular'
+# Сколько страниц выдачи запрашивается параллельно
+DEFAULT_CONCURRENCY = 6
+# Минимальный интервал между записями среза выдачи по одному запросу, сек
+WRITE_INTERVAL = 3598
 
 class ParserWB:
-    def __init__(self, query: str):
+    def __init__(self, query: str, concurrency: int = DEFAULT_CONCURRENCY,
+                 dest: str = DEFAULT_DEST, sort: str = DEFAULT_SORT, use_cache: bool = True,
+                 pool: Optional[ClickHousePool] = None, search_client: Optional[WBSearchClient] = None,
+                 strict: bool = True, buffered: bool = False, storage_mode: str = 'full',
+                 storage: Optional[SnapshotStorage] = None, dedup: Optional[SQLiteDedupStore] = None):
         # Используем основной логгер бота
         self.logger = logging.getLogger('WBTrackerBot')
         self.query = query
+        self.concurrency = max(1, concurrency)
+        self.dest = dest
+        self.sort = sort
+        self.use_cache = use_cache
+        # strict=True — полная валидация товаров через pydantic,
+        # strict=False — быстрый разбор только нужных полей в ProductRecord
+        self.strict = strict
         self.filename_excel = f"{query}.xlsx"
         self.filename_csv = f"{query}.csv"
-        
-        try:
-            self.client = Client(
-                host='195.133.194.116',
-                port=9000,  
-                user='default',
-                password='1234',
-                settings={'connect_timeout': 10}
+        # Хранилище срезов: по умолчанию ClickHouse, pool/buffered/storage_mode
+        # передаются в ClickHouseStorage. Для работы без сервера — storage.SQLiteStorage
+        self.storage = storage if storage is not None else ClickHouseStorage(pool, storage_mode, buffered)
+        # Окно записи срезов: по умолчанию окно хранилища (storage.write_dedup()),
+        # которое создается только при первой проверке или записи
+        self._dedup = dedup
+        # HTTP-сессия и лимит запросов к WB общие для всех обходов процесса
+        self.search_client = search_client if search_client is not None else SEARCH_CLIENT
+        # Изменения последнего полного среза относительно предыдущего (см. snapshot_diff)
+        self.last_diff: Optional[SnapshotDiff] = None
+
+    def _build_params(self, page: int) -> Dict:
+        return {
+            'ab_testing': 'false',
+            'appType': '1',
+            'curr': 'rub',
+            'dest': self.dest,
+            'lang': 'ru',
+            'page': page,
+            'query': self.query,
+            'resultset': 'catalog',
+            'sort': self.sort,
+            'spp': '30',
+            'suppressSpellcheck': 'false',
+        }
+
+    def _fetch_page(self, page: int) -> Optional[List]:
+        """
+        Загружает одну страницу выдачи.
+        Возвращает список товаров, пустой список для пустой страницы или None при ошибке
+        """
+        response = self.search_client.get(self._page_params(page))
+        if not self._page_loaded(page, response.status_code if response is not None else None):
+            return None
+        return self._decode_page(page, response.json())
+
+    def _page_params(self, page: int) -> Dict:
+        params = self._build_params(page)
+        self.logger.debug(f"[ParserWB] Запрос страницы {page} с параметрами: {params}")
+        return params
+
+    def _page_loaded(self, page: int, status: Optional[int]) -> bool:
+        """Проверяет код ответа на запрос страницы (None — сервер недоступен) и пишет ошибку в лог"""
+        if status is None:
+            self.logger.error(f"[ParserWB] Не удалось получить страницу {page}: сервер недоступен")
+            return False
+        if status != 200:
+            self.logger.error(f"[ParserWB] Ошибка при запросе данных! Код: {status}")
+            return False
+        return True
+
+    def _decode_page(self, page: int, payload: Dict) -> List:
+        """Разбирает ответ поиска в список товаров (пустой, если товаров на странице нет)"""
+        data = payload.get("data", {})
+        if "products" in data and isinstance(data["products"], list) and data["products"]:
+            if self.strict:
+                products = Items.model_validate(data).products
+            else:
+                products = decode_products(data["products"])
+            self.logger.info(f"[ParserWB] Прочитаны данные со страницы {page}: {len(products)} товаров")
+            return products
+
+        self.logger.warning(f"[ParserWB] Список товаров пуст или отсутствует на странице {page}")
+        return []
+
+    def _cache_key(self):
+        # Режим разбора входит в ключ: в срезе лежат либо Item, либо ProductRecord
+        return (self.query, self.dest, self.sort, self.strict)
+
+    def _open_snapshot(self) -> CrawlSnapshot:
+        """Срез выдачи по запросу из общего кэша (или новый, если кэш отключен)"""
+        snapshot = CRAWL_CACHE.get_or_create(self._cache_key()) if self.use_cache else CrawlSnapshot()
+        if snapshot.pages:
+            self.logger.info(
+                f"[ParserWB] Используется кэшированный срез по запросу '{self.query}': "
+                f"{len(snapshot.pages)} стр.{' (полный)' if snapshot.complete else ''}"
             )
-            
-            test_result = self.client.execute('SELECT 1')
-            self.logger.info(f"[ParserWB] Соединение с ClickHouse установлено успешно (запрос: '{query}')")
-        
-        except Exception as e:
-            self.logger.error(f"[ParserWB] Ошибка подключения к ClickHouse: {str(e)}", exc_info=True)
-            raise
+        return snapshot
 
-    def _execute_query(self, query, params=None):
-        """Выполняет SQL-запрос к ClickHouse через clickhouse-driver"""
-        try:
-            self.logger.debug(f"[ParserWB] Выполнение запроса: {query[:100]}... (params: {params})")
-            result = self.client.execute(query, params)
-            self.logger.debug("[ParserWB] Запрос выполнен успешно")
-            return result
-        except Exception as e:
-            self.logger.error(f"[ParserWB] Ошибка выполнения запроса: {str(e)}", exc_info=True)
+    def _iter_pages(self):
+        """
+        Отдает страницы выдачи (номер, товары) строго по порядку.
+        Страницы берутся из общего среза в кэше, недостающие догружаются
+        пачками по self.concurrency штук. Обход останавливается на первой
+        пустой странице или ошибке
+        """
+        snapshot = self._open_snapshot()
+        index = 0
+        while True:
+            if index < len(snapshot.pages):
+                yield index + 1, snapshot.pages[index]
+                index += 1
+                continue
+            if snapshot.complete:
+                return
+            with snapshot.lock:
+                # Пока ждали блокировку, страницы могли догрузить другие проверки
+                if index >= len(snapshot.pages) and not snapshot.complete:
+                    if not self._extend_snapshot(snapshot):
+                        return
+
+    def _extend_snapshot(self, snapshot: CrawlSnapshot) -> bool:
+        """
+        Догружает в срез следующую пачку страниц.
+        Возвращает False, если не удалось добавить ни одной страницы из-за ошибки
+        """
+        batch = self._next_batch(snapshot)
+        if batch is None:
+            return True
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            # map сохраняет порядок страниц независимо от порядка ответов
+            results = list(executor.map(self._fetch_page, batch))
+        return self._append_pages(snapshot, batch, results)
+
+    def _next_batch(self, snapshot: CrawlSnapshot) -> Optional[range]:
+        """Номера страниц следующей пачки или None, если выдача прочитана до предела"""
+        page = len(snapshot.pages) + 1
+        if page > MAX_PAGES:
+            snapshot.complete = True
             return None
+        return range(page, min(page + self.concurrency, MAX_PAGES + 1))
+
+    def _append_pages(self, snapshot: CrawlSnapshot, batch: range, results: List) -> bool:
+        """Дописывает загруженную пачку в срез до первой пустой страницы или ошибки"""
+        added = 0
+        for products in results:
+            if products is None:
+                # Ошибку не кэшируем: следующая проверка попробует загрузить страницу снова
+                return added > 0
+            if not products:
+                snapshot.complete = True
+                return True
+            snapshot.pages.append(products)
+            added += 1
+
+        if batch.stop > MAX_PAGES:
+            snapshot.complete = True
+        return True
+
+    def iter_products(self):
+        """
+        Отдает товары выдачи по одному в порядке позиций: (позиция, страница, товар).
+        Следующие страницы загружаются только по мере чтения
+        """
+        position = 0
+        for page, products in self._iter_pages():
+            for product in products:
+                position += 1
+                yield position, page, product
 
     def parse(self):
-        _page = 1
+        """
+        Обходит всю выдачу по запросу и сохраняет срез в хранилище.
+        Если срез по запросу уже записан в текущем окне, обход не выполняется:
+        его результат все равно был бы отброшен (как и в CrawlEngine)
+        """
+        if not self._write_due():
+            self.logger.info(f"[ParserWB] Срез по запросу '{self.query}' уже сохранен, обход пропущен")
+            return None
+
         all_items = Items(products=[])
-        self.logger.info(f"[ParserWB] Начало парсинга запроса: '{self.query}'")
-
-        while _page < 61:
-            params = {
-                'ab_testing': 'false',
-                'appType': '1',
-                'curr': 'rub',
-                'dest': '123585528',
-                'lang': 'ru',
-                'page': _page,
-                'query': self.query,
-                'resultset': 'catalog',
-                'sort': 'popular',
-                'spp': '30',
-                'suppressSpellcheck': 'false',
-            }
+        self.logger.info(f"[ParserWB] Начало парсинга запроса: '{self.query}' (параллельно страниц: {self.concurrency})")
 
-            self.logger.debug(f"[ParserWB] Запрос страницы {_page} с параметрами: {params}")
-            response = requests.get('https://search.wb.ru/exactmatch/ru/common/v9/search', params=params)
-            _page += 1
-            
-            if response.status_code == 200:
-                data = response.json().get("data", {})
-                
-                if "products" in data and isinstance(data["products"], list) and data["products"]:
-                    items_info = Items.model_validate(data)
-                    all_items.products.extend(items_info.products)
-                    self.logger.info(f"[ParserWB] Прочитаны данные со страницы {_page-1}: {len(items_info.products)} товаров")
-                else:
-                    self.logger.warning(f"[ParserWB] Список товаров пуст или отсутствует на странице {_page-1}")
-                    break
-            else:
-                self.logger.error(f"[ParserWB] Ошибка при запросе данных! Код: {response.status_code}")
-                break
+        for _, products in self._iter_pages():
+            all_items.products.extend(products)
         
         if all_items.products:
-            self.logger.info(f"[ParserWB] Всего загружено {len(all_items.products)} товаров. Сохранение в ClickHouse...")
-            result = self.__save_to_db(all_items)
-            if result:
-                self.logger.info(f"[ParserWB] Успешно загружено {len(all_items.products)} записей в ClickHouse")
-            else:
-                self.logger.error("[ParserWB] Ошибка при загрузке данных в ClickHouse")
+            self._save_snapshot(all_items)
             return all_items
         else:
             self.logger.warning("[ParserWB] Не найдено ни одного товара по запросу")
             return None
 
-    def find_product_position(self, article: int, query: str) -> Optional[Dict]:
+    def _save_snapshot(self, items: Items) -> bool:
+        """Сравнивает полный срез выдачи с предыдущим и сохраняет его в хранилище"""
+        self.last_diff = SNAPSHOT_STORE.update(self.query, items.products)
+        self.logger.info(f"[ParserWB] Всего загружено {len(items.products)} товаров. Сохранение в хранилище...")
+        result = self.__save_to_db(items)
+        if result:
+            self.logger.info(f"[ParserWB] Успешно загружено {len(items.products)} записей в хранилище")
+        else:
+            self.logger.error("[ParserWB] Ошибка при загрузке данных в хранилище")
+        return result
+
+    @property
+    def dedup(self) -> SQLiteDedupStore:
+        if self._dedup is None:
+            self._dedup = self.storage.write_dedup()
+        return self._dedup
+
+    def _write_due(self) -> bool:
+        """Проверяет, прошло ли достаточно времени с последней записи среза по запросу"""
+        return self.dedup.is_due(self.query, WRITE_INTERVAL)
+
+    def find_product_position(self, article: int, query: str, full_snapshot: bool = False) -> Optional[Dict]:
         """
         Ищет товар по артикулу в текущем запросе и возвращает его позицию и данные
-        Возвращает словарь с ключами: position, product_data
+        Возвращает словарь с ключами: position, page, product_data
+
+        По умолчанию выдача читается постранично и обход прекращается, как только
+        товар найден. При full_snapshot=True выдача дочитывается до конца и
+        сохраняется в хранилище (если срез по запросу еще не записан в этот час)
+        """
+        return self.find_products_positions([article], query, full_snapshot).get(article)
+
+    def find_products_positions(self, articles: List[int], query: str,
+                                full_snapshot: bool = False) -> Dict[int, Optional[Dict]]:
         """
+        Ищет несколько артикулов за один обход выдачи.
+        Возвращает словарь {артикул: результат find_product_position}
+        """
+        results = {article: None for article in articles}
         try:
-            self.logger.info(f"[ParserWB] Поиск товара {article} по запросу '{query}'")
-            parsed_data = self.parse()
-            
-            if parsed_data:
-                for idx, product in enumerate(parsed_data.products):
-                    if product.id == article:
-                        position = idx + 1
-                        self.logger.info(f"[ParserWB] Товар {article} найден на позиции {position}")
-                        return {
-                            'position': position,
-                            'product_data': self._extract_product_data(product)
-                        }
-            
-            self.logger.warning(f"[ParserWB] Товар {article} не найден в текущем парсинге, поиск в БД")
-            return self._find_product_in_db(article, query)
+            self.logger.info(f"[ParserWB] Поиск товаров {list(results)} по запросу '{query}'")
+
+            full_snapshot = full_snapshot and self._snapshot_due()
+
+            all_items = Items(products=[])
+            remaining = set(results)
+            for position, page, product in self.iter_products():
+                if full_snapshot:
+                    all_items.products.append(product)
+                self._match_product(results, remaining, position, page, product)
+                if not remaining and not full_snapshot:
+                    break
+
+            self._finish_search(results, remaining, all_items, query)
             
         except Exception as e:
-            self.logger.error(f"[ParserWB] Ошибка при поиске товара {article}: {str(e)}", exc_info=True)
-            return None
+            self.logger.error(f"[ParserWB] Ошибка при поиске товаров {list(results)}: {str(e)}", exc_info=True)
+        return results
+
+    def _snapshot_due(self) -> bool:
+        """Нужен ли полный обход для записи среза при поиске товаров"""
+        if self._write_due():
+            return True
+        self.logger.info(f"[ParserWB] Срез по запросу '{self.query}' уже сохранен, выполняется поиск без полного обхода")
+        return False
+
+    def _match_product(self, results: Dict[int, Optional[Dict]], remaining: set,
+                       position: int, page: int, product):
+        """Записывает позицию товара в results, если его артикул еще ищется"""
+        if product.id not in remaining:
+            return
+        self.logger.info(f"[ParserWB] Товар {product.id} найден на позиции {position} (страница {page})")
+        results[product.id] = {
+            'position': position,
+            'page': page,
+            'product_data': self._extract_product_data(product)
+        }
+        remaining.discard(product.id)
+
+    def _finish_search(self, results: Dict[int, Optional[Dict]], remaining: set, all_items: Items, query: str):
+        """Сохраняет собранный при поиске срез и ищет в БД товары, которых нет в выдаче"""
+        if all_items.products:
+            self._save_snapshot(all_items)
+
+        for article in remaining:
+            self.logger.warning(f"[ParserWB] Товар {article} не найден в текущем парсинге, поиск в БД")
+            results[article] = self._find_product_in_db(article, query)
 
     def _find_product_in_db(self, article: int, query: str) -> Optional[Dict]:
         """
-        Ищет товар в ClickHouse по артикулу и запросу
+        Ищет товар в хранилище срезов по артикулу и запросу
         Возвращает последнюю запись о товаре
         """
-        query_sql = """
-        SELECT 
-            if (promotion = 'no promotion' or promotion = '',position,promoPosition) as position_with_promo,
-            name,
-            brand,
-            price,
-            number_of_feedbacks,
-            reviewRating,
-            promoTextCard,
-            created_at
-        FROM wildberries.data
-        WHERE articul = %(article)s AND query = %(query)s
-        ORDER BY created_at DESC
-        LIMIT 1
-        """
-        
         try:
             self.logger.debug(f"[ParserWB] Поиск товара {article} в БД по запросу '{query}'")
-            result = self._execute_query(query_sql, {'article': article, 'query': query})
+            record = self.storage.latest_record(article, query)
             
-            if result:
-                position, name, brand, price, feedbacks, rating, promo_text, timestamp = result[0]
+            if record:
+                position, name, brand, price, feedbacks, rating, promo_text, timestamp = record
                 self.logger.info(f"[ParserWB] Товар {article} найден в БД на позиции {position}")
                 return {
                     'position': position,
@@ -166,41 +335,32 @@ class ParserWB:
             self.logger.error(f"[ParserWB] Ошибка при поиске товара в БД: {str(e)}", exc_info=True)
             return None
 
-    def get_product_history(self, article: int, query: str, days: int = 7) -> List[Dict]:
+    def get_product_history(self, article: int, query: str, days: int = 7,
+                            resolution: Optional[str] = None) -> List[Dict]:
         """
         Возвращает историю позиций товара за указанное количество дней
+        
+        resolution=None — все замеры за период,
+        'hour'/'day' — агрегаты по часам/дням, посчитанные в хранилище:
+        position (средняя), min_position, max_position, price (средняя), feedbacks (максимум)
         """
-        query_sql = """
-        SELECT 
-            if (promotion = 'no promotion' or promotion = '',position,promoPosition) as position_with_promo,
-            price,
-            number_of_feedbacks,
-            created_at  
-        FROM wildberries.data
-        WHERE articul = %(article)s  AND query = %(query)s
-          AND created_at <= %(date_from)s
-        ORDER BY created_at
-        """
+        if resolution is not None and resolution not in HISTORY_RESOLUTIONS:
+            raise ValueError(f"Неизвестная детализация истории: {resolution}")
         
-        date_from = datetime.now()
-        self.logger.info(f"[ParserWB] Получение истории товара {article} за последние {days} дней")
+        date_from = datetime.now() - timedelta(days=days)
+        self.logger.info(f"[ParserWB] Получение истории товара {article} за последние {days} дней (детализация: {resolution or 'все замеры'})")
         
         try:
-            results = self._execute_query(
-                query_sql, 
-                {
-                    'article': article,
-                    'query': query,
-                    'date_from': date_from
-                }
-            )
+            results = self.storage.history(article, query, date_from, resolution)
             
             history = []
             for row in results:
-                position, price, feedbacks, timestamp = row
+                position, min_position, max_position, price, feedbacks, timestamp = row
                 history.append({
                     'date': timestamp,
                     'position': position,
+                    'min_position': min_position,
+                    'max_position': max_position,
                     'price': price,
                     'feedbacks': feedbacks
                 })
@@ -214,22 +374,19 @@ class ParserWB:
     def _extract_product_data(self, product) -> Dict:
         """Извлекает основные данные о товаре"""
         try:
-            price = product.sizes[0].get("price", {}).get("total", 0) // 100 if product.sizes else 0
-            logistics = product.sizes[0].get("price", {}).get("logistics", 0) if product.sizes else 0
-            
             data = {
                 'id': product.id,
                 'name': product.name if product.name else 'no name',
                 'brand': product.brand if product.brand else 'no brand',
-                'price': price,
-                'logistics_cost': logistics,
+                'price': product.price,
+                'logistics_cost': product.logistics,
                 'rating': product.reviewRating if product.reviewRating else 0,
                 'feedbacks': product.feedbacks if product.feedbacks else 0,
                 'quantity': product.totalQuantity if product.totalQuantity else 0,
-                'promo_text': product.promoTextCard if product.promoTextCard else 'no promo',
+                'promo_text': product.promoTextCard if product.promoTextCard else NO_PROMO_TEXT,
                 'position': product.log.get("position") if product.log else -1,
                 'promo_position': product.log.get("promoPosition") if product.log else -1,
-                'colors': len(product.colors) if product.colors else 1
+                'colors': product.colors_count or 1
             }
             
             self.logger.debug(f"[ParserWB] Извлечены данные товара {product.id}: {data}")
@@ -252,71 +409,121 @@ class ParserWB:
                 'colors': 0
             }
     
+    def load_history(self, days: int = 30, date_to: Optional[datetime] = None, output: str = 'pandas'):
+        """
+        Загружает все замеры по запросу за период для анализа (research.ipynb).
+        Столбцы читаются из хранилища целиком и очищаются векторно (см. history_frame):
+        типизированные числа, бренд категорией и его код, флаги продвижения 0/1.
+
+        output='pandas' — pandas.DataFrame, 'arrow' — pyarrow.Table,
+        'numpy' — ({заголовок: массив numpy}, список брендов по кодам)
+        """
+        if output not in ('pandas', 'arrow', 'numpy'):
+            raise ValueError(f"Неизвестный формат результата: {output}")
+        date_to = date_to or datetime.now()
+        date_from = date_to - timedelta(days=days)
+        self.logger.info(f"[ParserWB] Загрузка замеров по запросу '{self.query}' с {date_from:%Y-%m-%d} по {date_to:%Y-%m-%d}")
+
+        frame, brands = clean_history(self.storage.read_columns(self.query, date_from, date_to))
+        self.logger.info(f"[ParserWB] Загружено {len(frame['id'])} записей по запросу '{self.query}'")
+        if output == 'numpy':
+            return frame, brands
+        if output == 'arrow':
+            return to_arrow(frame, brands)
+        return to_pandas(frame, brands)
+
     def __save_to_db(self, items: Items):
-        current_time = datetime.now()
+        self.logger.info(f"[ParserWB] Подготовка {len(items.products)} товаров для сохранения в БД")
+        return self.save_columns(self._build_columns(items, datetime.now()))
+
+    def save_columns(self, columns: List) -> bool:
+        """
+        Записывает готовые колонки среза (в порядке DATA_COLUMNS) в хранилище,
+        если срез по запросу еще не записан в текущем окне WRITE_INTERVAL.
+        Перед записью к срезу добавляется оценка конверсии (см. conversion_model)
+        """
         self.logger.debug(f"[ParserWB] Проверка времени последней записи для запроса '{self.query}'")
         
-        if self.query in LAST_WRITE_TIMES:
-            last_write_time = LAST_WRITE_TIMES[self.query]
-            time_diff = (current_time - last_write_time).total_seconds()
-            
-            if time_diff < 3598:
-                self.logger.warning(
-                    f"[ParserWB] Данные по запросу '{self.query}' уже сохранялись {time_diff:.0f} секунд назад. "
-                    "Пропускаем сохранение."
-                )
-                return False
-        else:
+        # Окно записи захватывается атомарно, поэтому срез не запишут повторно
+        # ни после перезапуска, ни другие процессы
+        claimed_at = time.time()
+        previous_write = self.dedup.try_claim(self.query, WRITE_INTERVAL, claimed_at)
+        if previous_write is None:
+            self.logger.warning(
+                f"[ParserWB] Данные по запросу '{self.query}' уже сохранялись в последние {WRITE_INTERVAL} секунд. "
+                "Пропускаем сохранение."
+            )
+            return False
+        if not previous_write:
             self.logger.info(f"[ParserWB] Первая запись для запроса '{self.query}'")
         
-        data_to_insert = []
-        self.logger.info(f"[ParserWB] Подготовка {len(items.products)} товаров для сохранения в БД")
-        
-        for i, product in enumerate(items.products): 
-            price = product.sizes[0].get("price", {}).get("total", 0) // 100
-            logistics = product.sizes[0].get("price", {}).get("logistics", 0)
-
-            data_to_insert.append((
-                product.id,
-                self.query,
-                datetime.now(),
-                product.name if product.name else 'no name',
-                product.brand if product.brand else 'no brand',
-                price,
-                logistics,
-                product.reviewRating if product.reviewRating else 0,
-                product.feedbacks if product.feedbacks else 0,
-                product.totalQuantity if product.totalQuantity else 0,
-                product.viewFlags if product.viewFlags else 0,
-                product.pics if product.pics else 0,
-                product.supplierFlags if product.supplierFlags else 0,
-                product.supplierRating if product.supplierRating else 0,
-                product.dist if product.dist else 0,
-                str(product.log.get("promotion")) if product.log else "no promotion",
-                product.log.get("tp") if product.log else "no tp",
-                product.promoTextCard if product.promoTextCard else 'no promo',
-                product.log.get("cpm") if product.log else 0,
-                product.log.get("promoPosition") if product.log else -1,
-                product.log.get("position") if product.log else i+1,
-                len(product.colors) if product.colors else 0
-            ))
-        
+        rows = len(columns[0])
         try:
-            self.logger.info(f"[ParserWB] Начало вставки {len(data_to_insert)} записей в ClickHouse")
-            self.client.execute(
-                """INSERT INTO wildberries.data VALUES""",
-                data_to_insert,
-                types_check=True
-            )
-            
-            LAST_WRITE_TIMES[self.query] = current_time
-            self.logger.info(f"[ParserWB] Успешно сохранено {len(data_to_insert)} записей для запроса '{self.query}'")
+            if len(columns) == len(DATA_COLUMNS):
+                columns = list(columns) + [score_snapshot(columns)]
+            # Срез, отброшенный буфером вставки (buffered=True), освобождает окно записи
+            self.storage.insert_snapshot(self.query, columns, lambda: self._release_window(previous_write, claimed_at))
+            self.logger.info(f"[ParserWB] Успешно сохранено {rows} записей для запроса '{self.query}'")
             return True
             
         except Exception as e:
             self.logger.error(f"[ParserWB] Ошибка при вставке данных: {str(e)}", exc_info=True)
+            self.dedup.release(self.query, previous_write, claimed_at)
             return False
 
+    def _release_window(self, previous_write: float, claimed_at: float):
+        self.logger.error(f"[ParserWB] Срез по запросу '{self.query}' отброшен буфером вставки, окно записи освобождено")
+        self.dedup.release(self.query, previous_write, claimed_at)
+
+    def _build_columns(self, items: Items, created_at: datetime) -> List:
+        """
+        Собирает колонки для вставки в wildberries.data в порядке DATA_COLUMNS.
+        Все строки среза получают одно время замера created_at
+        """
+        return build_columns(items.products, self.query, created_at)
+
+
+def _log_value(log: Optional[Dict], key: str):
+    """Поле log товара или значение по умолчанию, если log или поля нет"""
+    value = log.get(key) if log else None
+    return LOG_DEFAULTS[key] if value is None else value
+
+
+def build_columns(products: List, query: str, created_at: datetime, first_position: Optional[int] = 1) -> List:
+    """
+    Собирает колонки среза в порядке DATA_COLUMNS из товаров одной выдачи.
+    Товары без log получают позицию по порядку, начиная с first_position.
+    При first_position=None их позиция остается пустой: так колонки собираются
+    по отдельным страницам, пока число товаров до страницы еще неизвестно
+    """
+    logs = [product.log for product in products]
+    rows = len(products)
+    return [
+        array('Q', (product.id for product in products)),
+        [query] * rows,
+        [created_at] * rows,
+        [product.name if product.name else 'no name' for product in products],
+        [product.brand if product.brand else 'no brand' for product in products],
+        array('q', (product.price for product in products)),
+        array('q', (product.logistics for product in products)),
+        array('d', (product.reviewRating or 0 for product in products)),
+        array('q', (product.feedbacks or 0 for product in products)),
+        array('q', (product.totalQuantity or 0 for product in products)),
+        array('q', (product.viewFlags or 0 for product in products)),
+        array('q', (product.pics or 0 for product in products)),
+        array('q', (product.supplierFlags or 0 for product in products)),
+        array('d', (product.supplierRating or 0 for product in products)),
+        array('q', (product.dist or 0 for product in products)),
+        [str(log.get("promotion")) if log else "no promotion" for log in logs],
+        [_log_value(log, "tp") for log in logs],
+        [product.promoTextCard if product.promoTextCard else NO_PROMO_TEXT for product in products],
+        [_log_value(log, "cpm") for log in logs],
+        [log.get("promoPosition") if log else -1 for log in logs],
+        [log.get("position") if log else (None if first_position is None else first_position + i)
+         for i, log in enumerate(logs)],
+        array('q', (product.colors_count for product in products)),
+    ]
+
 if __name__ == "__main__":
     # Настройка логирования при запуске напрямую (для тестирования)
     logging.basicConfig(
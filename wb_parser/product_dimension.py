@@ -0,0 +1,45 @@
+import threading
+from collections import OrderedDict
+from typing import List, Sequence, Tuple
+
+# Сколько товаров помнит кэш справочника
+DEFAULT_MAX_PRODUCTS = 1000000
+
+
+class ProductDimensionCache:
+    """
+    Последние записанные в wildberries.products атрибуты товаров.
+    Позволяет при каждом обходе отправлять в справочник только новые
+    и изменившиеся товары. После перезапуска кэш пуст и товары
+    записываются повторно, дубли схлопывает ReplacingMergeTree
+    """
+
+    def __init__(self, max_products: int = DEFAULT_MAX_PRODUCTS):
+        self.max_products = max_products
+        self._attributes: "OrderedDict[int, Tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def changed(self, articles: Sequence[int], attributes: Sequence[Tuple]) -> List[int]:
+        """
+        Возвращает индексы товаров, атрибуты которых отличаются от записанных,
+        и сразу запоминает новые значения
+        """
+        indexes = []
+        with self._lock:
+            for index, (article, values) in enumerate(zip(articles, attributes)):
+                if self._attributes.get(article) != values:
+                    self._attributes[article] = values
+                    indexes.append(index)
+                self._attributes.move_to_end(article)
+            while len(self._attributes) > self.max_products:
+                self._attributes.popitem(last=False)
+        return indexes
+
+    def forget(self, articles: Sequence[int]):
+        """Убирает товары из кэша, например после неудачной вставки"""
+        with self._lock:
+            for article in articles:
+                self._attributes.pop(article, None)
+
+
+PRODUCT_DIMENSION = ProductDimensionCache()
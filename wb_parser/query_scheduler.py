@@ -0,0 +1,139 @@
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import logging
+
+# Длина окна, по которому разносятся проверки разных запросов, сек
+SPREAD_WINDOW = 3600
+# Сколько запросов может обрабатываться одновременно
+DEFAULT_MAX_WORKERS = 4
+
+
+class Subscription:
+    """Отслеживание одного артикула пользователем по запросу"""
+    __slots__ = ('chat_id', 'article', 'query', 'interval', 'next_run')
+
+    def __init__(self, chat_id: int, article: int, query: str, interval: int, next_run: float):
+        self.chat_id = chat_id
+        self.article = article
+        self.query = query
+        self.interval = interval
+        self.next_run = next_run
+
+
+class QueryScheduler:
+    """
+    Планировщик проверок, сгруппированных по поисковому запросу.
+    За один тик каждый запрос обходится один раз, а все наступившие проверки
+    артикулов по нему передаются в check_query одним списком.
+    Асинхронная версия бота забирает запросы через collect_due()/finish() сама.
+    Каждый запрос получает собственный слот внутри часа, чтобы обходы разных
+    запросов не совпадали по времени
+    """
+
+    def __init__(self, check_query: Optional[Callable[[str, List[Subscription]], None]] = None,
+                 max_workers: int = DEFAULT_MAX_WORKERS):
+        self.logger = logging.getLogger('WBTrackerBot')
+        self.check_query = check_query
+        # {query: {(chat_id, article): Subscription}}
+        self._subscriptions: Dict[str, Dict[Tuple[int, int], Subscription]] = {}
+        self._running = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='query-check')
+
+    @staticmethod
+    def _query_phase(query: str) -> int:
+        """Смещение слота запроса внутри окна, стабильное между перезапусками"""
+        return zlib.crc32(query.encode('utf-8')) % SPREAD_WINDOW
+
+    def _next_slot(self, query: str, earliest: float) -> float:
+        """Ближайший слот запроса не раньше earliest"""
+        slot = earliest - earliest % SPREAD_WINDOW + self._query_phase(query)
+        if slot < earliest:
+            slot += SPREAD_WINDOW
+        return slot
+
+    def add(self, chat_id: int, article: int, query: str, interval: int):
+        """
+        Добавляет или обновляет отслеживание. interval задается в секундах.
+        Первая плановая проверка — в ближайший слот запроса не раньше, чем через половину интервала
+        """
+        next_run = self._next_slot(query, time.time() + interval / 2)
+        with self._lock:
+            self._subscriptions.setdefault(query, {})[(chat_id, article)] = Subscription(
+                chat_id, article, query, interval, next_run
+            )
+        self.logger.info(
+            f"[QueryScheduler] Товар {article} по запросу '{query}': проверка каждые {interval // 3600} ч, "
+            f"ближайшая в {time.strftime('%H:%M:%S', time.localtime(next_run))}"
+        )
+
+    def add_many(self, subscriptions: Iterable[Tuple[int, int, str, int]]) -> int:
+        """
+        Массово добавляет отслеживания (chat_id, article, query, interval) под одной блокировкой,
+        например при восстановлении после перезапуска. Возвращает количество добавленных
+        """
+        now = time.time()
+        count = 0
+        with self._lock:
+            for chat_id, article, query, interval in subscriptions:
+                next_run = self._next_slot(query, now + interval / 2)
+                self._subscriptions.setdefault(query, {})[(chat_id, article)] = Subscription(
+                    chat_id, article, query, interval, next_run
+                )
+                count += 1
+        self.logger.info(f"[QueryScheduler] Восстановлено {count} отслеживаний по {len(self._subscriptions)} запросам")
+        return count
+
+    def remove(self, chat_id: int, article: int, query: str):
+        with self._lock:
+            subscriptions = self._subscriptions.get(query)
+            if subscriptions is None:
+                return
+            subscriptions.pop((chat_id, article), None)
+            if not subscriptions:
+                del self._subscriptions[query]
+
+    def collect_due(self) -> List[Tuple[str, List[Subscription]]]:
+        """
+        Забирает запросы, у которых наступили проверки, и переносит их следующий запуск.
+        Запрос считается выполняющимся, пока для него не вызван finish()
+        """
+        now = time.time()
+        due_queries = []
+        with self._lock:
+            for query, subscriptions in self._subscriptions.items():
+                if query in self._running:
+                    continue
+                due = [s for s in subscriptions.values() if s.next_run <= now]
+                if not due:
+                    continue
+                for subscription in due:
+                    next_run = subscription.next_run + subscription.interval
+                    # После простоя не догоняем пропущенные слоты, а переходим к ближайшему
+                    if next_run <= now:
+                        next_run = self._next_slot(query, now)
+                    subscription.next_run = next_run
+                self._running.add(query)
+                due_queries.append((query, due))
+        return due_queries
+
+    def finish(self, query: str):
+        with self._lock:
+            self._running.discard(query)
+
+    def run_pending(self):
+        """Отправляет на обработку в пул потоков все запросы, у которых наступили проверки"""
+        for query, due in self.collect_due():
+            self.logger.info(f"[QueryScheduler] Проверка запроса '{query}': {len(due)} товаров")
+            self._executor.submit(self._run_query, query, due)
+
+    def _run_query(self, query: str, due: List[Subscription]):
+        try:
+            self.check_query(query, due)
+        except Exception as e:
+            self.logger.error(f"[QueryScheduler] Ошибка при проверке запроса '{query}': {str(e)}", exc_info=True)
+        finally:
+            self.finish(query)
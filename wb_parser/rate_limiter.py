@@ -0,0 +1,55 @@
+import threading
+import time
+from typing import Optional
+
+
+class RateLimiter:
+    """
+    Ограничитель частоты по алгоритму token bucket.
+    rate — сколько операций в секунду разрешено в среднем, capacity — допустимый всплеск
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """
+        Пытается забрать токены без ожидания.
+        Возвращает 0, если токены получены, иначе — сколько секунд нужно подождать
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def acquire(self, tokens: float = 1.0):
+        """Блокирует поток, пока не будут получены токены"""
+        while True:
+            delay = self.try_acquire(tokens)
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def is_full(self) -> bool:
+        """Бакет полон: ограничитель неотличим от нового, и его можно не хранить"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens >= self.capacity
+
+    def penalize(self, seconds: float):
+        """Запрещает операции на указанное время, например после ответа 429"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens = min(self._tokens, -seconds * self.rate)
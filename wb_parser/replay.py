@@ -0,0 +1,138 @@
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, quote, unquote, urlparse
+import logging
+from wb_client import WBSearchClient
+
+# Каталог с записанными ответами поиска: <каталог>/<запрос>/<страница>.json
+DEFAULT_FIXTURES_DIR = 'wb_fixtures'
+# Ответ поиска за последней страницей выдачи
+EMPTY_PAGE = b'{"data": {"products": []}}'
+
+
+def fixture_path(fixtures_dir: str, query: str, page: int) -> str:
+    return os.path.join(fixtures_dir, quote(query, safe=''), f'{page}.json')
+
+
+class RecordingSearchClient(WBSearchClient):
+    """
+    Клиент поиска WB, который сохраняет успешные ответы на диск.
+    Передается в ParserWB(search_client=...) для однократной записи выдачи
+    """
+
+    def __init__(self, fixtures_dir: str = DEFAULT_FIXTURES_DIR, **kwargs):
+        super().__init__(**kwargs)
+        self.fixtures_dir = fixtures_dir
+
+    def get(self, params: Dict):
+        response = super().get(params)
+        if response is not None and response.status_code == 200:
+            path = fixture_path(self.fixtures_dir, params['query'], params['page'])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(response.content)
+            self.logger.debug(f"[RecordingSearchClient] Ответ сохранен в {path}")
+        return response
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    server: 'ReplayServer'
+
+    def do_GET(self):
+        server = self.server
+        params = parse_qs(urlparse(self.path).query)
+        query = params.get('query', [''])[0]
+        page = int(params.get('page', ['1'])[0])
+
+        delay = server.latency + random.uniform(0, server.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+        if random.random() < server.error_rate:
+            status = random.choice((429, 503))
+            server.count('errors')
+            self.send_response(status)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        path = fixture_path(server.fixtures_dir, query, page)
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            body = EMPTY_PAGE
+        server.count('pages')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Запросы к заглушке не пишем в лог бота
+        pass
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """
+    Локальная заглушка поиска WB, отдающая записанные ответы.
+    latency и jitter задают задержку ответа в секундах, error_rate — долю
+    ответов 429/503 (с Retry-After: 0) для проверки повторов клиента.
+    Для отсутствующей страницы отдается пустая выдача, как у WB после последней страницы
+    """
+    daemon_threads = True
+
+    def __init__(self, fixtures_dir: str = DEFAULT_FIXTURES_DIR, latency: float = 0.0,
+                 jitter: float = 0.0, error_rate: float = 0.0, port: int = 0):
+        super().__init__(('127.0.0.1', port), _ReplayHandler)
+        self.logger = logging.getLogger('WBTrackerBot')
+        self.fixtures_dir = fixtures_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stats = {'pages': 0, 'errors': 0}
+        self._stats_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/search'
+
+    def count(self, key: str):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def start(self) -> 'ReplayServer':
+        self._thread = threading.Thread(target=self.serve_forever, name='wb-replay-server')
+        self._thread.daemon = True
+        self._thread.start()
+        self.logger.info(f"[ReplayServer] Заглушка поиска WB запущена на {self.url} (ответы из {self.fixtures_dir})")
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> 'ReplayServer':
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def list_recorded_queries(fixtures_dir: str = DEFAULT_FIXTURES_DIR):
+    """Запросы, для которых есть записанные ответы"""
+    if not os.path.isdir(fixtures_dir):
+        return []
+    return sorted(unquote(name) for name in os.listdir(fixtures_dir)
+                  if os.path.isdir(os.path.join(fixtures_dir, name)))
@@ -0,0 +1,710 @@
+import argparse
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+import logging
+from clickhouse_pool import CLICKHOUSE_POOL, ClickHousePool
+
+# Схема базы wildberries в ClickHouse, которой управляет ParserWB.
+# Изменения оформляются миграциями MIGRATIONS: номер версии, описание и список DDL.
+# Примененные версии записываются в wildberries.schema_migrations,
+# migrate() применяет только недостающие по порядку номеров.
+# Уже выпущенную миграцию не меняют — добавляют следующую.
+# Шаг миграции — DDL или функция от пула для шагов, которым нужны данные сервера.
+# Миграции применяются только явно, шагом развертывания: python schema.py migrate.
+# Обходы и чтения схему не меняют, а лишь проверяют ее версию (schema_version)
+#
+# Хранение в режиме storage_mode='delta':
+# редко меняющиеся атрибуты товара пишутся в справочник wildberries.products
+# только при изменении, а при каждом обходе — лишь временной ряд wildberries.positions.
+# Представление wildberries.data_joined собирает из них строки в формате wildberries.data,
+# атрибуты товара берутся из словаря wildberries.products_dict (миграция 6)
+#
+# Таблицы для чтения без сканирования сырых срезов заполняются материализованными
+# представлениями из wildberries.data и wildberries.positions:
+# wildberries.latest_positions — последняя запись по (query, articul),
+# wildberries.positions_hourly/positions_daily — агрегаты позиции и цены по часам/дням
+
+# Сколько дней хранятся сырые срезы и почасовые агрегаты, дневные агрегаты хранятся без ограничения
+RAW_TTL_DAYS = 180
+HOURLY_TTL_DAYS = 365
+
+# Порядок столбцов таблицы wildberries.data
+DATA_COLUMNS = (
+    'articul', 'query', 'created_at', 'name', 'brand', 'price', 'logistics',
+    'reviewRating', 'number_of_feedbacks', 'totalQuantity', 'viewFlags', 'pics',
+    'supplierFlags', 'supplierRating', 'dist', 'promotion', 'tp', 'promoTextCard',
+    'cpm', 'promoPosition', 'position', 'colors',
+)
+# Оценки модели, которые пишутся рядом с сырыми строками (миграция 5, см. conversion_model.py)
+SCORE_COLUMNS = ('predicted_conversion',)
+# Столбцы, которые записываются при каждом обходе: сырые данные среза и оценки
+SNAPSHOT_COLUMNS = DATA_COLUMNS + SCORE_COLUMNS
+# Порядок столбцов справочника товаров
+PRODUCT_COLUMNS = (
+    'articul', 'updated_at', 'name', 'brand', 'viewFlags', 'pics',
+    'supplierFlags', 'supplierRating', 'colors',
+)
+# Порядок столбцов временного ряда позиций
+POSITION_COLUMNS = (
+    'articul', 'query', 'created_at', 'price', 'logistics', 'reviewRating',
+    'number_of_feedbacks', 'totalQuantity', 'dist', 'promotion', 'tp',
+    'promoTextCard', 'cpm', 'promoPosition', 'position', 'predicted_conversion',
+)
+# Заголовки столбцов, с которыми работает research.ipynb, в порядке выгрузки
+# (см. exporter.py, history_frame.py)
+NOTEBOOK_COLUMNS = (
+    ('articul', 'id'),
+    ('name', 'название'),
+    ('brand', 'бренд'),
+    ('price', 'цена (руб.)'),
+    ('logistics', 'стоимость доставки'),
+    ('reviewRating', 'рейтинг'),
+    ('number_of_feedbacks', 'количество отзывов'),
+    ('totalQuantity', 'в наличии'),
+    ('viewFlags', 'количество просмотров'),
+    ('pics', 'количество картинок'),
+    ('supplierFlags', 'уровень продавца'),
+    ('supplierRating', 'рейтинг продавца'),
+    ('dist', 'расстояние до товара'),
+    ('promotion', 'участвует в продвижении?'),
+    ('tp', 'тип рекламы'),
+    ('promoTextCard', 'рекламный слоган'),
+    ('cpm', 'ставка за тысячу показов'),
+    ('promoPosition', 'место товара при продвижении'),
+    ('position', 'место товара без продвижения'),
+    ('colors', 'количество цветов'),
+)
+# Дополнительные столбцы выгрузки истории: по ним различаются замеры
+META_COLUMNS = (
+    ('query', 'запрос'),
+    ('created_at', 'время замера'),
+)
+# Заглушки, которыми парсер заполняет отсутствующие значения.
+# В выгрузке они становятся пустыми ячейками, как в исходной таблице тетрадки
+MISSING_VALUES = {
+    'name': ('no name',),
+    'brand': ('no brand',),
+    'promotion': ('no promotion', 'None', ''),
+    'tp': ('no tp',),
+    'promoTextCard': ('no promo',),
+    'promoPosition': (-1,),
+}
+SOURCE_TABLES = {'full': 'wildberries.data', 'delta': 'wildberries.positions'}
+ROLLUP_TABLES = {
+    'hour': ('wildberries.positions_hourly', 'toStartOfHour'),
+    'day': ('wildberries.positions_daily', 'toStartOfDay'),
+}
+# Позиция с учетом продвижения, как ее показывает выдача
+POSITION_WITH_PROMO = (
+    "toInt64(ifNull(if(promotion = 'no promotion' OR promotion = '', position, promoPosition), -1))"
+)
+
+
+def insert_sql(table: str, columns: Sequence[str]) -> str:
+    """INSERT с явным списком столбцов, чтобы вставка не зависела от их порядка в таблице"""
+    return f"INSERT INTO {table} ({', '.join(columns)}) VALUES"
+
+
+CREATE_MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS wildberries.schema_migrations
+(
+    version UInt32,
+    description String,
+    applied_at DateTime
+)
+ENGINE = MergeTree
+ORDER BY version
+"""
+
+
+# Ключи wildberries.data, с которыми ее создает миграция 1 (как их показывает system.tables)
+DATA_SORTING_KEY = 'query, articul, created_at'
+DATA_PARTITION_KEY = 'toYYYYMM(created_at)'
+
+
+def _create_data(table: str) -> str:
+    """
+    Сырые срезы выдачи, столбцы в порядке DATA_COLUMNS.
+    Ключ сортировки повторяет основной доступ: товар по запросу за период
+    """
+    return f"""
+CREATE TABLE IF NOT EXISTS {table}
+(
+    articul UInt64 CODEC(Delta, ZSTD(1)),
+    query LowCardinality(String),
+    created_at DateTime CODEC(DoubleDelta, ZSTD(1)),
+    name String CODEC(ZSTD(3)),
+    brand LowCardinality(String),
+    price Int64 CODEC(T64, ZSTD(1)),
+    logistics Int64 CODEC(T64, ZSTD(1)),
+    reviewRating Float64 CODEC(Gorilla, ZSTD(1)),
+    number_of_feedbacks Int64 CODEC(T64, ZSTD(1)),
+    totalQuantity Int64 CODEC(T64, ZSTD(1)),
+    viewFlags Int64 CODEC(T64, ZSTD(1)),
+    pics Int64 CODEC(T64, ZSTD(1)),
+    supplierFlags Int64 CODEC(T64, ZSTD(1)),
+    supplierRating Float64 CODEC(Gorilla, ZSTD(1)),
+    dist Int64 CODEC(T64, ZSTD(1)),
+    promotion LowCardinality(String),
+    tp LowCardinality(Nullable(String)),
+    promoTextCard LowCardinality(String),
+    cpm Nullable(Float64) CODEC(ZSTD(1)),
+    promoPosition Nullable(Int64) CODEC(ZSTD(1)),
+    position Nullable(Int64) CODEC(ZSTD(1)),
+    colors Int64 CODEC(T64, ZSTD(1))
+)
+ENGINE = MergeTree
+PARTITION BY toYYYYMM(created_at)
+ORDER BY (query, articul, created_at)
+TTL created_at + INTERVAL {RAW_TTL_DAYS} DAY
+"""
+
+
+CREATE_PRODUCTS = """
+CREATE TABLE IF NOT EXISTS wildberries.products
+(
+    articul UInt64,
+    updated_at DateTime,
+    name String CODEC(ZSTD(3)),
+    brand LowCardinality(String),
+    viewFlags Int64 CODEC(T64, ZSTD(1)),
+    pics Int64 CODEC(T64, ZSTD(1)),
+    supplierFlags Int64 CODEC(T64, ZSTD(1)),
+    supplierRating Float64 CODEC(Gorilla, ZSTD(1)),
+    colors Int64 CODEC(T64, ZSTD(1))
+)
+ENGINE = ReplacingMergeTree(updated_at)
+ORDER BY articul
+"""
+
+CREATE_POSITIONS = f"""
+CREATE TABLE IF NOT EXISTS wildberries.positions
+(
+    articul UInt64 CODEC(Delta, ZSTD(1)),
+    query LowCardinality(String),
+    created_at DateTime CODEC(DoubleDelta, ZSTD(1)),
+    price Int64 CODEC(T64, ZSTD(1)),
+    logistics Int64 CODEC(T64, ZSTD(1)),
+    reviewRating Float64 CODEC(Gorilla, ZSTD(1)),
+    number_of_feedbacks Int64 CODEC(T64, ZSTD(1)),
+    totalQuantity Int64 CODEC(T64, ZSTD(1)),
+    dist Int64 CODEC(T64, ZSTD(1)),
+    promotion LowCardinality(String),
+    tp LowCardinality(Nullable(String)),
+    promoTextCard LowCardinality(String),
+    cpm Nullable(Float64) CODEC(ZSTD(1)),
+    promoPosition Nullable(Int64) CODEC(ZSTD(1)),
+    position Nullable(Int64) CODEC(ZSTD(1))
+)
+ENGINE = MergeTree
+PARTITION BY toYYYYMM(created_at)
+ORDER BY (query, articul, created_at)
+TTL created_at + INTERVAL {RAW_TTL_DAYS} DAY
+"""
+
+# Столбцы и их порядок совпадают с wildberries.data, поэтому запросы
+# к истории и последней записи работают с представлением без изменений
+CREATE_DATA_JOINED = """
+CREATE VIEW IF NOT EXISTS wildberries.data_joined AS
+SELECT
+    p.articul AS articul, p.query AS query, p.created_at AS created_at,
+    d.name AS name, d.brand AS brand,
+    p.price AS price, p.logistics AS logistics, p.reviewRating AS reviewRating,
+    p.number_of_feedbacks AS number_of_feedbacks, p.totalQuantity AS totalQuantity,
+    d.viewFlags AS viewFlags, d.pics AS pics, d.supplierFlags AS supplierFlags,
+    d.supplierRating AS supplierRating,
+    p.dist AS dist, p.promotion AS promotion, p.tp AS tp, p.promoTextCard AS promoTextCard,
+    p.cpm AS cpm, p.promoPosition AS promoPosition, p.position AS position,
+    d.colors AS colors
+FROM wildberries.positions AS p
+LEFT JOIN
+(
+    SELECT
+        articul,
+        argMax(name, updated_at) AS name,
+        argMax(brand, updated_at) AS brand,
+        argMax(viewFlags, updated_at) AS viewFlags,
+        argMax(pics, updated_at) AS pics,
+        argMax(supplierFlags, updated_at) AS supplierFlags,
+        argMax(supplierRating, updated_at) AS supplierRating,
+        argMax(colors, updated_at) AS colors
+    FROM wildberries.products
+    GROUP BY articul
+) AS d USING (articul)
+"""
+
+# Сколько секунд словарь атрибутов товара может отставать от справочника (мин., макс.)
+PRODUCTS_DICT_LIFETIME = (30, 60)
+
+# Последние атрибуты каждого товара: источник словаря wildberries.products_dict
+CREATE_PRODUCTS_LATEST = """
+CREATE VIEW IF NOT EXISTS wildberries.products_latest AS
+SELECT
+    articul,
+    argMax(name, updated_at) AS name,
+    argMax(brand, updated_at) AS brand,
+    argMax(viewFlags, updated_at) AS viewFlags,
+    argMax(pics, updated_at) AS pics,
+    argMax(supplierFlags, updated_at) AS supplierFlags,
+    argMax(supplierRating, updated_at) AS supplierRating,
+    argMax(colors, updated_at) AS colors
+FROM wildberries.products
+GROUP BY articul
+"""
+
+# Последние атрибуты каждого товара в памяти сервера. Справочник агрегируется один раз
+# при обновлении словаря, а строки wildberries.data_joined получают атрибуты
+# поиском по ключу (dictGet), а не GROUP BY по всему справочнику в каждом запросе.
+# Источник — таблица того же сервера без USER/PASSWORD: словарь читает ее от имени
+# пользователя default, и пароль не попадает в system.dictionaries, SHOW CREATE и журнал запросов
+CREATE_PRODUCTS_DICT = f"""
+CREATE DICTIONARY IF NOT EXISTS wildberries.products_dict
+(
+    articul UInt64,
+    name String,
+    brand String,
+    viewFlags Int64,
+    pics Int64,
+    supplierFlags Int64,
+    supplierRating Float64,
+    colors Int64
+)
+PRIMARY KEY articul
+SOURCE(CLICKHOUSE(DB 'wildberries' TABLE 'products_latest'))
+LIFETIME(MIN {PRODUCTS_DICT_LIFETIME[0]} MAX {PRODUCTS_DICT_LIFETIME[1]})
+LAYOUT(HASHED())
+"""
+
+
+def _product_attribute(name: str) -> str:
+    return f"dictGet('wildberries.products_dict', '{name}', p.articul) AS {name}"
+
+
+# Те же столбцы, что и у CREATE_DATA_JOINED, но атрибуты товара читаются из словаря.
+# Товар, которого еще нет в словаре, получает пустые атрибуты, как при LEFT JOIN
+CREATE_DATA_JOINED_DICT = f"""
+CREATE OR REPLACE VIEW wildberries.data_joined AS
+SELECT
+    p.articul AS articul, p.query AS query, p.created_at AS created_at,
+    {_product_attribute('name')}, {_product_attribute('brand')},
+    p.price AS price, p.logistics AS logistics, p.reviewRating AS reviewRating,
+    p.number_of_feedbacks AS number_of_feedbacks, p.totalQuantity AS totalQuantity,
+    {_product_attribute('viewFlags')}, {_product_attribute('pics')},
+    {_product_attribute('supplierFlags')}, {_product_attribute('supplierRating')},
+    p.dist AS dist, p.promotion AS promotion, p.tp AS tp, p.promoTextCard AS promoTextCard,
+    p.cpm AS cpm, p.promoPosition AS promoPosition, p.position AS position,
+    {_product_attribute('colors')}
+FROM wildberries.positions AS p
+"""
+
+CREATE_LATEST_POSITIONS = """
+CREATE TABLE IF NOT EXISTS wildberries.latest_positions
+(
+    query LowCardinality(String),
+    articul UInt64,
+    created_at DateTime,
+    position Int64,
+    price Int64,
+    number_of_feedbacks Int64,
+    reviewRating Float64,
+    promoTextCard String,
+    name String,
+    brand LowCardinality(String)
+)
+ENGINE = ReplacingMergeTree(created_at)
+ORDER BY (query, articul)
+"""
+
+
+def _create_rollup(table: str, ttl_days: Optional[int]) -> str:
+    ttl = f"TTL bucket + INTERVAL {ttl_days} DAY" if ttl_days else ""
+    return f"""
+CREATE TABLE IF NOT EXISTS {table}
+(
+    query LowCardinality(String),
+    articul UInt64,
+    bucket DateTime,
+    avg_position AggregateFunction(avg, Int64),
+    min_position SimpleAggregateFunction(min, Int64),
+    max_position SimpleAggregateFunction(max, Int64),
+    avg_price AggregateFunction(avg, Int64),
+    feedbacks SimpleAggregateFunction(max, Int64)
+)
+ENGINE = AggregatingMergeTree
+PARTITION BY toYYYYMM(bucket)
+ORDER BY (query, articul, bucket)
+{ttl}
+"""
+
+
+def _view_name(target: str, mode: str) -> str:
+    return f"{target}_from_{mode}_mv"
+
+
+def _latest_select(mode: str) -> str:
+    # В режиме 'delta' название и бренд лежат в справочнике wildberries.products
+    names = "name, brand" if mode == 'full' else "'' AS name, '' AS brand"
+    return f"""
+SELECT
+    query, articul, created_at,
+    {POSITION_WITH_PROMO} AS position,
+    toInt64(price) AS price,
+    toInt64(number_of_feedbacks) AS number_of_feedbacks,
+    toFloat64(reviewRating) AS reviewRating,
+    promoTextCard,
+    {names}
+FROM {SOURCE_TABLES[mode]}
+"""
+
+
+def _rollup_select(mode: str, bucket_function: str, where: str = "") -> str:
+    return f"""
+SELECT
+    query, articul,
+    {bucket_function}(created_at) AS bucket,
+    avgState(position_with_promo) AS avg_position,
+    min(position_with_promo) AS min_position,
+    max(position_with_promo) AS max_position,
+    avgState(toInt64(price)) AS avg_price,
+    max(toInt64(number_of_feedbacks)) AS feedbacks
+FROM
+(
+    SELECT query, articul, created_at, price, number_of_feedbacks,
+           {POSITION_WITH_PROMO} AS position_with_promo
+    FROM {SOURCE_TABLES[mode]}
+    {where}
+)
+GROUP BY query, articul, bucket
+"""
+
+
+# Границы переноса истории в агрегаты миграции 4: по строке на представление
+# при его создании и еще одна после переноса
+CREATE_SCHEMA_BACKFILLS = """
+CREATE TABLE IF NOT EXISTS wildberries.schema_backfills
+(
+    view String,
+    cutoff DateTime,
+    backfilled UInt8,
+    recorded_at DateTime64(3)
+)
+ENGINE = MergeTree
+ORDER BY (view, recorded_at)
+"""
+
+
+def _latest_backfill(mode: str) -> str:
+    return f"""
+INSERT INTO wildberries.latest_positions
+SELECT
+    query, articul, max(created_at),
+    argMax(position, created_at), argMax(price, created_at), argMax(number_of_feedbacks, created_at),
+    argMax(reviewRating, created_at), argMax(promoTextCard, created_at),
+    argMax(name, created_at), argMax(brand, created_at)
+FROM ({_latest_select(mode)})
+WHERE created_at <= %(cutoff)s
+GROUP BY query, articul
+"""
+
+
+def _rollup_backfill(table: str, mode: str, bucket_function: str) -> str:
+    return f"INSERT INTO {table} {_rollup_select(mode, bucket_function, 'WHERE created_at <= %(cutoff)s')}"
+
+
+def _record_backfill(pool: ClickHousePool, view: str, cutoff: datetime, backfilled: bool):
+    pool.execute(
+        "INSERT INTO wildberries.schema_backfills (view, cutoff, backfilled, recorded_at) VALUES",
+        [(view, cutoff, int(backfilled), datetime.now())]
+    )
+
+
+def _materialize(target: str, mode: str, select: str, backfill: str) -> Callable[[ClickHousePool], None]:
+    """
+    Шаг миграции: материализованное представление из исходной таблицы режима mode
+    в target и перенос истории, записанной до его создания.
+    Граница переноса — последний created_at исходной таблицы, прочитанный прямо перед
+    созданием представления: строки до нее переносятся, более поздние считает представление.
+    Граница записывается в wildberries.schema_backfills до создания представления, поэтому
+    повторная попытка миграции переносит историю с той же границей, а уже выполненный
+    перенос не повторяет. Строки, вставленные между чтением границы и созданием
+    представления, не попадут никуда, поэтому миграцию 4 применяют при остановленных обходах
+    """
+    view = _view_name(target, mode)
+    database, name = view.split('.', 1)
+
+    def step(pool: ClickHousePool):
+        logger = logging.getLogger('WBTrackerBot')
+        exists = pool.execute(
+            "SELECT 1 FROM system.tables WHERE database = %(database)s AND name = %(name)s",
+            {'database': database, 'name': name}
+        )
+        recorded = pool.execute(
+            "SELECT cutoff, backfilled FROM wildberries.schema_backfills "
+            "WHERE view = %(view)s ORDER BY recorded_at DESC LIMIT 1",
+            {'view': view}
+        )
+        if not exists:
+            cutoff = pool.execute(f"SELECT max(created_at) FROM {SOURCE_TABLES[mode]}")[0][0]
+            _record_backfill(pool, view, cutoff, False)
+            pool.execute(f"CREATE MATERIALIZED VIEW IF NOT EXISTS {view} TO {target} AS {select}")
+        elif not recorded:
+            logger.warning(f"[schema] {view} создано без записанной границы, история в {target} не переносится")
+            return
+        elif recorded[0][1]:
+            return
+        else:
+            cutoff = recorded[0][0]
+
+        logger.info(f"[schema] Перенос истории {SOURCE_TABLES[mode]} в {target} до {cutoff}")
+        pool.execute(backfill, {'cutoff': cutoff})
+        _record_backfill(pool, view, cutoff, True)
+
+    return step
+
+
+def _materialized_views() -> List[Callable[[ClickHousePool], None]]:
+    steps = []
+    for mode in SOURCE_TABLES:
+        steps.append(_materialize('wildberries.latest_positions', mode, _latest_select(mode), _latest_backfill(mode)))
+        for table, bucket_function in ROLLUP_TABLES.values():
+            steps.append(_materialize(
+                table, mode, _rollup_select(mode, bucket_function), _rollup_backfill(table, mode, bucket_function)
+            ))
+    return steps
+
+
+# Версия схемы, с которой есть wildberries.latest_positions и агрегаты истории
+ROLLUPS_VERSION = 4
+# Версия схемы, с которой в исходных таблицах есть столбец predicted_conversion
+SCORES_VERSION = 5
+# Столбцы, добавленные в таблицы миграциями: имя -> версия схемы, с которой они есть
+COLUMN_VERSIONS = {name: SCORES_VERSION for name in SCORE_COLUMNS}
+
+ADD_PREDICTED_CONVERSION = (
+    "ALTER TABLE {table} ADD COLUMN IF NOT EXISTS predicted_conversion Nullable(Float32) CODEC(ZSTD(1))"
+)
+
+def check_data_layout(pool: ClickHousePool):
+    """
+    Проверяет, что wildberries.data имеет ключи миграции 1. Таблицу, созданную вручную
+    до миграций, migrate не перестраивает: копирование живых данных выполняется только
+    явно (python schema.py rebuild-data, см. rebuild_data), до этого миграции не применяются
+    """
+    result = pool.execute(
+        "SELECT sorting_key, partition_key FROM system.tables WHERE database = 'wildberries' AND name = 'data'"
+    )
+    if result and tuple(result[0]) != (DATA_SORTING_KEY, DATA_PARTITION_KEY):
+        raise RuntimeError(
+            f"wildberries.data создана до миграций (ключ сортировки '{result[0][0]}', партиции "
+            f"'{result[0][1]}'). Остановите обходы и выполните python schema.py rebuild-data"
+        )
+
+
+MigrationStep = Union[str, Callable[[ClickHousePool], None]]
+
+# (версия, описание, шаги)
+MIGRATIONS: Tuple[Tuple[int, str, Sequence[MigrationStep]], ...] = (
+    (1, "raw crawl table wildberries.data", [_create_data('wildberries.data')]),
+    # Новая таблица уже создана миграцией 1 с нужными ключами, а таблица, созданная
+    # вручную до миграций, должна быть перестроена rebuild_data: версия 2 записывается,
+    # только если wildberries.data действительно имеет схему миграции 1
+    (2, "rebuild wildberries.data with (query, articul, created_at) sort key, partitions, TTL and codecs", [
+        check_data_layout,
+    ]),
+    (3, "delta storage: wildberries.products, wildberries.positions, wildberries.data_joined", [
+        CREATE_PRODUCTS, CREATE_POSITIONS, CREATE_DATA_JOINED,
+    ]),
+    (4, "latest positions and hourly/daily rollups", [
+        CREATE_SCHEMA_BACKFILLS,
+        CREATE_LATEST_POSITIONS,
+        _create_rollup(ROLLUP_TABLES['hour'][0], HOURLY_TTL_DAYS),
+        _create_rollup(ROLLUP_TABLES['day'][0], None),
+        *_materialized_views(),
+    ]),
+    (5, "predicted conversion next to raw rows", [
+        ADD_PREDICTED_CONVERSION.format(table=table) for table in SOURCE_TABLES.values()
+    ]),
+    (6, "wildberries.data_joined reads product attributes from wildberries.products_dict", [
+        CREATE_PRODUCTS_LATEST, CREATE_PRODUCTS_DICT, CREATE_DATA_JOINED_DICT,
+    ]),
+)
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+# Блокировки изменений схемы на сервере: миграции и перестройку не выполняют
+# два процесса одновременно, даже запущенные на разных машинах
+CREATE_SCHEMA_LOCKS = """
+CREATE TABLE IF NOT EXISTS wildberries.schema_locks
+(
+    owner String,
+    acquired_at DateTime64(3)
+)
+ENGINE = MergeTree
+ORDER BY (acquired_at, owner)
+"""
+# Через сколько секунд блокировка процесса, который не снял ее (например, был убит), не учитывается
+MIGRATION_LOCK_TTL = 6 * 3600
+# Как часто процесс перепроверяет отставшую версию схемы, сек
+VERSION_RECHECK_INTERVAL = 300
+
+
+@contextmanager
+def migration_lock(pool: ClickHousePool):
+    """
+    Эксклюзивная блокировка изменений схемы в wildberries.schema_locks; второй процесс
+    получает ошибку, а не ждет. Каждый процесс записывает свою строку со временем сервера,
+    блокировку держит самая ранняя из действующих строк, остальные процессы удаляют свою
+    """
+    owner = uuid.uuid4().hex
+    pool.execute("CREATE DATABASE IF NOT EXISTS wildberries")
+    pool.execute(CREATE_SCHEMA_LOCKS)
+    pool.execute("INSERT INTO wildberries.schema_locks SELECT %(owner)s, now64(3)", {'owner': owner})
+    try:
+        holder = pool.execute(
+            "SELECT owner, acquired_at FROM wildberries.schema_locks "
+            "WHERE acquired_at > now64(3) - INTERVAL %(ttl)s SECOND ORDER BY acquired_at, owner LIMIT 1",
+            {'ttl': MIGRATION_LOCK_TTL}
+        )
+        if holder and holder[0][0] != owner:
+            raise RuntimeError(
+                f"Схему wildberries уже изменяет другой процесс (блокировка {holder[0][0]} с {holder[0][1]})"
+            )
+        yield
+    finally:
+        pool.execute(
+            "ALTER TABLE wildberries.schema_locks DELETE WHERE owner = %(owner)s",
+            {'owner': owner}, settings={'mutations_sync': 1}
+        )
+
+
+def applied_version(pool: ClickHousePool) -> int:
+    result = pool.execute("SELECT max(version) FROM wildberries.schema_migrations")
+    return result[0][0] if result else 0
+
+
+def migrate(pool: ClickHousePool = CLICKHOUSE_POOL, target: int = LATEST_VERSION) -> int:
+    """
+    Применяет недостающие миграции до версии target и возвращает текущую версию схемы.
+    Миграция записывается в schema_migrations только после выполнения всех ее шагов.
+    Пока wildberries.data не перестроена rebuild_data, миграции не применяются
+    (в том числе в базе, где версия 2 уже была записана)
+    """
+    logger = logging.getLogger('WBTrackerBot')
+    with migration_lock(pool):
+        pool.execute(CREATE_MIGRATIONS_TABLE)
+
+        check_data_layout(pool)
+        version = applied_version(pool)
+        for migration_version, description, steps in MIGRATIONS:
+            if migration_version <= version or migration_version > target:
+                continue
+            logger.info(f"[schema] Применение миграции {migration_version}: {description}")
+            for step in steps:
+                if callable(step):
+                    step(pool)
+                else:
+                    pool.execute(step)
+            pool.execute(
+                "INSERT INTO wildberries.schema_migrations (version, description, applied_at) VALUES",
+                [(migration_version, description, datetime.now())]
+            )
+            version = migration_version
+
+    _versions.pop(id(pool), None)
+    logger.info(f"[schema] Версия схемы wildberries: {version}")
+    return version
+
+
+def rebuild_data(pool: ClickHousePool = CLICKHOUSE_POOL):
+    """
+    Переносит wildberries.data, созданную вручную до миграций с другим ключом сортировки,
+    в таблицу со схемой миграции 1. Явный шаг обслуживания: обходы на время переноса
+    нужно остановить, иначе строки, вставленные во время копирования, в новую таблицу
+    не попадут. Копируются только столбцы, которые есть в обеих таблицах.
+    Старая таблица не удаляется и остается под именем wildberries.data_before_rebuild
+    """
+    logger = logging.getLogger('WBTrackerBot')
+    with migration_lock(pool):
+        existing = {row[0] for row in pool.execute(
+            "SELECT name FROM system.columns WHERE database = 'wildberries' AND table = 'data'"
+        )}
+        columns = ', '.join(name for name in SNAPSHOT_COLUMNS if name in existing)
+        # Без IF NOT EXISTS: оставшаяся от прерванной перестройки таблица — повод разобраться вручную
+        pool.execute(_create_data('wildberries.data_rebuild').replace('IF NOT EXISTS ', ''))
+        pool.execute(ADD_PREDICTED_CONVERSION.format(table='wildberries.data_rebuild'))
+        logger.info(f"[schema] Копирование wildberries.data ({columns})")
+        pool.execute(f"INSERT INTO wildberries.data_rebuild ({columns}) SELECT {columns} FROM wildberries.data")
+        pool.execute("EXCHANGE TABLES wildberries.data AND wildberries.data_rebuild")
+        pool.execute("RENAME TABLE wildberries.data_rebuild TO wildberries.data_before_rebuild")
+    logger.info("[schema] wildberries.data перестроена, прежняя таблица — wildberries.data_before_rebuild")
+
+
+# id пула -> (версия схемы, время проверки)
+_versions: Dict[int, Tuple[int, float]] = {}
+_versions_lock = threading.Lock()
+
+
+def schema_version(pool: ClickHousePool = CLICKHOUSE_POOL) -> int:
+    """
+    Версия схемы без изменения самой схемы. Результат запоминается для пула;
+    отставшая версия перепроверяется раз в VERSION_RECHECK_INTERVAL секунд,
+    чтобы процесс увидел миграции, примененные без его перезапуска.
+    Если версию узнать не удалось, считается, что миграции не применены
+    """
+    now = time.monotonic()
+    with _versions_lock:
+        cached = _versions.get(id(pool))
+    if cached and (cached[0] >= LATEST_VERSION or now - cached[1] < VERSION_RECHECK_INTERVAL):
+        return cached[0]
+
+    logger = logging.getLogger('WBTrackerBot')
+    try:
+        version = applied_version(pool)
+    except Exception as e:
+        logger.error(f"[schema] Не удалось проверить версию схемы wildberries: {str(e)}")
+        version = 0
+    if version < LATEST_VERSION:
+        logger.warning(
+            f"[schema] Схема wildberries версии {version}, последняя — {LATEST_VERSION}. "
+            "Примените миграции: python schema.py migrate"
+        )
+    with _versions_lock:
+        _versions[id(pool)] = (version, now)
+    return version
+
+
+def writable_columns(pool: ClickHousePool, names: Sequence[str],
+                     columns: Sequence[Sequence]) -> Tuple[Tuple[str, ...], List[Sequence]]:
+    """
+    Оставляет для вставки только столбцы, которые есть в таблице при текущей версии схемы:
+    до применения миграции оценки не записываются, а срез все равно сохраняется
+    """
+    version = schema_version(pool)
+    kept = [i for i, name in enumerate(names) if COLUMN_VERSIONS.get(name, 0) <= version]
+    return tuple(names[i] for i in kept), [columns[i] for i in kept]
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description='Управление схемой wildberries в ClickHouse')
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+    migrate_command = commands.add_parser('migrate', help='применить недостающие миграции')
+    migrate_command.add_argument('--target', type=int, default=LATEST_VERSION)
+    commands.add_parser('rebuild-data', help='перенести созданную вручную wildberries.data (обходы остановить)')
+    commands.add_parser('version', help='показать версию схемы')
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    )
+    if args.command == 'migrate':
+        migrate(target=args.target)
+    elif args.command == 'rebuild-data':
+        rebuild_data()
+    else:
+        print(applied_version(CLICKHOUSE_POOL))
@@ -0,0 +1,200 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+import numpy as np
+
+# Сколько последних срезов выдачи хранится в памяти
+DEFAULT_MAX_QUERIES = 512
+
+# Типы записей журнала изменений
+MOVED = 'moved'
+ENTERED = 'entered'
+EXITED = 'exited'
+PRICE = 'price'
+PROMO = 'promo'
+
+
+class QuerySnapshot:
+    """
+    Срез выдачи по запросу в виде массивов numpy, упорядоченных по позиции.
+    Повторы артикула в выдаче отбрасываются, учитывается первое вхождение
+    """
+    __slots__ = ('created_at', 'ids', 'positions', 'prices', 'promo')
+
+    def __init__(self, ids: np.ndarray, prices: np.ndarray, promo: np.ndarray, created_at: float = None):
+        ids = np.asarray(ids, dtype=np.int64)
+        _, first = np.unique(ids, return_index=True)
+        first.sort()
+        self.created_at = created_at if created_at is not None else time.time()
+        self.ids = ids[first]
+        self.positions = (first + 1).astype(np.int64)
+        self.prices = np.asarray(prices, dtype=np.int64)[first]
+        self.promo = np.asarray(promo, dtype=np.int8)[first]
+
+    @classmethod
+    def from_products(cls, products: List, created_at: float = None) -> 'QuerySnapshot':
+        """Строит срез из списка Item/ProductRecord в порядке выдачи"""
+        count = len(products)
+        return cls(
+            np.fromiter((product.id for product in products), dtype=np.int64, count=count),
+            np.fromiter((product.price for product in products), dtype=np.int64, count=count),
+            np.fromiter((1 if product.log and product.log.get('promotion') else 0 for product in products),
+                        dtype=np.int8, count=count),
+            created_at,
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+
+class SnapshotDiff:
+    """
+    Изменения между двумя срезами выдачи одного запроса.
+    Каждая группа — параллельные массивы numpy:
+    moved (ids, old, new позиции), entered (ids, позиции), exited (ids, прежние позиции),
+    price (ids, old, new цены), promo (ids, old, new флаги продвижения)
+    """
+    __slots__ = ('query', 'created_at', 'moved', 'entered', 'exited', 'price', 'promo')
+
+    def __init__(self, query: str, created_at: float, moved: Tuple, entered: Tuple, exited: Tuple,
+                 price: Tuple, promo: Tuple):
+        self.query = query
+        self.created_at = created_at
+        self.moved = moved
+        self.entered = entered
+        self.exited = exited
+        self.price = price
+        self.promo = promo
+
+    def __len__(self):
+        return (len(self.moved[0]) + len(self.entered[0]) + len(self.exited[0])
+                + len(self.price[0]) + len(self.promo[0]))
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            MOVED: len(self.moved[0]),
+            ENTERED: len(self.entered[0]),
+            EXITED: len(self.exited[0]),
+            PRICE: len(self.price[0]),
+            PROMO: len(self.promo[0]),
+        }
+
+    def to_rows(self) -> List[Tuple[str, int, int, int]]:
+        """
+        Компактный журнал изменений: (тип, артикул, было, стало).
+        Для появившихся товаров было = 0, для выпавших стало = 0
+        """
+        rows = []
+        ids, old, new = self.moved
+        rows.extend(zip([MOVED] * len(ids), ids.tolist(), old.tolist(), new.tolist()))
+        ids, new = self.entered
+        rows.extend(zip([ENTERED] * len(ids), ids.tolist(), [0] * len(ids), new.tolist()))
+        ids, old = self.exited
+        rows.extend(zip([EXITED] * len(ids), ids.tolist(), old.tolist(), [0] * len(ids)))
+        for kind, (ids, old, new) in ((PRICE, self.price), (PROMO, self.promo)):
+            rows.extend(zip([kind] * len(ids), ids.tolist(), old.tolist(), new.tolist()))
+        return rows
+
+    def for_articles(self, articles: Iterable[int]) -> Dict[int, Dict[str, Tuple[int, int]]]:
+        """
+        Изменения только по указанным артикулам:
+        {артикул: {тип: (было, стало)}}, артикулы без изменений не попадают в результат
+        """
+        wanted = np.fromiter(set(articles), dtype=np.int64)
+        changes: Dict[int, Dict[str, Tuple[int, int]]] = {}
+        for kind, group in ((MOVED, self.moved), (ENTERED, self.entered), (EXITED, self.exited),
+                            (PRICE, self.price), (PROMO, self.promo)):
+            ids = group[0]
+            mask = np.isin(ids, wanted)
+            if not mask.any():
+                continue
+            if kind == ENTERED:
+                values = zip([0] * int(mask.sum()), group[1][mask].tolist())
+            elif kind == EXITED:
+                values = zip(group[1][mask].tolist(), [0] * int(mask.sum()))
+            else:
+                values = zip(group[1][mask].tolist(), group[2][mask].tolist())
+            for article, value in zip(ids[mask].tolist(), values):
+                changes.setdefault(article, {})[kind] = value
+        return changes
+
+
+def diff_snapshots(query: str, previous: QuerySnapshot, current: QuerySnapshot) -> SnapshotDiff:
+    """
+    Сравнивает два среза выдачи за один векторный проход:
+    артикулы текущего среза ищутся в отсортированных артикулах предыдущего
+    """
+    order = np.argsort(previous.ids, kind='stable')
+    sorted_ids = previous.ids[order]
+
+    index = np.searchsorted(sorted_ids, current.ids)
+    index[index == len(sorted_ids)] = 0
+    found = sorted_ids[index] == current.ids if len(sorted_ids) else np.zeros(len(current.ids), dtype=bool)
+    # Индекс каждого найденного товара текущего среза в предыдущем срезе
+    previous_index = order[index[found]]
+
+    cur_ids = current.ids[found]
+    old_positions = previous.positions[previous_index]
+    new_positions = current.positions[found]
+    moved = old_positions != new_positions
+
+    old_prices = previous.prices[previous_index]
+    new_prices = current.prices[found]
+    price_changed = old_prices != new_prices
+
+    old_promo = previous.promo[previous_index]
+    new_promo = current.promo[found]
+    promo_changed = old_promo != new_promo
+
+    still_present = np.zeros(len(previous.ids), dtype=bool)
+    still_present[previous_index] = True
+
+    return SnapshotDiff(
+        query,
+        current.created_at,
+        moved=(cur_ids[moved], old_positions[moved], new_positions[moved]),
+        entered=(current.ids[~found], current.positions[~found]),
+        exited=(previous.ids[~still_present], previous.positions[~still_present]),
+        price=(cur_ids[price_changed], old_prices[price_changed], new_prices[price_changed]),
+        promo=(cur_ids[promo_changed], old_promo[promo_changed], new_promo[promo_changed]),
+    )
+
+
+class SnapshotStore:
+    """
+    Последний полный срез выдачи по каждому запросу.
+    update() сохраняет новый срез и возвращает изменения относительно предыдущего
+    """
+
+    def __init__(self, max_queries: int = DEFAULT_MAX_QUERIES):
+        self.logger = logging.getLogger('WBTrackerBot')
+        self.max_queries = max_queries
+        self._snapshots: "OrderedDict[str, QuerySnapshot]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query: str) -> Optional[QuerySnapshot]:
+        with self._lock:
+            return self._snapshots.get(query)
+
+    def update(self, query: str, products: List) -> Optional[SnapshotDiff]:
+        """Возвращает None, если предыдущего среза по запросу еще нет"""
+        current = QuerySnapshot.from_products(products)
+        with self._lock:
+            previous = self._snapshots.get(query)
+            self._snapshots[query] = current
+            self._snapshots.move_to_end(query)
+            while len(self._snapshots) > self.max_queries:
+                self._snapshots.popitem(last=False)
+
+        if previous is None:
+            self.logger.info(f"[SnapshotStore] Первый срез по запросу '{query}': {len(current)} товаров")
+            return None
+
+        diff = diff_snapshots(query, previous, current)
+        self.logger.info(f"[SnapshotStore] Изменения по запросу '{query}': {diff.summary()}")
+        return diff
+
+
+SNAPSHOT_STORE = SnapshotStore()
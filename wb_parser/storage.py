@@ -0,0 +1,491 @@
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import logging
+from clickhouse_pool import CLICKHOUSE_POOL, ClickHousePool
+from insert_buffer import DATA_BUFFER, POSITIONS_BUFFER, PRODUCTS_BUFFER
+from schema import (DATA_COLUMNS, POSITION_COLUMNS, PRODUCT_COLUMNS, ROLLUP_TABLES, SCORE_COLUMNS,
+                    ROLLUPS_VERSION, SNAPSHOT_COLUMNS, insert_sql, schema_version, writable_columns)
+from product_dimension import PRODUCT_DIMENSION
+from write_dedup import DEFAULT_DB_PATH, SQLiteDedupStore, dedup_store
+
+# Допустимые детализации истории
+HISTORY_RESOLUTIONS = ('hour', 'day')
+# Режимы хранения срезов в ClickHouse:
+# 'full' — каждый обход целиком пишется в wildberries.data,
+# 'delta' — атрибуты товара в справочник wildberries.products только при изменении,
+# позиции, цены и остатки — во временной ряд wildberries.positions (см. schema.py)
+STORAGE_MODES = ('full', 'delta')
+# Откуда читаются последняя запись товара и история в каждом режиме
+READ_TABLES = {'full': 'wildberries.data', 'delta': 'wildberries.data_joined'}
+HISTORY_TABLES = {'full': 'wildberries.data', 'delta': 'wildberries.positions'}
+
+DEFAULT_SQLITE_PATH = 'wildberries.sqlite3'
+# Сколько строк срезов читается с сервера за раз при выгрузке
+DEFAULT_BATCH_ROWS = 10000
+
+# Строка последней записи товара:
+# (позиция с учетом продвижения, название, бренд, цена, отзывы, рейтинг, промо-текст, время замера)
+LatestRecord = Tuple
+# Строка истории: (позиция, минимальная позиция, максимальная позиция, цена, отзывы, время)
+HistoryRow = Tuple
+
+
+def with_scores(columns: List[Sequence]) -> List[Sequence]:
+    """Дополняет колонки среза пустыми оценками SCORE_COLUMNS, если срез не оценивался"""
+    missing = len(SNAPSHOT_COLUMNS) - len(columns)
+    if missing <= 0:
+        return columns
+    return list(columns) + [[None] * len(columns[0]) for _ in SCORE_COLUMNS[-missing:]]
+
+
+class SnapshotStorage:
+    """
+    Хранилище срезов выдачи, с которым работает ParserWB.
+    Срез передается колонками в порядке schema.DATA_COLUMNS, за которыми
+    могут идти оценки модели SCORE_COLUMNS (без них оценки записываются пустыми).
+    Ошибки записи и массового чтения срезов (iter_snapshots, read_columns) пробрасываются,
+    ошибки остальных чтений логируются и дают пустой результат
+    """
+
+    def insert_snapshot(self, query: str, columns: List[Sequence], on_dropped: Optional[Callable[[], None]] = None):
+        """
+        Записывает срез. Хранилище с буфером вставки вызывает on_dropped,
+        если срез был принят в буфер, но отброшен, так и не попав в базу
+        """
+        raise NotImplementedError
+
+    def latest_record(self, article: int, query: str) -> Optional[LatestRecord]:
+        raise NotImplementedError
+
+    def history(self, article: int, query: str, date_from: datetime,
+                resolution: Optional[str] = None) -> List[HistoryRow]:
+        raise NotImplementedError
+
+    def iter_snapshots(self, query: str, date_from: datetime, date_to: Optional[datetime] = None,
+                       article: Optional[int] = None, batch_size: int = DEFAULT_BATCH_ROWS) -> Iterator[List[Tuple]]:
+        """
+        Отдает строки срезов по запросу за период пачками до batch_size строк.
+        Строки в порядке DATA_COLUMNS, упорядочены по времени замера и позиции.
+        Ошибка чтения пробрасывается, чтобы обрыв выгрузки нельзя было принять за ее конец
+        """
+        raise NotImplementedError
+
+    def write_dedup(self) -> SQLiteDedupStore:
+        """Окно записи срезов этого хранилища (см. write_dedup), создается при первом обращении"""
+        raise NotImplementedError
+
+    def read_columns(self, query: str, date_from: datetime, date_to: Optional[datetime] = None,
+                     article: Optional[int] = None) -> Dict[str, Sequence]:
+        """
+        Читает срезы по запросу за период целиком, по столбцам: {имя из DATA_COLUMNS: значения}.
+        Для массовой загрузки в анализ, где строки не нужны.
+        Ошибка чтения пробрасывается: пустой результат означает, что замеров за период нет
+        """
+        raise NotImplementedError
+
+
+class ClickHouseStorage(SnapshotStorage):
+    """Срезы в ClickHouse (схема и миграции — в schema.py)"""
+
+    def __init__(self, pool: Optional[ClickHousePool] = None, storage_mode: str = 'full', buffered: bool = False):
+        self.logger = logging.getLogger('WBTrackerBot')
+        if storage_mode not in STORAGE_MODES:
+            raise ValueError(f"Неизвестный режим хранения: {storage_mode}")
+        # Соединения с ClickHouse берутся из общего пула только на время запроса
+        self.pool = pool if pool is not None else CLICKHOUSE_POOL
+        self.storage_mode = storage_mode
+        # buffered=True — срез не вставляется сразу, а копится в общем буфере
+        # вместе со срезами других запросов (см. insert_buffer.DATA_BUFFER)
+        self.buffered = buffered
+
+    def write_dedup(self) -> SQLiteDedupStore:
+        # Без локальной записи время последнего среза берется из таблицы режима хранения
+        return dedup_store(DEFAULT_DB_PATH, self.pool, self.storage_mode)
+
+    def _execute_query(self, query, params=None):
+        """Выполняет SQL-запрос к ClickHouse через clickhouse-driver"""
+        try:
+            self.logger.debug(f"[ClickHouseStorage] Выполнение запроса: {query[:100]}... (params: {params})")
+            result = self.pool.execute(query, params)
+            self.logger.debug("[ClickHouseStorage] Запрос выполнен успешно")
+            return result
+        except Exception as e:
+            self.logger.error(f"[ClickHouseStorage] Ошибка выполнения запроса: {str(e)}", exc_info=True)
+            return None
+
+    def _has_rollups(self) -> bool:
+        """Есть ли агрегаты истории. Схема только проверяется: миграции применяются отдельно (schema.py migrate)"""
+        return schema_version(self.pool) >= ROLLUPS_VERSION
+
+    def _first_nonempty(self, queries: List[str], params: Dict) -> List:
+        """Выполняет запросы по очереди и возвращает первый непустой результат"""
+        result = []
+        for query_sql in queries:
+            result = self._execute_query(query_sql, params)
+            if result:
+                break
+        return result
+
+    def insert_snapshot(self, query: str, columns: List[Sequence], on_dropped: Optional[Callable[[], None]] = None):
+        columns = with_scores(columns)
+        rows = len(columns[0])
+        if self.storage_mode == 'delta':
+            self._insert_delta(query, columns, on_dropped)
+        elif self.buffered:
+            DATA_BUFFER.add(columns, on_dropped)
+            self.logger.info(f"[ClickHouseStorage] {rows} записей по запросу '{query}' добавлены в буфер вставки")
+        else:
+            self.logger.info(f"[ClickHouseStorage] Начало вставки {rows} записей в ClickHouse")
+            names, columns = writable_columns(self.pool, SNAPSHOT_COLUMNS, columns)
+            self.pool.execute(
+                insert_sql('wildberries.data', names),
+                columns,
+                columnar=True
+            )
+
+    def _insert_delta(self, query: str, columns: List[Sequence], on_dropped: Optional[Callable[[], None]] = None):
+        """
+        Пишет срез в режиме 'delta': все строки во временной ряд wildberries.positions
+        и только новые или изменившиеся товары в справочник wildberries.products
+        """
+        positions = [columns[SNAPSHOT_COLUMNS.index(name)] for name in POSITION_COLUMNS]
+        # updated_at справочника — время замера среза
+        dimension = [columns[SNAPSHOT_COLUMNS.index('created_at' if name == 'updated_at' else name)]
+                     for name in PRODUCT_COLUMNS]
+        articles = dimension[0]
+        changed = PRODUCT_DIMENSION.changed(articles, list(zip(*dimension[2:])))
+        products = [[column[i] for i in changed] for column in dimension]
+        self.logger.info(
+            f"[ClickHouseStorage] Срез по запросу '{query}': {len(articles)} позиций, "
+            f"{len(changed)} новых или измененных товаров для справочника"
+        )
+
+        if self.buffered:
+            POSITIONS_BUFFER.add(positions, on_dropped)
+            if changed:
+                # Отброшенные при переполнении буфера товары нужно записать при следующем обходе
+                PRODUCTS_BUFFER.add(products, lambda: PRODUCT_DIMENSION.forget(products[0]))
+            return
+        try:
+            names, positions = writable_columns(self.pool, POSITION_COLUMNS, positions)
+            self.pool.execute(insert_sql('wildberries.positions', names), positions, columnar=True)
+            if changed:
+                self.pool.execute(insert_sql('wildberries.products', PRODUCT_COLUMNS), products, columnar=True)
+        except Exception:
+            # Товары не попали в справочник, при следующем обходе их нужно записать снова
+            PRODUCT_DIMENSION.forget(products[0])
+            raise
+
+    def latest_record(self, article: int, query: str) -> Optional[LatestRecord]:
+        """
+        Запись читается точечно из wildberries.latest_positions по ключу (query, articul).
+        Сырые срезы сканируются, только если товара там нет (записан до появления таблицы)
+        """
+        latest_sql = """
+        SELECT
+            position,
+            name,
+            brand,
+            price,
+            number_of_feedbacks,
+            reviewRating,
+            promoTextCard,
+            created_at
+        FROM wildberries.latest_positions
+        WHERE query = %(query)s AND articul = %(article)s
+        ORDER BY created_at DESC
+        LIMIT 1
+        """
+        if self.storage_mode == 'delta':
+            # Название и бренд берутся из справочника тоже точечным чтением по articul
+            latest_sql = """
+            SELECT l.position, d.name, d.brand, l.price, l.number_of_feedbacks,
+                   l.reviewRating, l.promoTextCard, l.created_at
+            FROM (
+                SELECT articul, position, price, number_of_feedbacks, reviewRating, promoTextCard, created_at
+                FROM wildberries.latest_positions
+                WHERE query = %(query)s AND articul = %(article)s
+                ORDER BY created_at DESC
+                LIMIT 1
+            ) AS l
+            LEFT JOIN (
+                SELECT articul, argMax(name, updated_at) AS name, argMax(brand, updated_at) AS brand
+                FROM wildberries.products
+                WHERE articul = %(article)s
+                GROUP BY articul
+            ) AS d USING (articul)
+            """
+
+        query_sql = f"""
+        SELECT
+            if (promotion = 'no promotion' or promotion = '',position,promoPosition) as position_with_promo,
+            name,
+            brand,
+            price,
+            number_of_feedbacks,
+            reviewRating,
+            promoTextCard,
+            created_at
+        FROM {READ_TABLES[self.storage_mode]}
+        WHERE articul = %(article)s AND query = %(query)s
+        ORDER BY created_at DESC
+        LIMIT 1
+        """
+
+        queries = [latest_sql, query_sql] if self._has_rollups() else [query_sql]
+        result = self._first_nonempty(queries, {'article': article, 'query': query})
+        return result[0] if result else None
+
+    def history(self, article: int, query: str, date_from: datetime,
+                resolution: Optional[str] = None) -> List[HistoryRow]:
+        """
+        Агрегаты читаются из готовых таблиц wildberries.positions_hourly/positions_daily.
+        Сырые срезы сканируются только за ту часть периода, которой в агрегатах нет:
+        до первого агрегированного интервала (например, если история агрегатов
+        короче запрошенной или агрегатов еще нет).
+        Из агрегатов берутся только интервалы, целиком входящие в период: интервал,
+        начатый до date_from, считается по сырым срезам с date_from
+        """
+        history_table = HISTORY_TABLES[self.storage_mode]
+        params = {'article': article, 'query': query, 'date_from': date_from}
+        if resolution is None:
+            query_sql = f"""
+            SELECT
+                if (promotion = 'no promotion' or promotion = '',position,promoPosition) as position_with_promo,
+                position_with_promo as min_position,
+                position_with_promo as max_position,
+                price,
+                number_of_feedbacks,
+                created_at
+            FROM {history_table}
+            WHERE articul = %(article)s  AND query = %(query)s
+              AND created_at >= %(date_from)s
+            ORDER BY created_at
+            """
+            return self._execute_query(query_sql, params) or []
+
+        rollup_table, bucket_function = ROLLUP_TABLES[resolution]
+        rows = []
+        if self._has_rollups():
+            rows = self._execute_query(f"""
+            SELECT
+                toInt32(round(avgMerge(avg_position))) as avg_position,
+                min(min_position) as min_position,
+                max(max_position) as max_position,
+                toInt32(round(avgMerge(avg_price))) as avg_price,
+                max(feedbacks) as feedbacks,
+                bucket
+            FROM {rollup_table}
+            WHERE query = %(query)s AND articul = %(article)s
+              AND bucket >= %(date_from)s
+            GROUP BY bucket
+            ORDER BY bucket
+            """, params) or []
+        # Агрегаты покрывают период с начала первого интервала
+        if rows and rows[0][5] <= date_from:
+            return rows
+
+        conditions = "articul = %(article)s  AND query = %(query)s AND created_at >= %(date_from)s"
+        if rows:
+            conditions += " AND created_at < %(covered_from)s"
+            params['covered_from'] = rows[0][5]
+        raw_rows = self._execute_query(f"""
+            SELECT
+                toInt32(round(avg(position_with_promo))) as avg_position,
+                min(position_with_promo) as min_position,
+                max(position_with_promo) as max_position,
+                toInt32(round(avg(price))) as avg_price,
+                max(number_of_feedbacks) as feedbacks,
+                {bucket_function}(created_at) as bucket
+            FROM (
+                SELECT
+                    if (promotion = 'no promotion' or promotion = '',position,promoPosition) as position_with_promo,
+                    price,
+                    number_of_feedbacks,
+                    created_at
+                FROM {history_table}
+                WHERE {conditions}
+            )
+            GROUP BY bucket
+            ORDER BY bucket
+            """, params) or []
+        return raw_rows + rows
+
+    def _snapshots_sql(self, date_to: Optional[datetime], article: Optional[int]) -> str:
+        conditions = ['query = %(query)s', 'created_at >= %(date_from)s']
+        if date_to is not None:
+            conditions.append('created_at < %(date_to)s')
+        if article is not None:
+            conditions.append('articul = %(article)s')
+        return f"""
+        SELECT {', '.join(DATA_COLUMNS)}
+        FROM {READ_TABLES[self.storage_mode]}
+        WHERE {' AND '.join(conditions)}
+        ORDER BY created_at, position
+        """
+
+    def iter_snapshots(self, query: str, date_from: datetime, date_to: Optional[datetime] = None,
+                       article: Optional[int] = None, batch_size: int = DEFAULT_BATCH_ROWS) -> Iterator[List[Tuple]]:
+        sql = self._snapshots_sql(date_to, article)
+        params = {'query': query, 'date_from': date_from, 'date_to': date_to, 'article': article}
+        batch = []
+        for row in self.pool.execute_iter(sql, params, settings={'max_block_size': batch_size}):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def read_columns(self, query: str, date_from: datetime, date_to: Optional[datetime] = None,
+                     article: Optional[int] = None) -> Dict[str, Sequence]:
+        params = {'query': query, 'date_from': date_from, 'date_to': date_to, 'article': article}
+        # use_numpy: драйвер отдает столбцы массивами numpy прямо из блоков Native, без кортежей строк
+        columns = self.pool.execute(self._snapshots_sql(date_to, article), params,
+                                    columnar=True, settings={'use_numpy': True})
+        if not columns:
+            return {name: [] for name in DATA_COLUMNS}
+        return dict(zip(DATA_COLUMNS, columns))
+
+
+class SQLiteStorage(SnapshotStorage):
+    """
+    Встроенное хранилище срезов в файле SQLite для запусков без сервера ClickHouse:
+    локальной отладки, замеров производительности и небольших установок.
+    Таблица data повторяет столбцы wildberries.data
+    """
+
+    # Типы столбцов data в порядке SNAPSHOT_COLUMNS
+    COLUMN_TYPES = (
+        'INTEGER', 'TEXT', 'TIMESTAMP', 'TEXT', 'TEXT', 'INTEGER', 'INTEGER',
+        'REAL', 'INTEGER', 'INTEGER', 'INTEGER', 'INTEGER',
+        'INTEGER', 'REAL', 'INTEGER', 'TEXT', 'TEXT', 'TEXT',
+        'REAL', 'INTEGER', 'INTEGER', 'INTEGER', 'REAL',
+    )
+    # Начало интервала в формате времени SQLite
+    BUCKET_FORMATS = {'hour': '%Y-%m-%d %H:00:00', 'day': '%Y-%m-%d 00:00:00'}
+    POSITION_WITH_PROMO = (
+        "CASE WHEN promotion = 'no promotion' OR promotion = '' THEN position ELSE promoPosition END"
+    )
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH):
+        self.logger = logging.getLogger('WBTrackerBot')
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            columns = ', '.join(f'{name} {column_type}' for name, column_type in zip(SNAPSHOT_COLUMNS, self.COLUMN_TYPES))
+            conn.execute(f'CREATE TABLE IF NOT EXISTS data ({columns})')
+            # Файлы, созданные до появления оценок, дополняются недостающими столбцами
+            existing = {row[1] for row in conn.execute('PRAGMA table_info(data)')}
+            for name, column_type in zip(SNAPSHOT_COLUMNS, self.COLUMN_TYPES):
+                if name not in existing:
+                    conn.execute(f'ALTER TABLE data ADD COLUMN {name} {column_type}')
+            conn.execute('CREATE INDEX IF NOT EXISTS data_query_articul ON data (query, articul, created_at)')
+
+    def _connect(self) -> sqlite3.Connection:
+        # Соединение sqlite3 нельзя делить между потоками, держим по одному на поток
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, detect_types=sqlite3.PARSE_DECLTYPES)
+            self._local.conn = conn
+        return conn
+
+    def write_dedup(self) -> SQLiteDedupStore:
+        # Окно записи лежит в том же файле, что и срезы, в таблице last_writes
+        return dedup_store(self.path)
+
+    def insert_snapshot(self, query: str, columns: List[Sequence], on_dropped: Optional[Callable[[], None]] = None):
+        # Срез записывается сразу, отбрасывать его некому
+        placeholders = ', '.join('?' * len(SNAPSHOT_COLUMNS))
+        with self._connect() as conn:
+            conn.executemany(
+                f"INSERT INTO data ({', '.join(SNAPSHOT_COLUMNS)}) VALUES ({placeholders})",
+                zip(*with_scores(columns))
+            )
+        self.logger.info(f"[SQLiteStorage] Сохранено {len(columns[0])} записей по запросу '{query}'")
+
+    def latest_record(self, article: int, query: str) -> Optional[LatestRecord]:
+        try:
+            return self._connect().execute(
+                f"""
+                SELECT {self.POSITION_WITH_PROMO}, name, brand, price, number_of_feedbacks,
+                       reviewRating, promoTextCard, created_at
+                FROM data
+                WHERE query = ? AND articul = ?
+                ORDER BY created_at DESC
+                LIMIT 1
+                """,
+                (query, article)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self.logger.error(f"[SQLiteStorage] Ошибка при поиске товара {article}: {str(e)}", exc_info=True)
+            return None
+
+    def history(self, article: int, query: str, date_from: datetime,
+                resolution: Optional[str] = None) -> List[HistoryRow]:
+        if resolution is None:
+            sql = f"""
+            SELECT {self.POSITION_WITH_PROMO} AS position_with_promo,
+                   {self.POSITION_WITH_PROMO}, {self.POSITION_WITH_PROMO},
+                   price, number_of_feedbacks, created_at
+            FROM data
+            WHERE query = ? AND articul = ? AND created_at >= ?
+            ORDER BY created_at
+            """
+        else:
+            sql = f"""
+            SELECT CAST(round(avg(position_with_promo)) AS INTEGER), min(position_with_promo),
+                   max(position_with_promo), CAST(round(avg(price)) AS INTEGER),
+                   max(number_of_feedbacks), bucket
+            FROM (
+                SELECT {self.POSITION_WITH_PROMO} AS position_with_promo, price, number_of_feedbacks,
+                       strftime('{self.BUCKET_FORMATS[resolution]}', created_at) AS bucket
+                FROM data
+                WHERE query = ? AND articul = ? AND created_at >= ?
+            )
+            GROUP BY bucket
+            ORDER BY bucket
+            """
+        try:
+            rows = self._connect().execute(sql, (query, article, date_from)).fetchall()
+        except sqlite3.Error as e:
+            self.logger.error(f"[SQLiteStorage] Ошибка при получении истории товара {article}: {str(e)}", exc_info=True)
+            return []
+        if resolution is not None:
+            # strftime возвращает строку, приводим начало интервала к datetime как в ClickHouse
+            rows = [row[:5] + (datetime.fromisoformat(row[5]),) for row in rows]
+        return rows
+
+    def iter_snapshots(self, query: str, date_from: datetime, date_to: Optional[datetime] = None,
+                       article: Optional[int] = None, batch_size: int = DEFAULT_BATCH_ROWS) -> Iterator[List[Tuple]]:
+        conditions = ['query = ?', 'created_at >= ?']
+        params = [query, date_from]
+        if date_to is not None:
+            conditions.append('created_at < ?')
+            params.append(date_to)
+        if article is not None:
+            conditions.append('articul = ?')
+            params.append(article)
+        sql = f"""
+        SELECT {', '.join(DATA_COLUMNS)}
+        FROM data
+        WHERE {' AND '.join(conditions)}
+        ORDER BY created_at, position
+        """
+        cursor = self._connect().execute(sql, params)
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                return
+            yield batch
+
+    def read_columns(self, query: str, date_from: datetime, date_to: Optional[datetime] = None,
+                     article: Optional[int] = None) -> Dict[str, Sequence]:
+        columns: List[List] = [[] for _ in DATA_COLUMNS]
+        for batch in self.iter_snapshots(query, date_from, date_to, article):
+            for column, values in zip(columns, zip(*batch)):
+                column.extend(values)
+        return dict(zip(DATA_COLUMNS, columns))
@@ -0,0 +1,304 @@
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+import logging
+from telebot.types import ReplyKeyboardMarkup
+import messages
+
+# Логика бота, общая для синхронной (bot_log.py) и асинхронной (async_bot.py) версий:
+# диалоги с пользователем, отслеживания в памяти и уведомления по результатам проверок.
+# Здесь нет обращений к Telegram, парсеру и TrackingStore: версия бота выполняет
+# возвращенные действия и отправляет сообщения сама, в своем потоке или event loop
+
+ADD_BUTTON = '📊 Добавить товар'
+ANALYTICS_BUTTON = '📈 Аналитика'
+REMOVE_BUTTON = '❌ Удалить отслеживание'
+HISTORY_BUTTON = '📉 История отслеживания'
+BACK_BUTTON = '↩️ Назад'
+# За сколько дней показывается история позиций
+HISTORY_DAYS = 7
+
+# Шаги диалога: чего бот ждет от пользователя следующим сообщением
+STEP_QUERY = 'query'
+STEP_ARTICLE = 'article'
+STEP_FREQUENCY = 'frequency'
+STEP_HISTORY = 'history'
+STEP_REMOVE = 'remove'
+# Подписи кнопок выбора товара на шагах выбора
+SELECTION_PREFIXES = {STEP_HISTORY: 'История', STEP_REMOVE: 'Удалить'}
+SELECTION_PROMPTS = {
+    STEP_HISTORY: "Выберите товар для просмотра истории:\n(Указан артикул и запрос)",
+    STEP_REMOVE: "Выберите товар для удаления отслеживания:\n(Указан артикул и запрос)",
+}
+
+# Действия, которые бот выполняет после ответа на шаг диалога
+ACTION_MENU = 'menu'
+ACTION_HISTORY_MENU = 'history_menu'
+ACTION_TRACK = 'track'
+ACTION_HISTORY = 'history'
+ACTION_REMOVE = 'remove'
+
+# (chat_id, текст)
+Notification = Tuple[int, str]
+# (chat_id, article, query, position) для TrackingStore.update_positions
+PositionUpdate = Tuple[int, int, str, int]
+
+
+class DialogReply(NamedTuple):
+    """Ответ на сообщение пользователя: текст (если есть) и действие бота с аргументами"""
+    text: Optional[str] = None
+    action: Optional[str] = None
+    args: Tuple = ()
+
+
+def check_interval(frequency: int) -> int:
+    """Интервал проверок в секундах для frequency проверок в сутки"""
+    return max(1, 24 // frequency) * 3600
+
+
+def parse_selection(text: str) -> Tuple[int, str]:
+    """Артикул и запрос из кнопки выбора товара вида 'История: 123 (шарф)'"""
+    parts = text.split('(')
+    article = int(parts[0].split(':')[1].strip())
+    query = parts[1].replace(')', '').strip()
+    return article, query
+
+
+def history_chart_args(article: int, query: str, history: List[Dict]) -> Tuple:
+    """Аргументы ChartRenderer.render для истории позиций из get_product_history"""
+    return (
+        article, query,
+        [entry['date'] for entry in history],
+        [entry['position'] for entry in history],
+        [entry['min_position'] for entry in history],
+        [entry['max_position'] for entry in history],
+    )
+
+
+def main_menu_markup() -> ReplyKeyboardMarkup:
+    markup = ReplyKeyboardMarkup(resize_keyboard=True)
+    markup.add(ADD_BUTTON, ANALYTICS_BUTTON)
+    markup.add(REMOVE_BUTTON, HISTORY_BUTTON)
+    return markup
+
+
+def selection_markup(labels: List[str]) -> ReplyKeyboardMarkup:
+    markup = ReplyKeyboardMarkup(resize_keyboard=True, row_width=2)
+    for label in labels:
+        markup.add(label)
+    markup.add(BACK_BUTTON)
+    return markup
+
+
+class Tracker:
+    """
+    Отслеживания пользователей и шаги диалогов в памяти процесса.
+    Методы не блокируются и не обращаются к сети: изменения отслеживаний
+    бот сам сохраняет в TrackingStore
+    """
+
+    def __init__(self):
+        self.logger = logging.getLogger('WBTrackerBot')
+        # структура: {chat_id: {article: {query: {data}}}
+        self.tracked_items: Dict[int, Dict[int, Dict[str, Dict]]] = {}
+        # Следующий шаг диалога: {chat_id: (шаг, данные)}
+        self.steps: Dict[int, Tuple[str, Tuple]] = {}
+
+    # Отслеживания
+
+    def tracked(self, chat_id: int, article: int, query: str) -> Optional[Dict]:
+        return self.tracked_items.get(chat_id, {}).get(article, {}).get(query)
+
+    def track(self, chat_id: int, article: int, query: str, frequency: int, last_position: Optional[int] = None):
+        self.tracked_items.setdefault(chat_id, {}).setdefault(article, {})[query] = {
+            'frequency': frequency,
+            'last_position': last_position
+        }
+
+    def untrack(self, chat_id: int, article: int, query: str) -> bool:
+        """Удаляет отслеживание, возвращает False, если его не было"""
+        queries = self.tracked_items.get(chat_id, {}).get(article)
+        if not queries or query not in queries:
+            return False
+        del queries[query]
+        if not queries:
+            del self.tracked_items[chat_id][article]
+        return True
+
+    def restore(self, rows: Iterable[Tuple[int, int, str, int, Optional[int]]]) -> List[Tuple[int, int, str, int]]:
+        """
+        Загружает отслеживания из TrackingStore.iter_all().
+        Возвращает их для QueryScheduler.add_many: (chat_id, article, query, интервал)
+        """
+        subscriptions = []
+        for chat_id, article, query, frequency, last_position in rows:
+            self.track(chat_id, article, query, frequency, last_position)
+            subscriptions.append((chat_id, article, query, check_interval(frequency)))
+        return subscriptions
+
+    def selection_labels(self, chat_id: int, step: str) -> List[str]:
+        prefix = SELECTION_PREFIXES[step]
+        return [
+            f"{prefix}: {article} ({query})"
+            for article, queries in self.tracked_items.get(chat_id, {}).items()
+            for query in queries
+        ]
+
+    # Диалоги
+
+    def waiting(self, chat_id: int) -> bool:
+        """Ждет ли бот от пользователя ответа на шаг диалога"""
+        return chat_id in self.steps
+
+    def cancel(self, chat_id: int):
+        self.steps.pop(chat_id, None)
+
+    def start_adding(self, chat_id: int) -> str:
+        self.steps[chat_id] = (STEP_QUERY, ())
+        return "Напишите запрос, в котором будет отслеживаться положение товара (например, 'шарф'):"
+
+    def start_selection(self, chat_id: int, step: str) -> Tuple[str, List[str]]:
+        """
+        Начинает выбор товара для истории (STEP_HISTORY) или удаления (STEP_REMOVE).
+        Возвращает текст и подписи кнопок; без отслеживаний кнопок нет и шаг не начинается
+        """
+        labels = self.selection_labels(chat_id, step)
+        if not labels:
+            self.cancel(chat_id)
+            return "У вас нет отслеживаемых товаров.", []
+        self.steps[chat_id] = (step, ())
+        return SELECTION_PROMPTS[step], labels
+
+    def handle(self, chat_id: int, text: Optional[str]) -> DialogReply:
+        """Обрабатывает ответ пользователя на текущий шаг диалога"""
+        step, data = self.steps.pop(chat_id, (None, ()))
+        text = text or ''
+        if step == STEP_QUERY:
+            return self._handle_query(chat_id, text)
+        if step == STEP_ARTICLE:
+            return self._handle_article(chat_id, text, *data)
+        if step == STEP_FREQUENCY:
+            return self._handle_frequency(text, *data)
+        if step in (STEP_HISTORY, STEP_REMOVE):
+            return self._handle_selection(chat_id, step, text)
+        return DialogReply(action=ACTION_MENU)
+
+    def _handle_query(self, chat_id: int, text: str) -> DialogReply:
+        query = text.lower()
+        if query.isdigit():
+            self.logger.warning(f"[Tracker] Пользователь {chat_id} ввел число вместо запроса")
+            return DialogReply(
+                "❌ Вы ввели число (похоже на артикул товара).\n"
+                "Пожалуйста, введите текстовый поисковый запрос (например, 'шарфы', 'зимние куртки')."
+            )
+        if len(query) < 2:
+            self.logger.warning(f"[Tracker] Слишком короткий запрос от пользователя {chat_id}")
+            return DialogReply("❌ Слишком короткий запрос. Введите минимум 2 символа.")
+
+        self.steps[chat_id] = (STEP_ARTICLE, (query,))
+        self.logger.info(f"[Tracker] Запрос '{query}' принят, ожидаем артикул от пользователя {chat_id}")
+        return DialogReply("Теперь отправьте артикул товара WB, который вы хотите отслеживать:")
+
+    def _handle_article(self, chat_id: int, text: str, query: str) -> DialogReply:
+        try:
+            article = int(text)
+        except ValueError:
+            self.logger.warning(f"[Tracker] Некорректный артикул от пользователя {chat_id}")
+            return DialogReply("Некорректный артикул. Попробуйте снова.")
+
+        self.steps[chat_id] = (STEP_FREQUENCY, (query, article))
+        return DialogReply("Укажите периодичность проверок в день (например, 4):")
+
+    def _handle_frequency(self, text: str, query: str, article: int) -> DialogReply:
+        try:
+            frequency = int(text)
+            if frequency < 1 or frequency > 24:
+                raise ValueError("Частота должна быть от 1 до 24 раз в день")
+        except ValueError as e:
+            return DialogReply(f"Ошибка: {str(e)}. Попробуйте снова.")
+        return DialogReply(action=ACTION_TRACK, args=(article, query, frequency))
+
+    def _handle_selection(self, chat_id: int, step: str, text: str) -> DialogReply:
+        if text == BACK_BUTTON:
+            return DialogReply(action=ACTION_MENU)
+        try:
+            article, query = parse_selection(text)
+        except (IndexError, ValueError):
+            # Из истории пользователь возвращается к выбору товара, из удаления — в меню
+            return DialogReply(
+                "Некорректный формат. Используйте кнопки для выбора.",
+                ACTION_HISTORY_MENU if step == STEP_HISTORY else ACTION_MENU
+            )
+
+        if self.tracked(chat_id, article, query) is None:
+            self.logger.warning(f"[Tracker] Товар {article} не найден для пользователя {chat_id}")
+            return DialogReply(
+                "Товар не найден в вашем списке отслеживания.",
+                None if step == STEP_HISTORY else ACTION_MENU
+            )
+        return DialogReply(action=ACTION_HISTORY if step == STEP_HISTORY else ACTION_REMOVE, args=(article, query))
+
+    # Результаты проверок
+
+    def report_position(self, chat_id: int, article: int, query: str,
+                        result: Optional[Dict]) -> Tuple[Optional[str], Optional[int]]:
+        """
+        Текст уведомления о текущей позиции товара или ее изменении (None, если
+        позиция не изменилась) и текущая позиция (None, если она не определена)
+        """
+        tracked = self.tracked(chat_id, article, query)
+        if tracked is None:
+            self.logger.info(f"[Tracker] Отслеживание товара {article} по запросу '{query}' уже удалено пользователем {chat_id}")
+            return None, None
+
+        if not result:
+            self.logger.warning(f"[Tracker] Товар {article} не найден по запросу '{query}'")
+            return f"❌ Товар {article} не найден по запросу '{query}'", None
+
+        current_position = result['position']
+        last_position = tracked.get('last_position')
+        text = None
+        if last_position is None:
+            text = messages.first_position_text(article, query, result)
+            self.logger.info(f"[Tracker] Первая проверка товара {article}: позиция {current_position}")
+        elif current_position != last_position:
+            text = messages.position_change_text(article, query, last_position, result)
+            self.logger.info(f"[Tracker] Изменение позиции товара {article}: {last_position} → {current_position}")
+
+        tracked['last_position'] = current_position
+        return text, current_position
+
+    def check_results(self, query: str, targets: List[Tuple[int, int]], results: Dict[int, Optional[Dict]],
+                      diff=None) -> Tuple[List[Notification], List[PositionUpdate]]:
+        """
+        Разбирает результаты проверки запроса для отслеживаний targets: (chat_id, article).
+        diff — изменения среза выдачи (ParserWB.last_diff), по ним сообщается об изменении
+        цены и продвижения. Возвращает уведомления и позиции для TrackingStore.update_positions
+        """
+        notifications, positions = [], []
+        for chat_id, article in targets:
+            try:
+                text, position = self.report_position(chat_id, article, query, results.get(article))
+            except Exception as e:
+                self.logger.error(f"[Tracker] Ошибка при проверке товара {article}: {str(e)}", exc_info=True)
+                notifications.append((chat_id, f"⚠️ Ошибка при проверке товара {article}: {str(e)}"))
+                continue
+            if text:
+                notifications.append((chat_id, text))
+            if position is not None:
+                positions.append((chat_id, article, query, position))
+
+        if diff is not None:
+            notifications.extend(self.snapshot_changes(query, targets, diff))
+        return notifications, positions
+
+    def snapshot_changes(self, query: str, targets: List[Tuple[int, int]], diff) -> List[Notification]:
+        """Уведомления об изменении цены и продвижения отслеживаемых товаров между срезами выдачи"""
+        changes = diff.for_articles(article for _, article in targets)
+        notifications = []
+        for chat_id, article in targets:
+            article_changes = changes.get(article, {})
+            if 'price' not in article_changes and 'promo' not in article_changes:
+                continue
+            if self.tracked(chat_id, article, query) is None:
+                continue
+            notifications.append((chat_id, messages.snapshot_changes_text(article, query, article_changes)))
+        return notifications
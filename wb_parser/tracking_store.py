@@ -0,0 +1,89 @@
+import sqlite3
+import threading
+import time
+from typing import Iterable, Iterator, Optional, Tuple
+import logging
+
+DEFAULT_DB_PATH = 'tracking.sqlite3'
+# Сколько строк читается за раз при восстановлении отслеживаний
+LOAD_BATCH_SIZE = 5000
+
+
+class TrackingStore:
+    """
+    Хранилище отслеживаний пользователей в SQLite.
+    Каждая строка — отслеживание артикула пользователем по запросу с частотой
+    проверок и последней известной позицией
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH):
+        self.logger = logging.getLogger('WBTrackerBot')
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS subscriptions (
+                chat_id INTEGER NOT NULL,
+                article INTEGER NOT NULL,
+                query TEXT NOT NULL,
+                frequency INTEGER NOT NULL,
+                last_position INTEGER,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (chat_id, article, query)
+            );
+            CREATE INDEX IF NOT EXISTS subscriptions_query ON subscriptions (query);
+            CREATE INDEX IF NOT EXISTS subscriptions_chat_id ON subscriptions (chat_id);
+        ''')
+
+    def _connect(self) -> sqlite3.Connection:
+        # Соединение sqlite3 нельзя делить между потоками, держим по одному на поток
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def add(self, chat_id: int, article: int, query: str, frequency: int):
+        """
+        Добавляет отслеживание или обновляет частоту проверок существующего.
+        Повторно добавленное отслеживание начинается заново, как и в памяти бота
+        (Tracker.track): последняя позиция сбрасывается
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'INSERT INTO subscriptions (chat_id, article, query, frequency, last_position, created_at) '
+                'VALUES (?, ?, ?, ?, NULL, ?) '
+                'ON CONFLICT(chat_id, article, query) DO UPDATE SET frequency = excluded.frequency, last_position = NULL',
+                (chat_id, article, query, frequency, time.time())
+            )
+
+    def remove(self, chat_id: int, article: int, query: str):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                'DELETE FROM subscriptions WHERE chat_id = ? AND article = ? AND query = ?',
+                (chat_id, article, query)
+            )
+
+    def update_positions(self, positions: Iterable[Tuple[int, int, str, Optional[int]]]):
+        """Сохраняет последние позиции одной транзакцией: (chat_id, article, query, position)"""
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                'UPDATE subscriptions SET last_position = ? WHERE chat_id = ? AND article = ? AND query = ?',
+                ((position, chat_id, article, query) for chat_id, article, query, position in positions)
+            )
+
+    def iter_all(self) -> Iterator[Tuple[int, int, str, int, Optional[int]]]:
+        """Отдает все отслеживания пачками: (chat_id, article, query, frequency, last_position)"""
+        cursor = self._connect().execute(
+            'SELECT chat_id, article, query, frequency, last_position FROM subscriptions ORDER BY query'
+        )
+        while True:
+            rows = cursor.fetchmany(LOAD_BATCH_SIZE)
+            if not rows:
+                return
+            yield from rows
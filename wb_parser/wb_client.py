@@ -0,0 +1,119 @@
+import math
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+import requests
+from requests.adapters import HTTPAdapter
+import logging
+from rate_limiter import RateLimiter
+
+SEARCH_URL = 'https://search.wb.ru/exactmatch/ru/common/v9/search'
+# Коды ответа, после которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 30.0
+# Дольше этого Retry-After не соблюдается: ошибочный или враждебный заголовок
+# не должен останавливать все обходы процесса на часы, сек
+DEFAULT_RETRY_AFTER_MAX = 120.0
+DEFAULT_TIMEOUT = 15
+# Размер пула keep-alive соединений к search.wb.ru
+DEFAULT_POOL_SIZE = 32
+# Общий для всех обходов в процессе лимит запросов к поиску WB, запросов/сек
+WB_REQUESTS_PER_SECOND = 10
+
+
+class WBSearchClient:
+    """
+    Клиент поиска WB поверх одной requests.Session с keep-alive.
+    Повторяет запросы при сетевых ошибках и кодах из RETRY_STATUSES с
+    экспоненциальной задержкой и случайным разбросом, учитывает Retry-After
+    (не дольше retry_after_max секунд)
+    """
+
+    def __init__(self, base_url: str = SEARCH_URL, rate_limiter: Optional[RateLimiter] = None,
+                 max_retries: int = DEFAULT_MAX_RETRIES, backoff_base: float = DEFAULT_BACKOFF_BASE,
+                 backoff_max: float = DEFAULT_BACKOFF_MAX, timeout: float = DEFAULT_TIMEOUT,
+                 pool_size: int = DEFAULT_POOL_SIZE, retry_after_max: float = DEFAULT_RETRY_AFTER_MAX):
+        self.logger = logging.getLogger('WBTrackerBot')
+        self.base_url = base_url
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.retry_after_max = retry_after_max
+        self.pool_size = pool_size
+        self.session = self._create_session()
+
+    def _create_session(self):
+        """HTTP-сессия клиента с пулом на pool_size соединений"""
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _retry_after(self, response) -> Optional[float]:
+        """Разбирает заголовок Retry-After (число секунд или HTTP-дата), не больше retry_after_max"""
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:
+                retry_at = parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                return None
+            if retry_at.tzinfo is None:
+                retry_at = retry_at.replace(tzinfo=timezone.utc)
+            seconds = (retry_at - datetime.now(timezone.utc)).total_seconds()
+        if math.isnan(seconds):
+            return None
+        return min(max(0.0, seconds), self.retry_after_max)
+
+    def get(self, params: Dict) -> Optional[requests.Response]:
+        """
+        Выполняет запрос к поиску с повторами.
+        Возвращает последний полученный ответ (в том числе неуспешный) или None,
+        если ни одна попытка не дошла до сервера
+        """
+        response = None
+        for attempt in range(self.max_retries + 1):
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+            except requests.RequestException as e:
+                response = None
+                delay = self._backoff(attempt)
+                self.logger.warning(
+                    f"[WBSearchClient] Ошибка сети (попытка {attempt + 1}): {str(e)}. Повтор через {delay:.1f} с"
+                )
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                retry_after = self._retry_after(response)
+                delay = retry_after if retry_after is not None else self._backoff(attempt)
+                self.logger.warning(
+                    f"[WBSearchClient] Код {response.status_code} (попытка {attempt + 1}). Повтор через {delay:.1f} с"
+                )
+                if response.status_code == 429 and self.rate_limiter is not None:
+                    # Притормаживаем все обходы процесса, а не только текущий:
+                    # ожидание произойдет в rate_limiter.acquire() перед повтором
+                    self.rate_limiter.penalize(delay)
+                    delay = 0
+
+            if attempt < self.max_retries and delay > 0:
+                time.sleep(delay)
+        return response
+
+
+WB_RATE_LIMITER = RateLimiter(WB_REQUESTS_PER_SECOND)
+SEARCH_CLIENT = WBSearchClient(rate_limiter=WB_RATE_LIMITER)
@@ -0,0 +1,149 @@
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+import logging
+from clickhouse_pool import CLICKHOUSE_POOL, ClickHousePool
+from schema import SOURCE_TABLES
+
+# Файл окна записи для хранилища ClickHouse; SQLiteStorage держит окно в своем файле
+DEFAULT_DB_PATH = 'write_dedup.sqlite3'
+
+
+class ClickHouseDedupStore:
+    """
+    Определяет время последней записи по запросу через max(created_at) в таблице,
+    куда пишет режим хранения: wildberries.data ('full') или wildberries.positions ('delta')
+    """
+
+    def __init__(self, pool: ClickHousePool = CLICKHOUSE_POOL, storage_mode: str = 'full'):
+        self.logger = logging.getLogger('WBTrackerBot')
+        self.pool = pool
+        self.table = SOURCE_TABLES[storage_mode]
+
+    def last_write(self, query: str) -> Optional[float]:
+        try:
+            result = self.pool.execute(
+                f"SELECT max(created_at), count() FROM {self.table} WHERE query = %(query)s",
+                {'query': query}
+            )
+        except Exception as e:
+            self.logger.error(f"[ClickHouseDedupStore] Ошибка при запросе времени последней записи: {str(e)}", exc_info=True)
+            return None
+        if not result or not result[0][1]:
+            return None
+        return result[0][0].timestamp()
+
+
+class SQLiteDedupStore:
+    """
+    Время последней записи среза по каждому запросу в локальной базе SQLite.
+    Файл переживает перезапуски и общий для всех процессов на машине: захват
+    окна записи выполняется в транзакции BEGIN IMMEDIATE, поэтому срез по
+    запросу в пределах окна записывает только один процесс.
+    Если по запросу нет локальной записи, время берется из fallback (ClickHouse)
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, fallback: Optional[ClickHouseDedupStore] = None):
+        self.logger = logging.getLogger('WBTrackerBot')
+        self.path = path
+        self.fallback = fallback
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS last_writes (query TEXT PRIMARY KEY, written_at REAL NOT NULL)'
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # Соединение sqlite3 нельзя делить между потоками, держим по одному на поток
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def _local_last_write(self, conn: sqlite3.Connection, query: str) -> Optional[float]:
+        row = conn.execute('SELECT written_at FROM last_writes WHERE query = ?', (query,)).fetchone()
+        return row[0] if row else None
+
+    def last_write(self, query: str) -> Optional[float]:
+        """Возвращает время последней записи по запросу (unix time) или None"""
+        written_at = self._local_last_write(self._connect(), query)
+        if written_at is None and self.fallback is not None:
+            written_at = self.fallback.last_write(query)
+            if written_at is not None:
+                self._connect().execute(
+                    'INSERT OR IGNORE INTO last_writes (query, written_at) VALUES (?, ?)', (query, written_at)
+                )
+        return written_at
+
+    def is_due(self, query: str, interval: float) -> bool:
+        written_at = self.last_write(query)
+        return written_at is None or time.time() - written_at >= interval
+
+    def try_claim(self, query: str, interval: float, now: Optional[float] = None) -> Optional[float]:
+        """
+        Захватывает окно записи по запросу, записывая время now (по умолчанию — текущее).
+        Возвращает время предыдущей записи (0, если ее не было), если окно
+        свободно и захвачено, или None, если срез уже записан в пределах окна
+        """
+        # Запрос к fallback выполняем до транзакции, чтобы не держать блокировку на время сетевого запроса
+        self.last_write(query)
+
+        conn = self._connect()
+        now = time.time() if now is None else now
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            previous = self._local_last_write(conn, query)
+            if previous is not None and now - previous < interval:
+                conn.execute('ROLLBACK')
+                return None
+            conn.execute(
+                'INSERT INTO last_writes (query, written_at) VALUES (?, ?) '
+                'ON CONFLICT(query) DO UPDATE SET written_at = excluded.written_at',
+                (query, now)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return previous or 0.0
+
+    def release(self, query: str, previous: float, claimed_at: Optional[float] = None):
+        """
+        Возвращает окно записи после неудачной вставки.
+        С claimed_at окно возвращается, только если его с тех пор не захватили снова:
+        так отброшенный из буфера старый срез не освобождает окно более нового
+        """
+        conn = self._connect()
+        condition, params = 'query = ?', (query,)
+        if claimed_at is not None:
+            condition, params = 'query = ? AND written_at = ?', (query, claimed_at)
+        if previous:
+            conn.execute(f'UPDATE last_writes SET written_at = ? WHERE {condition}', (previous,) + params)
+        else:
+            conn.execute(f'DELETE FROM last_writes WHERE {condition}', params)
+
+
+# (файл, id пула fallback, режим хранения) -> общее для процесса окно записи
+_stores: Dict[Tuple[str, Optional[int], str], SQLiteDedupStore] = {}
+_stores_lock = threading.Lock()
+
+
+def dedup_store(path: str = DEFAULT_DB_PATH, fallback_pool: Optional[ClickHousePool] = None,
+                storage_mode: str = 'full') -> SQLiteDedupStore:
+    """
+    Окно записи в файле path, общее для всех хранилищ процесса с тем же файлом.
+    Создается при первом обращении, а не при импорте: обходы без записи не создают
+    файл и не обращаются к ClickHouse. fallback_pool — откуда брать время последней
+    записи, если локальной записи по запросу нет (None — только локальный файл),
+    storage_mode — режим хранения ClickHouse, таблицу которого читает fallback
+    """
+    key = (path, id(fallback_pool) if fallback_pool is not None else None, storage_mode)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            fallback = ClickHouseDedupStore(fallback_pool, storage_mode) if fallback_pool is not None else None
+            store = _stores[key] = SQLiteDedupStore(path, fallback)
+        return store